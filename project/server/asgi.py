@@ -0,0 +1,75 @@
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+
+from project.server import create_app
+from project.server.main.logger import get_logger
+from project.server.main.my_elastic import close_async_elastic
+from project.server.main.tasks import create_task_match_async
+
+logger = get_logger(__name__)
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def read_body(receive) -> bytes:
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_json(send, response: dict, status: int) -> None:
+    body = f"{flask_app.json.dumps(response, separators=(',', ':'))}\n".encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    (b'access-control-allow-origin', b'*')]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def run_task_match(receive, send) -> None:
+    try:
+        args = json.loads(await read_body(receive))
+    except ValueError as error:
+        await send_json(send, {'Error': f'Invalid JSON body: {error}'}, 400)
+        return
+    logger.debug(f'/match {args}')
+    try:
+        response = await create_task_match_async(args=args)
+    except Exception as error:
+        logger.exception(f'/match {args} raises an error: {error}')
+        await send_json(send, {'Error': str(error)}, 500)
+        return
+    await send_json(send, response, 202)
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_elastic()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    """ASGI application serving the JSON /match requests with the asynchronous matcher on the event loop,
+    and all the other requests (including the /match file uploads) with the Flask application."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/match':
+        content_type = dict(scope.get('headers', [])).get(b'content-type', b'')
+        if not content_type.startswith(b'multipart/form-data'):
+            await run_task_match(receive, send)
+            return
+    await wsgi_app(scope, receive, send)
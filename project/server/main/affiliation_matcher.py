@@ -1,14 +1,15 @@
+from project.server.main.config import MATCHER_BATCH_SIZE
 from project.server.main.logger import get_logger
-from project.server.main.match_country import match_country
-from project.server.main.match_grid import match_grid
-from project.server.main.match_rnsr import match_rnsr
-from project.server.main.match_ror import match_ror
-from project.server.main.match_paysage import match_paysage
-from project.server.main.my_elastic import MyElastic
+from project.server.main.match_country import match_country, match_country_list
+from project.server.main.match_grid import match_grid, match_grid_list
+from project.server.main.match_rnsr import match_rnsr, match_rnsr_list
+from project.server.main.match_ror import match_ror, match_ror_list
+from project.server.main.match_paysage import match_paysage, match_paysage_list
+from project.server.main.my_elastic import get_elastic
 from project.server.main.utils import chunks
 
 logger = get_logger(__name__)
-client = MyElastic()
+client = get_elastic()
 use_cache = False
 
 
@@ -35,52 +36,67 @@ def get_query_from_affiliation(affiliation):
     return ' '.join(query_elts)
 
 
-def get_country(affiliation):
-    in_cache = False
-    params = {
-        "size": 1,
-        "query": {
-            "term": {
-                "affiliation.keyword": affiliation
+def get_countries(affiliations: list) -> dict:
+    countries_by_affiliation = {}
+    affiliations_to_match = []
+    for affiliation in affiliations:
+        params = {
+            "size": 1,
+            "query": {
+                "term": {
+                    "affiliation.keyword": affiliation
+                }
             }
         }
-    }
-    hits_in_cache = []
-    if use_cache:
-        try:
-            r = client.search(index='bso-cache-country', body=params)
-            hits_in_cache = r['hits']['hits']
-        except:
-            logger.debug("error in search in bso-cache-country")
-    if len(hits_in_cache) >= 1:
-        in_cache = True
-        countries = hits_in_cache[0]['_source']['countries']
-    else:
-        countries = match_country(conditions={'query': affiliation})['results']
-    return {'countries': countries, 'in_cache': in_cache}
+        hits_in_cache = []
+        if use_cache:
+            try:
+                r = client.search(index='bso-cache-country', body=params)
+                hits_in_cache = r['hits']['hits']
+            except:
+                logger.debug("error in search in bso-cache-country")
+        if len(hits_in_cache) >= 1:
+            countries_by_affiliation[affiliation] = {'countries': hits_in_cache[0]['_source']['countries'],
+                                                     'in_cache': True}
+        else:
+            affiliations_to_match.append(affiliation)
+    for affiliations_chunk in chunks(affiliations_to_match, MATCHER_BATCH_SIZE):
+        responses = match_country_list(conditions_list=[{'query': affiliation} for affiliation in affiliations_chunk])
+        for affiliation, response in zip(affiliations_chunk, responses):
+            countries_by_affiliation[affiliation] = {'countries': response['results'], 'in_cache': False}
+    return countries_by_affiliation
 
 
-def get_matches(affiliation, match_types):
+MATCH_FUNCTIONS = {
+    'country': (match_country, match_country_list),
+    'grid': (match_grid, match_grid_list),
+    'rnsr': (match_rnsr, match_rnsr_list),
+    'ror': (match_ror, match_ror_list),
+    'paysage': (match_paysage, match_paysage_list)
+}
+
+
+def format_matches(responses: dict) -> list:
     results = []
     other_ids = []
-    if 'country' in match_types:
-        countries = match_country(conditions={'query': affiliation})
+    if 'country' in responses:
+        countries = responses['country']
         results += [{'id': e, 'type': 'country'} for e in countries['results']]
-    if 'grid' in match_types:
-        grids = match_grid(conditions={'query': affiliation})
+    if 'grid' in responses:
+        grids = responses['grid']
         results += [{'id': e, 'type': 'grid'} for e in grids['results']]
         if 'other_ids' in grids:
             other_ids += grids['other_ids']
-    if 'rnsr' in match_types:
-        rnsrs = match_rnsr(conditions={'query': affiliation})
+    if 'rnsr' in responses:
+        rnsrs = responses['rnsr']
         results += [{'id': e, 'type': 'rnsr'} for e in rnsrs['results']]
         if 'other_ids' in rnsrs:
             other_ids += rnsrs['other_ids']
-    if 'ror' in match_types:
-        rors = match_ror(conditions={'query': affiliation})
+    if 'ror' in responses:
+        rors = responses['ror']
         results += [{'id': e, 'type': 'country'} for e in rors['results']]
-    if 'paysage' in match_types:
-        paysages = match_paysage(conditions={'query': affiliation})
+    if 'paysage' in responses:
+        paysages = responses['paysage']
         results += [{'id': e, 'type': 'paysage'} for e in paysages['results']]
     for r in other_ids:
         if r['type'] in ['siren', 'sirene', 'siret'] and r not in results:
@@ -88,6 +104,27 @@ def get_matches(affiliation, match_types):
     return results
 
 
+def get_matches(affiliation, match_types):
+    responses = {}
+    for match_type in MATCH_FUNCTIONS:
+        if match_type in match_types:
+            match_function = MATCH_FUNCTIONS[match_type][0]
+            responses[match_type] = match_function(conditions={'query': affiliation})
+    return format_matches(responses)
+
+
+def get_matches_list(affiliations: list, match_types: list) -> list:
+    """Same as get_matches, but each matcher percolates all the affiliations in the same requests."""
+    responses = [{} for _ in affiliations]
+    for match_type in MATCH_FUNCTIONS:
+        if match_type in match_types:
+            match_list_function = MATCH_FUNCTIONS[match_type][1]
+            conditions_list = [{'query': affiliation} for affiliation in affiliations]
+            for ix, response in enumerate(match_list_function(conditions_list=conditions_list)):
+                responses[ix][match_type] = response
+    return [format_matches(r) for r in responses]
+
+
 def is_na(x):
     return not(not x)
 
@@ -117,8 +154,7 @@ def enrich_and_filter_publications_by_country(publications: list, countries_to_k
     # Retrieve countries for all publications
     assert(check_matcher_health())
     for all_affiliations_list_chunk in chunks(all_affiliations_list, 1000):
-        for affiliation in all_affiliations_list_chunk:
-            all_affiliations_dict[affiliation] = get_country(affiliation)
+        all_affiliations_dict.update(get_countries(all_affiliations_list_chunk))
         logger.debug(f'{len(all_affiliations_dict)} / {len(all_affiliations_list)} treated in country_matcher')
         if use_cache:
             logger.debug('Loading in cache')
@@ -127,7 +163,11 @@ def enrich_and_filter_publications_by_country(publications: list, countries_to_k
                 if affiliation in all_affiliations_dict and all_affiliations_dict[affiliation]['in_cache'] is False:
                     cache.append({'_index': 'bso-cache-country', 'affiliation': affiliation,
                                   'countries': all_affiliations_dict[affiliation]['countries']})
-            client.parallel_bulk(actions=cache)
+            try:
+                client.parallel_bulk(actions=cache)
+            except Exception as exception:
+                # The cache is only an optimization, its failures do not stop the matching
+                logger.error(f'parallel_bulk bso-cache-country raises an error: {exception}')
     logger.debug('All countries of all affiliations have been retrieved.')
     # Map countries with affiliations
     for publication in publications:
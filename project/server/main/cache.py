@@ -0,0 +1,79 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from project.server.main.config import ALIAS_CACHE_TTL, ANALYZE_CACHE_SIZE, PERCOLATION_CACHE_SIZE, \
+    PERCOLATION_CACHE_TTL
+
+
+class LRUCache:
+    """Thread-safe LRU cache, bounded in number of entries, whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None) -> int:
+        """Remove the entries whose key satisfies the predicate, or all the entries if no predicate is given."""
+        with self._lock:
+            keys = [key for key in self._data if predicate is None or predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        requests = self.hits + self.misses
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / requests if requests else None
+        }
+
+
+# Percolation hits shared by all the matchers of the process, keyed by (alias, index, field, criterion_query)
+percolation_cache = LRUCache(maxsize=PERCOLATION_CACHE_SIZE, ttl=PERCOLATION_CACHE_TTL)
+# Index currently behind each alias, keyed by alias
+aliases_cache = LRUCache(maxsize=10000, ttl=ALIAS_CACHE_TTL)
+# Vocabularies of the criteria of a source, keyed by the index behind the vocabulary alias
+vocabularies_cache = LRUCache(maxsize=100, ttl=PERCOLATION_CACHE_TTL)
+# Tokens of the criterion queries, keyed by (index behind the criterion alias, analyzer, criterion_query)
+analyzed_queries_cache = LRUCache(maxsize=ANALYZE_CACHE_SIZE, ttl=PERCOLATION_CACHE_TTL)
+# Country gazetteers, keyed by the indices behind the aliases they are read from
+gazetteers_cache = LRUCache(maxsize=10, ttl=PERCOLATION_CACHE_TTL)
+# Inputs shared by the loads of several sources, ie. INSEE zone emploi and geonames, cleared at the end of each load
+load_inputs_cache = LRUCache(maxsize=20, ttl=86400)
@@ -1,3 +1,4 @@
+import json
 import os
 import requests
 
@@ -20,21 +21,83 @@ APP_ENV = os.getenv('APP_ENV')
 # Set default config
 APP_ORGA = 'http://185.161.45.213/organizations'
 CHUNK_SIZE = 128
+# Size of the chunks of the dumps downloaded and parsed as streams
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1048576))
+# Cache of the downloaded dumps, stored by sha256 and refreshed with conditional requests. In offline mode, the last
+# downloaded dumps are used without any request
+DOWNLOAD_DIRECTORY = os.getenv('DOWNLOAD_DIRECTORY', '/tmp/affiliation-matcher/downloads')
+DOWNLOAD_OFFLINE = os.getenv('DOWNLOAD_OFFLINE', 'false').lower() == 'true'
+DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', 60))
 ELASTICSEARCH_HOST = 'elasticsearch'
 ELASTICSEARCH_PORT = '9200'
 ELASTICSEARCH_LOGIN = None
 ELASTICSEARCH_PASSWORD = None
+# Settings of the Elasticsearch clients, shared by all the threads of a process
+ELASTICSEARCH_MAXSIZE = int(os.getenv('ELASTICSEARCH_MAXSIZE', 25))
+ELASTICSEARCH_HTTP_COMPRESS = os.getenv('ELASTICSEARCH_HTTP_COMPRESS', 'true').lower() == 'true'
+ELASTICSEARCH_TIMEOUT = int(os.getenv('ELASTICSEARCH_TIMEOUT', 30))
+ELASTICSEARCH_MAX_RETRIES = int(os.getenv('ELASTICSEARCH_MAX_RETRIES', 10))
+
+# Number of sources loaded concurrently, each in its own process holding all its data, or 1 to load them one after
+# another in the process
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', 1))
+# Bulk ingest of the loads: the new indices are created without refresh nor replicas, indexed by BULK_THREAD_COUNT
+# threads in chunks of BULK_CHUNK_SIZE documents, then force merged to LOAD_MAX_NUM_SEGMENTS segments (0 not to merge),
+# given LOAD_NUMBER_OF_REPLICAS replicas and blocked for writes before their aliases are moved
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 500))
+BULK_THREAD_COUNT = int(os.getenv('BULK_THREAD_COUNT', 4))
+LOAD_MAX_NUM_SEGMENTS = int(os.getenv('LOAD_MAX_NUM_SEGMENTS', 1))
+LOAD_NUMBER_OF_REPLICAS = int(os.getenv('LOAD_NUMBER_OF_REPLICAS', 1))
 
 GRID_DUMP_URL = 'https://digitalscience.figshare.com/ndownloader/files/30895309'
 SCANR_DUMP_URL = 'https://scanr-data.s3.gra.io.cloud.ovh.net/production/organizations.jsonl.gz'
 ZONE_EMPLOI_INSEE_DUMP = 'https://www.insee.fr/fr/statistiques/fichier/4652957/ZE2020_au_01-01-2024.zip'
 GEONAMES_DUMP_URL = "https://download.geonames.org/export/dump"
 
-ROR_DUMP_URL = get_last_ror_dump_url()
+# Number of following equivalent strategies groups whose percolations are sent in the same _msearch
+MATCHER_PREFETCH_GROUPS = int(os.getenv('MATCHER_PREFETCH_GROUPS', 0))
+# Number of following equivalent strategies groups evaluated along with the current one, their results used in order
+MATCHER_SPECULATIVE_GROUPS = int(os.getenv('MATCHER_SPECULATIVE_GROUPS', 0))
+# Restrict the percolations of the next criteria of a strategy to the candidates surviving the first ones, at the cost
+# of a round trip per criterion
+MATCHER_CANDIDATE_FILTER = os.getenv('MATCHER_CANDIDATE_FILTER', 'false').lower() == 'true'
+MATCHER_CANDIDATE_FILTER_MAX_TERMS = int(os.getenv('MATCHER_CANDIDATE_FILTER_MAX_TERMS', 1000))
+# Number of hits of a percolation, the next ones being paged with search_after in a point in time up to MATCHER_HIT_MAX
+MATCHER_HIT_BUDGET = int(os.getenv('MATCHER_HIT_BUDGET', 1000))
+# Hit budgets by criterion (ie. grid_cities_by_region) or criterion field (ie. city), as JSON
+MATCHER_HIT_BUDGETS = json.loads(os.getenv('MATCHER_HIT_BUDGETS', '{}'))
+MATCHER_HIT_MAX = int(os.getenv('MATCHER_HIT_MAX', 10000))
+MATCHER_PIT_KEEP_ALIVE = os.getenv('MATCHER_PIT_KEEP_ALIVE', '1m')
+# Skip the percolations whose query has no token in the vocabulary of the criterion, built at load time
+MATCHER_VOCABULARY_FILTER = os.getenv('MATCHER_VOCABULARY_FILTER', 'false').lower() == 'true'
+VOCABULARY_FALSE_POSITIVE_RATE = float(os.getenv('VOCABULARY_FALSE_POSITIVE_RATE', 0.01))
+# Process-wide cache of the criterion queries analyzed for the vocabulary filter
+ANALYZE_CACHE_SIZE = int(os.getenv('ANALYZE_CACHE_SIZE', 20000))
+# Answer the unambiguous country matches in memory, without percolating them
+MATCHER_COUNTRY_GAZETTEER = os.getenv('MATCHER_COUNTRY_GAZETTEER', 'false').lower() == 'true'
+# Time budget of a match in milliseconds, 0 for none: the percolations are given the time left as timeout, and the
+# strategies stop once it is over, the response being flagged as partial
+MATCHER_DEADLINE_MS = int(os.getenv('MATCHER_DEADLINE_MS', 0))
+# Number of affiliations percolated as documents of the same request in /match_list and /enrich_filter
+MATCHER_BATCH_SIZE = int(os.getenv('MATCHER_BATCH_SIZE', 100))
+MATCHER_BATCH_MAX_HITS = int(os.getenv('MATCHER_BATCH_MAX_HITS', 10000))
+# Process-wide cache of the percolations, 0 entries to disable it
+PERCOLATION_CACHE_SIZE = int(os.getenv('PERCOLATION_CACHE_SIZE', 20000))
+PERCOLATION_CACHE_TTL = int(os.getenv('PERCOLATION_CACHE_TTL', 86400))
+# Delay before an alias moved by another process is seen
+ALIAS_CACHE_TTL = int(os.getenv('ALIAS_CACHE_TTL', 60))
+# Cache of the match results shared through Redis, 'redis' or 'none'
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+RESULT_CACHE_BACKEND = os.getenv('RESULT_CACHE_BACKEND')
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 86400))
+
+# In offline mode, the last downloaded ROR dump is used
+ROR_DUMP_URL = None if DOWNLOAD_OFFLINE else get_last_ror_dump_url()
 
 
 if APP_ENV == 'test':
     ELASTICSEARCH_HOST = 'localhost'
+    RESULT_CACHE_BACKEND = RESULT_CACHE_BACKEND or 'none'
 elif APP_ENV == 'development':
     ELASTICSEARCH_HOST = 'elasticsearch'
 elif APP_ENV == 'production':
@@ -44,3 +107,4 @@ elif APP_ENV == 'production':
     ELASTICSEARCH_PASSWORD = os.getenv('ES_PASSWORD_MATCHER')
 else:
     ELASTICSEARCH_URL = f'{ELASTICSEARCH_HOST}:{ELASTICSEARCH_PORT}'
+RESULT_CACHE_BACKEND = RESULT_CACHE_BACKEND or 'redis'
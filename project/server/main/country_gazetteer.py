@@ -0,0 +1,150 @@
+import re
+import threading
+
+from elasticsearch import helpers
+
+from project.server.main.cache import gazetteers_cache
+from project.server.main.elastic_utils import get_index_name, get_synonyms
+from project.server.main.logger import get_logger
+from project.server.main.utils import strip_accents
+from project.server.main.vocabulary import get_percolator_text
+
+logger = get_logger(__name__)
+
+# Percolator indices read by the gazetteer, by kind of value
+GAZETTEER_CRITERIA = {'name': 'country_name', 'alpha3': 'country_alpha3', 'city': 'grid_cities_by_region'}
+ELISION_PATTERN = re.compile(r"\b(?:l|m|t|qu|n|s|j|d|c|jusqu|quoiqu|lorsqu|puisqu)['’]", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r'\w+')
+# Synonyms of the city_analyzer of the grid cities, applied to both the cities and the queries of the city trie
+CITY_SYNONYMS = get_synonyms('common_synonym')
+
+_build_lock = threading.Lock()
+
+
+def get_tokens(text: str, synonyms: dict = None) -> list:
+    # Close to the light and name_analyzer analyzers of the percolators: elision, accents folding and lowercase, then
+    # the synonyms of the analyzer if any
+    tokens = TOKEN_PATTERN.findall(strip_accents(ELISION_PATTERN.sub('', text or '')).lower())
+    if synonyms:
+        tokens = [synonym for token in tokens for synonym in synonyms.get(token, [token])]
+    return tokens
+
+
+class TokenTrie:
+    """Trie of token sequences, each sequence being mapped to a set of values."""
+
+    def __init__(self) -> None:
+        self.root = {}
+        # Sequences by first token, for find_loose
+        self.sequences = {}
+
+    def add(self, tokens: list, value) -> None:
+        tokens = tuple(tokens)
+        if not tokens:
+            return
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        # The None key of a node holds the values of the sequence ending there
+        node.setdefault(None, set()).add(value)
+        self.sequences.setdefault(tokens[0], {}).setdefault(tokens, set()).add(value)
+
+    def find(self, tokens: list) -> set:
+        """Values of the sequences found contiguously in the tokens."""
+        values = set()
+        for start in range(len(tokens)):
+            node = self.root
+            for token in tokens[start:]:
+                node = node.get(token)
+                if node is None:
+                    break
+                values.update(node.get(None, ()))
+        return values
+
+    def find_loose(self, tokens: list) -> set:
+        """Values of the sequences whose tokens are all in the tokens, in any order and at any distance."""
+        tokens = set(tokens)
+        values = set()
+        for token in tokens:
+            for sequence, sequence_values in self.sequences.get(token, {}).items():
+                if tokens.issuperset(sequence):
+                    values.update(sequence_values)
+        return values
+
+
+class CountryGazetteer:
+    """Country names, alpha3 codes and grid cities of a load, answering the queries whose country is unambiguous."""
+
+    def __init__(self, index_date: str = None, entities: dict = None) -> None:
+        self.tries = {kind: TokenTrie() for kind in GAZETTEER_CRITERIA}
+        self.index_date = index_date
+        self.entities = entities if entities is not None else {}
+
+    def add(self, kind: str, text: str, countries: list) -> None:
+        tokens = get_tokens(text, synonyms=CITY_SYNONYMS if kind == 'city' else None)
+        for country in countries:
+            self.tries[kind].add(tokens, country)
+
+    def get_country(self, query: str):
+        """Alpha2 code of the country returned by the default strategies of match_country, or None if they have to
+        be percolated. Only a query holding the name of a single country, and nothing that a previous strategy could
+        match for another country, is answered."""
+        tokens = get_tokens(query)
+        # The ids and codes are matched by the first strategies
+        if any(any(character.isdigit() for character in token) for token in tokens):
+            return None
+        countries = self.tries['name'].find(tokens)
+        if len(countries) != 1:
+            return None
+        # The country names are percolated as sloppy phrases, that could match another country
+        if self.tries['name'].find_loose(tokens) != countries:
+            return None
+        # The strategies on the grid cities and the alpha3 codes come first, and could match another country
+        cities = self.tries['city'].find_loose(get_tokens(query, synonyms=CITY_SYNONYMS))
+        if (cities & self.tries['alpha3'].find_loose(tokens)) - countries:
+            return None
+        return next(iter(countries))
+
+
+def get_gazetteer_version(es, index_prefix: str) -> tuple:
+    return tuple([es.get_index_from_alias(get_index_name(index_name=criterion, source='', index_prefix=index_prefix))
+                  for criterion in GAZETTEER_CRITERIA.values()])
+
+
+def build_gazetteer(es, index_prefix: str) -> CountryGazetteer:
+    """Gazetteer read from the percolators of the country names, alpha3 codes and grid cities, and from the country
+    entities, so that it holds the same data as the percolations."""
+    version = get_gazetteer_version(es=es, index_prefix=index_prefix)
+    entities_index = get_index_name(index_name='entities', source='country', index_prefix=index_prefix)
+    entities = {hit['_id']: hit.get('_source', {}) for hit in helpers.scan(es, index=entities_index,
+                                                                           query={'query': {'match_all': {}}})}
+    # ex: matcher-20240101000000_country_name -> 20240101
+    gazetteer = CountryGazetteer(index_date=version[0].replace('matcher-', '').split('_')[0][0:8], entities=entities)
+    for (kind, criterion), index in zip(GAZETTEER_CRITERIA.items(), version):
+        nb_percolators = 0
+        query = {'query': {'match_all': {}}, '_source': ['query', 'country_alpha2']}
+        for hit in helpers.scan(es, index=index, query=query):
+            percolator_text = get_percolator_text(hit.get('_source', {}).get('query'))
+            if percolator_text is not None:
+                gazetteer.add(kind=kind, text=percolator_text[1], countries=hit['_source'].get('country_alpha2', []))
+                nb_percolators += 1
+        logger.debug(f'{nb_percolators} percolators of {index} added to the country gazetteer')
+    return gazetteer
+
+
+def get_gazetteer(es, index_prefix: str = 'matcher'):
+    """Country gazetteer of the current load, built once per load and process, or None if it cannot be built."""
+    version = get_gazetteer_version(es=es, index_prefix=index_prefix)
+    gazetteer = gazetteers_cache.get(version)
+    if gazetteer is None:
+        with _build_lock:
+            gazetteer = gazetteers_cache.get(version)
+            if gazetteer is None:
+                try:
+                    gazetteer = build_gazetteer(es=es, index_prefix=index_prefix)
+                except Exception as exception:
+                    # Not retried before the expiration of the cache entry, the queries being percolated meanwhile
+                    logger.error(f'build_gazetteer {version} raises an error: {exception}')
+                    gazetteer = False
+                gazetteers_cache.set(version, gazetteer)
+    return gazetteer or None
@@ -0,0 +1,164 @@
+import fcntl
+import hashlib
+import json
+import os
+import requests
+import time
+
+from project.server.main.config import DOWNLOAD_DIRECTORY, DOWNLOAD_OFFLINE, DOWNLOAD_TIMEOUT, STREAM_CHUNK_SIZE
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class DownloadError(Exception):
+    pass
+
+
+def get_file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_json_file(path: str) -> dict:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json_file(path: str, data: dict) -> None:
+    # Written to a temporary file then renamed, so that a reader never sees a partial file
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def get_paths(name: str, directory: str) -> dict:
+    """Paths of the download cache: the artifacts are stored by sha256 of their content, and each name keeps the
+    metadata of its last good artifact, and of its partial download if any."""
+    key = hashlib.sha256(name.encode('utf-8')).hexdigest()
+    for subdirectory in ['objects', 'names', 'partial']:
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+    return {
+        'objects': os.path.join(directory, 'objects'),
+        'names': os.path.join(directory, 'names'),
+        'metadata': os.path.join(directory, 'names', f'{key}.json'),
+        'lock': os.path.join(directory, 'names', f'{key}.lock'),
+        'partial': os.path.join(directory, 'partial', key),
+        'partial_metadata': os.path.join(directory, 'partial', f'{key}.json')
+    }
+
+
+def get_validators(headers) -> dict:
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+
+def get_expected_size(response):
+    # Total size of the artifact, from the Content-Range of a partial response or the Content-Length of a full one
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        total = content_range.rsplit('/', 1)[-1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get('Content-Length')
+    # The size of a compressed transfer is not the size of the artifact
+    if content_length and content_length.isdigit() and not response.headers.get('Content-Encoding'):
+        return int(content_length)
+    return None
+
+
+def remove_unreferenced_object(sha256: str, paths: dict) -> None:
+    for metadata_file in os.listdir(paths['names']):
+        if metadata_file.endswith('.json') and \
+                read_json_file(os.path.join(paths['names'], metadata_file)).get('sha256') == sha256:
+            return
+    try:
+        os.remove(os.path.join(paths['objects'], sha256))
+    except FileNotFoundError:
+        pass
+
+
+def fetch(url: str, name: str, paths: dict, metadata: dict, verify: bool, timeout: int) -> str:
+    """Download the url into the cache, resuming its partial download if any, and return the path of the artifact."""
+    headers = {}
+    partial_metadata = read_json_file(paths['partial_metadata'])
+    partial_size = os.path.getsize(paths['partial']) if os.path.exists(paths['partial']) else 0
+    validator = partial_metadata.get('etag') or partial_metadata.get('last_modified')
+    if partial_size and partial_metadata.get('url') == url and validator:
+        # The rest of the partial download, or the whole artifact if it has changed meanwhile
+        headers['Range'] = f'bytes={partial_size}-'
+        headers['If-Range'] = validator
+    elif metadata.get('url') == url and os.path.exists(os.path.join(paths['objects'], metadata.get('sha256', ''))):
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+    with requests.get(url=url, headers=headers, stream=True, verify=verify, timeout=timeout) as response:
+        if response.status_code == 304:
+            logger.debug(f'{name} not modified since {metadata.get("last_modified") or metadata.get("etag")}')
+            metadata['checked_at'] = time.time()
+            write_json_file(paths['metadata'], metadata)
+            return os.path.join(paths['objects'], metadata['sha256'])
+        response.raise_for_status()
+        resumed = response.status_code == 206
+        if resumed and not response.headers.get('Content-Range', '').startswith(f'bytes {partial_size}-'):
+            os.remove(paths['partial'])
+            raise DownloadError(f'Unexpected range {response.headers.get("Content-Range")} to resume {name}')
+        if resumed:
+            logger.debug(f'resume download of {name} after {partial_size} bytes')
+        else:
+            partial_metadata = {'url': url, **get_validators(response.headers)}
+            write_json_file(paths['partial_metadata'], partial_metadata)
+        expected_size = get_expected_size(response)
+        with open(paths['partial'], 'ab' if resumed else 'wb') as file:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                file.write(chunk)
+    size = os.path.getsize(paths['partial'])
+    if expected_size is not None and size != expected_size:
+        # Kept to be resumed by the next download
+        raise DownloadError(f'Incomplete download of {name}: {size} bytes of {expected_size}')
+    sha256 = get_file_sha256(paths['partial'])
+    os.replace(paths['partial'], os.path.join(paths['objects'], sha256))
+    if os.path.exists(paths['partial_metadata']):
+        os.remove(paths['partial_metadata'])
+    previous_sha256 = metadata.get('sha256')
+    write_json_file(paths['metadata'], {'name': name, 'url': url, 'sha256': sha256, 'size': size,
+                                        'etag': partial_metadata.get('etag'),
+                                        'last_modified': partial_metadata.get('last_modified'),
+                                        'checked_at': time.time()})
+    if previous_sha256 and previous_sha256 != sha256:
+        remove_unreferenced_object(sha256=previous_sha256, paths=paths)
+    logger.debug(f'{name} downloaded from {url}: {size} bytes, sha256 {sha256}')
+    return os.path.join(paths['objects'], sha256)
+
+
+def download(url: str, name: str = None, verify: bool = True, directory: str = DOWNLOAD_DIRECTORY,
+             offline: bool = DOWNLOAD_OFFLINE, timeout: int = DOWNLOAD_TIMEOUT) -> str:
+    """Return the path of the artifact of the url in the download cache, downloaded only if it has changed since the
+    last download of the name (the url by default). In offline mode, or if the download fails, the last good artifact
+    of the name is returned. The returned file is shared, and must not be modified or removed."""
+    name = name or url
+    paths = get_paths(name=name, directory=directory)
+    # A single process downloads a name at a time
+    with open(paths['lock'], 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        metadata = read_json_file(paths['metadata'])
+        last_good_path = os.path.join(paths['objects'], metadata['sha256']) if metadata.get('sha256') else None
+        if last_good_path and not os.path.exists(last_good_path):
+            last_good_path = None
+        if offline:
+            if last_good_path is None:
+                raise DownloadError(f'No artifact of {name} in {directory} for the offline mode')
+            logger.debug(f'offline mode, {name} read from {last_good_path}')
+            return last_good_path
+        try:
+            return fetch(url=url, name=name, paths=paths, metadata=metadata, verify=verify, timeout=timeout)
+        except Exception as error:
+            if last_good_path is None:
+                raise
+            logger.error(f'Error while downloading {name} from {url}, last artifact used: {error}')
+            return last_good_path
@@ -1,3 +1,13 @@
+import hashlib
+import json
+
+from project.server.main.utils import normalize_name
+from project.server.main.vocabulary import get_percolator_text
+
+# Fields of the entities documents, used to enrich the results
+ENTITY_FIELDS = ['name', 'acronym', 'city', 'country']
+
+
 def get_mappings(analyzer) -> dict:
     return {
         'properties': {
@@ -21,6 +31,10 @@ def get_mappings(analyzer) -> dict:
                 'type': 'text',
                 'analyzer': 'keyword'
             },
+            'fingerprint': {
+                'type': 'keyword',
+                'index': False
+            },
             'query': {
                 'type': 'percolator'
             }
@@ -28,11 +42,67 @@ def get_mappings(analyzer) -> dict:
     }
 
 def get_mappings_direct(analyzers) -> dict:
-    mappings= { 'properties': {} }
+    mappings= { 'properties': {'fingerprint': {'type': 'keyword', 'index': False}} }
     for a in analyzers:
         mappings['properties'][a] = { 'type': 'text', 'analyzer': analyzers[a] }
     return mappings
 
+def get_mappings_entities() -> dict:
+    # The entities are only fetched by id, so their fields are not indexed
+    return {'dynamic': False, 'properties': {'id': {'type': 'keyword'}}}
+
+def get_mappings_vocabulary() -> dict:
+    # The vocabularies are read as a whole by the matcher, so their Bloom filters are not indexed
+    return {'dynamic': False, 'properties': {'criterion': {'type': 'keyword'}}}
+
+def get_entities_actions(data: list, index: str, fields: list, id_field: str = 'id') -> list:
+    actions = []
+    for data_point in data:
+        entity_id = data_point[id_field]
+        action = {'_index': index, '_id': entity_id, 'id': entity_id}
+        for field in fields:
+            values = data_point.get(field)
+            if values is None:
+                values = []
+            action[field] = values if isinstance(values, list) else [values]
+        if 'name' in fields:
+            # Names normalized once for all, for the name similarity gate of the matcher
+            action['name_normalized'] = [normalize_name(name) for name in action['name']]
+        actions.append(action)
+    return actions
+
+def get_document_source(action: dict) -> dict:
+    return {key: value for key, value in action.items() if not key.startswith('_') and key != 'fingerprint'}
+
+
+def get_document_id(action: dict) -> str:
+    """Stable id of the document of a bulk action: its own id if any, else derived from its criterion, ie. its index
+    name without prefix, and from its value, ie. the text of its percolator, so that it is kept from a load to the
+    next."""
+    if action.get('_id') is not None:
+        return str(action['_id'])
+    criterion = action['_index'].split('_', 1)[-1]
+    percolator_text = get_percolator_text(action.get('query'))
+    if percolator_text is not None:
+        value = percolator_text[1]
+    else:
+        value = json.dumps(action.get('query', get_document_source(action)), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f'{criterion}|{value}'.encode('utf-8')).hexdigest()
+
+
+def get_document_fingerprint(action: dict) -> str:
+    # The lists of ids are built from sets, so their order changes from a load to another and is not fingerprinted
+    source = {key: sorted(value, key=lambda x: json.dumps(x, sort_keys=True)) if isinstance(value, list) else value
+              for key, value in get_document_source(action).items()}
+    return hashlib.sha256(json.dumps(source, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def add_document_fingerprint(action: dict) -> dict:
+    """Bulk action with a stable id, and the fingerprint of its content to find the documents changed since the last
+    load of the index."""
+    return {**action, '_id': get_document_id(action), 'fingerprint': get_document_fingerprint(action)}
+
+
 def get_tokenizers():
     return {
         'url_tokenizer': {
@@ -105,6 +175,16 @@ def get_filters() -> dict:
     }
 
 
+def get_synonyms(filter_name: str) -> dict:
+    """Tokens replacing each token of the explicit mappings of a synonym filter, ie. {'st': ['saint'], ...}."""
+    synonyms = {}
+    for rule in get_filters()[filter_name]['synonyms']:
+        sources, target = rule.split('=>')
+        for source in sources.split(','):
+            synonyms[source.strip()] = target.split()
+    return synonyms
+
+
 def get_char_filters() -> dict:
     return {
         'remove_char_btw_digits': {
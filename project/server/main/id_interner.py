@@ -0,0 +1,48 @@
+import threading
+import weakref
+
+
+class IdTable:
+    """Two-way mapping between the entity ids of an index version and compact integers."""
+
+    def __init__(self, key) -> None:
+        self.key = key
+        self.ids = {}
+        self.values = []
+        self._lock = threading.Lock()
+
+    def intern(self, values: list) -> frozenset:
+        ids = self.ids
+        missing = [value for value in values if value not in ids]
+        if missing:
+            with self._lock:
+                for value in missing:
+                    if value not in ids:
+                        ids[value] = len(self.values)
+                        self.values.append(value)
+        return frozenset([ids[value] for value in values])
+
+    def lookup(self, int_ids) -> list:
+        """Convert back integers into entity ids, sorted to get a deterministic order."""
+        return sorted([self.values[int_id] for int_id in int_ids])
+
+
+class IdInterner:
+    """Keep the IdTable of each (field, index version) as long as it is used, ie. by a running match or by the
+    integers of a cached percolation, which reference it. A table is thus never recreated while integers it gave are
+    still in use, and a recreated table cannot be mixed up with the previous one."""
+
+    def __init__(self) -> None:
+        self._tables = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get_table(self, key) -> IdTable:
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None:
+                table = IdTable(key)
+                self._tables[key] = table
+            return table
+
+
+id_interner = IdInterner()
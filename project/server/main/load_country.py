@@ -1,9 +1,11 @@
 import pycountry
 
-from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings
+from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings, \
+    get_entities_actions, get_mappings_entities, get_mappings_vocabulary, ENTITY_FIELDS
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
+from project.server.main.my_elastic import get_elastic
 from project.server.main.utils import COUNTRY_SWITCHER
+from project.server.main.vocabulary import get_vocabulary_actions
 
 SOURCE = 'country'
 
@@ -52,9 +54,9 @@ def transform_country_data(raw_data):
     return countries
 
 
-def load_country(index_prefix: str = 'matcher') -> dict:
+def load_country(index_prefix: str = 'matcher', incremental: bool = False) -> dict:
     logger.debug('load country ...')
-    es = MyElastic()
+    es = get_elastic()
     settings = {
         'analysis': {
             'analyzer': get_analyzers(),
@@ -74,7 +76,7 @@ def load_country(index_prefix: str = 'matcher') -> dict:
     for criterion in criteria:
         index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
         analyzer = analyzers[criterion]
-        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings)
+        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings, incremental=incremental)
         es_data[criterion] = {}
     raw_countries = download_country_data()
     countries = transform_country_data(raw_countries)
@@ -105,5 +107,17 @@ def load_country(index_prefix: str = 'matcher') -> dict:
                           'query': {
                               'match_phrase': {'content': {'query': criterion_value, 'analyzer': analyzer, 'slop': 2}}}}
                 actions.append(action)
-    es.parallel_bulk(actions=actions)
+    # One document per entity, fetched by id to enrich the results
+    index = get_index_name(index_name='entities', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_entities(), incremental=incremental)
+    results[index] = len(countries)
+    actions += get_entities_actions(data=countries, index=index,
+                                    id_field='alpha2', fields=[field for field in ENTITY_FIELDS if field in criteria])
+    # Vocabulary of each criterion, used by the matcher to skip the percolations that cannot match
+    index = get_index_name(index_name='vocabulary', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_vocabulary(), incremental=incremental)
+    vocabulary_actions = get_vocabulary_actions(es=es, actions=actions, index=index, index_prefix=index_prefix)
+    results[index] = len(vocabulary_actions)
+    actions += vocabulary_actions
+    es.parallel_bulk(actions=actions, incremental=incremental)
     return results
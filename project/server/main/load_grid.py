@@ -1,34 +1,25 @@
 import json
-import os
-import requests
-import shutil
 
 from elasticsearch.client import IndicesClient
-from tempfile import mkdtemp
 from zipfile import ZipFile
 
-from project.server.main.config import CHUNK_SIZE, GRID_DUMP_URL
-from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings
+from project.server.main.config import GRID_DUMP_URL
+from project.server.main.download import download
+from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings, \
+    get_entities_actions, get_mappings_entities, get_mappings_vocabulary, ENTITY_FIELDS
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
+from project.server.main.my_elastic import get_elastic
 from project.server.main.utils import clean_list, ENGLISH_STOP, FRENCH_STOP, ACRONYM_IGNORED, GEO_IGNORED
+from project.server.main.vocabulary import get_vocabulary_actions
 
 logger = get_logger(__name__)
 SOURCE = 'grid'
 
 def download_data() -> dict:
-    grid_downloaded_file = 'grid_data_dump.zip'
-    grid_unzipped_folder = mkdtemp()
-    response = requests.get(url=GRID_DUMP_URL, stream=True)
-    with open(grid_downloaded_file, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            file.write(chunk)
-    with ZipFile(grid_downloaded_file, 'r') as file:
-        file.extractall(grid_unzipped_folder)
-    with open(f'{grid_unzipped_folder}/grid.json', 'r') as file:
-        data = json.load(file)
-    os.remove(path=grid_downloaded_file)
-    shutil.rmtree(path=grid_unzipped_folder)
+    grid_downloaded_file = download(url=GRID_DUMP_URL, name='grid')
+    with ZipFile(grid_downloaded_file, 'r') as zip_file:
+        with zip_file.open('grid.json', 'r') as file:
+            data = json.load(file)
     return data
 
 
@@ -117,15 +108,40 @@ def transform_data(data: dict) -> list:
                 formatted_data['cities_by_region'] += cities_by_region.get(r, [])
             formatted_data['cities_by_region'] = clean_list(data = formatted_data['cities_by_region'], ignored=GEO_IGNORED)
         res.append(formatted_data)
+    # Ancestors of each grid, so that the matcher removes them from its results without walking the parents
+    ancestors = get_ancestors_closure({formatted_data['id']: formatted_data['parent'] for formatted_data in res})
+    for formatted_data in res:
+        formatted_data['ancestors'] = ancestors[formatted_data['id']]
     return res
 
 
-def load_grid(index_prefix: str = 'matcher') -> dict:
+def get_ancestors_closure(parents: dict) -> dict:
+    """Sorted transitive ancestors of each id, from the parents of each id. The parents of the ids missing from
+    the mapping are unknown, and an id is never its own ancestor, even in a cycle."""
+    closure = {}
+    for entity_id in parents:
+        ancestors = set()
+        stack = list(parents[entity_id])
+        while stack:
+            parent = stack.pop()
+            if parent in ancestors:
+                continue
+            ancestors.add(parent)
+            if parent in closure:
+                ancestors.update(closure[parent])
+            else:
+                stack += parents.get(parent, [])
+        ancestors.discard(entity_id)
+        closure[entity_id] = sorted(ancestors)
+    return closure
+
+
+def load_grid(index_prefix: str = 'matcher', incremental: bool = False) -> dict:
     logger.debug('load grid ...')
     raw_data = download_data()
     transformed_data = transform_data(raw_data)
     
-    es = MyElastic()
+    es = get_elastic()
     # indices_client = IndicesClient(es)
     settings = {
         'analysis': {
@@ -157,7 +173,7 @@ def load_grid(index_prefix: str = 'matcher') -> dict:
     for criterion in criteria:
         index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
         analyzer = analyzers[criterion]
-        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings)
+        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings, incremental=incremental)
         es_data[criterion] = {}
     # Iterate over grid data
     for data_point in transformed_data:
@@ -204,5 +220,17 @@ def load_grid(index_prefix: str = 'matcher') -> dict:
             action['query'] = {'match_phrase': {'content': {'query': criterion_value,
                                                                 'analyzer': analyzer, 'slop': 0}}}
             actions.append(action)
-    es.parallel_bulk(actions=actions)
+    # One document per entity, fetched by id to enrich the results
+    index = get_index_name(index_name='entities', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_entities(), incremental=incremental)
+    results[index] = len(transformed_data)
+    actions += get_entities_actions(data=transformed_data, index=index,
+                                    fields=[field for field in ENTITY_FIELDS if field in criteria] + ['ancestors'])
+    # Vocabulary of each criterion, used by the matcher to skip the percolations that cannot match
+    index = get_index_name(index_name='vocabulary', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_vocabulary(), incremental=incremental)
+    vocabulary_actions = get_vocabulary_actions(es=es, actions=actions, index=index, index_prefix=index_prefix)
+    results[index] = len(vocabulary_actions)
+    actions += vocabulary_actions
+    es.parallel_bulk(actions=actions, incremental=incremental)
     return results
@@ -10,9 +10,13 @@ from project.server.main.elastic_utils import (
     get_filters,
     get_index_name,
     get_mappings,
+    get_mappings_entities,
+    get_mappings_vocabulary,
+    get_entities_actions,
+    ENTITY_FIELDS,
 )
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
+from project.server.main.my_elastic import get_elastic
 from project.server.main.utils import (
     insee_zone_emploi_data,
     get_alpha2_from_french,
@@ -24,6 +28,7 @@ from project.server.main.utils import (
     clean_city,
     normalize_text,
 )
+from project.server.main.vocabulary import get_vocabulary_actions
 
 logger = get_logger(__name__)
 
@@ -51,12 +56,12 @@ CATEGORIES = {
 }
 
 
-def load_paysage(index_prefix: str = "matcher") -> dict:
+def load_paysage(index_prefix: str = "matcher", incremental: bool = False) -> dict:
     """Load paysage data ton elastic indexes"""
 
     logger.debug("Start loading Paysage data...")
 
-    es = MyElastic()
+    es = get_elastic()
     indices_client = IndicesClient(es)
     settings = {
         "analysis": {
@@ -102,7 +107,7 @@ def load_paysage(index_prefix: str = "matcher") -> dict:
     for criterion in criteria:
         index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
         analyzer = analyzers[criterion]
-        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings)
+        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings, incremental=incremental)
         es_data[criterion] = {}
 
     # Download paysage data
@@ -162,8 +167,20 @@ def load_paysage(index_prefix: str = "matcher") -> dict:
                     }
                 }
             actions.append(action)
+    # One document per entity, fetched by id to enrich the results
+    index = get_index_name(index_name="entities", source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_entities(), incremental=incremental)
+    results[index] = len(transformed_data)
+    actions += get_entities_actions(data=transformed_data, index=index,
+                                    fields=[field for field in ENTITY_FIELDS if field in criteria] + ["paysage_categories"])
+    # Vocabulary of each criterion, used by the matcher to skip the percolations that cannot match
+    index = get_index_name(index_name="vocabulary", source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_vocabulary(), incremental=incremental)
+    vocabulary_actions = get_vocabulary_actions(es=es, actions=actions, index=index, index_prefix=index_prefix)
+    results[index] = len(vocabulary_actions)
+    actions += vocabulary_actions
     logger.debug("Start load elastic indexes")
-    es.parallel_bulk(actions=actions)
+    es.parallel_bulk(actions=actions, incremental=incremental)
     return results
 
 
@@ -199,7 +216,7 @@ def download_data() -> list:
     df = pd.DataFrame(data)
     data = (
         df.groupby(by="resourceId")
-        .agg({k: list if k == "relatedObjectId" else "first" for k in df.columns})
+        .agg({k: list if k in ["relatedObjectId", "relatedObject"] else "first" for k in df.columns})
         .to_dict(orient="records")
     )
     logger.debug(f"Keep {len(data)} paysage records without duplicates")
@@ -207,6 +224,28 @@ def download_data() -> list:
     return data
 
 
+def get_categories(record: dict) -> list:
+    """Categories of a paysage record, from the structure-categorie relations aggregated by download_data"""
+    related_object_ids = record.get("relatedObjectId")
+    related_objects = record.get("relatedObject")
+    if not isinstance(related_object_ids, list) or not isinstance(related_objects, list):
+        return []
+    categories = []
+    for related_object_id, related_object in zip(related_object_ids, related_objects):
+        if related_object_id not in CATEGORIES:
+            continue
+        if not isinstance(related_object, dict):
+            related_object = {}
+        category = {
+            "id": related_object_id,
+            "label": related_object.get("displayName"),
+            "priority": related_object.get("priority"),
+        }
+        if category not in categories:
+            categories.append(category)
+    return categories
+
+
 def transform_data(data: list) -> list:
     """Transform paysage data to elastic data"""
 
@@ -312,6 +351,7 @@ def transform_data(data: list) -> list:
         es_record["year"] = years
         es_record["web_url"] = web_urls
         es_record["web_domain"] = web_domains
+        es_record["paysage_categories"] = get_categories(record)
 
         es_records.append(es_record)
 
@@ -1,13 +1,15 @@
 import datetime
-import requests
+import json
 import pandas as pd
 import numpy as np
 from elasticsearch.client import IndicesClient
 
 from project.server.main.config import SCANR_DUMP_URL
-from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings
+from project.server.main.download import download
+from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings, \
+    get_entities_actions, get_mappings_entities, get_mappings_vocabulary, ENTITY_FIELDS
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
+from project.server.main.my_elastic import get_elastic
 from project.server.main.utils import (
     insee_zone_emploi_data,
     get_alpha2_from_french,
@@ -17,6 +19,7 @@ from project.server.main.utils import (
     clean_url,
     get_url_domain,
 )
+from project.server.main.vocabulary import get_vocabulary_actions
 
 logger = get_logger(__name__)
 
@@ -26,19 +29,23 @@ USE_ZONE_EMPLOI_COMPOSITION = False
 
 def download_data() -> list:
     logger.debug(f"download RNSR data from {SCANR_DUMP_URL}")
+    scanr_downloaded_file = download(url=SCANR_DUMP_URL, name='scanr')
     if "jsonl" in SCANR_DUMP_URL:
-        data = pd.read_json(SCANR_DUMP_URL, lines=True).replace(np.nan, None).to_dict(orient="records")
+        # The compression cannot be inferred from the name of the file in the download cache
+        compression = 'gzip' if SCANR_DUMP_URL.endswith('.gz') else None
+        data = pd.read_json(scanr_downloaded_file, lines=True, compression=compression).replace(np.nan, None) \
+            .to_dict(orient="records")
     else:
-        r = requests.get(SCANR_DUMP_URL)
-        data = r.json()
+        with open(scanr_downloaded_file, 'r') as file:
+            data = json.load(file)
     return data
 
 
 RNSR_DATA = download_data()
 
-def load_rnsr(index_prefix: str = 'matcher') -> dict:
+def load_rnsr(index_prefix: str = 'matcher', incremental: bool = False) -> dict:
     logger.debug('load rnsr ...')
-    es = MyElastic()
+    es = get_elastic()
     indices_client = IndicesClient(es)
     settings = {
         'analysis': {
@@ -77,7 +84,7 @@ def load_rnsr(index_prefix: str = 'matcher') -> dict:
     for criterion in criteria:
         index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
         analyzer = analyzers[criterion]
-        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings)
+        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings, incremental=incremental)
         es_data[criterion] = {}
     raw_data = RNSR_DATA
     transformed_data = transform_data(raw_data)
@@ -124,8 +131,20 @@ def load_rnsr(index_prefix: str = 'matcher') -> dict:
                 action['query'] = {'match': {'content': {'query': criterion_value, 'analyzer': analyzer,
                                                          'minimum_should_match': '-10%'}}}
             actions.append(action)
+    # One document per entity, fetched by id to enrich the results
+    index = get_index_name(index_name='entities', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_entities(), incremental=incremental)
+    results[index] = len(transformed_data)
+    actions += get_entities_actions(data=transformed_data, index=index,
+                                    fields=[field for field in ENTITY_FIELDS if field in criteria])
+    # Vocabulary of each criterion, used by the matcher to skip the percolations that cannot match
+    index = get_index_name(index_name='vocabulary', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_vocabulary(), incremental=incremental)
+    vocabulary_actions = get_vocabulary_actions(es=es, actions=actions, index=index, index_prefix=index_prefix)
+    results[index] = len(vocabulary_actions)
+    actions += vocabulary_actions
     logger.debug('load ES')
-    es.parallel_bulk(actions=actions)
+    es.parallel_bulk(actions=actions, incremental=incremental)
     return results
 
 
@@ -1,21 +1,21 @@
-import json
-import os
-import requests
-import shutil
+import io
+import itertools
 
-from tempfile import mkdtemp
 from zipfile import ZipFile
 
-from project.server.main.config import CHUNK_SIZE, ROR_DUMP_URL
-from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings, get_mappings_direct
+from project.server.main.config import ROR_DUMP_URL
+from project.server.main.download import download
+from project.server.main.elastic_utils import get_analyzers, get_tokenizers, get_char_filters, get_filters, get_index_name, get_mappings, get_mappings_direct, \
+    get_entities_actions, get_mappings_entities, get_mappings_vocabulary, ENTITY_FIELDS
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
+from project.server.main.my_elastic import get_elastic
 from project.server.main.utils import (
     insee_zone_emploi_data,
     geonames_french_departments,
     clean_list,
     clean_url,
     get_url_domain,
+    iter_json_array,
     normalize_text,
     ENGLISH_STOP,
     FRENCH_STOP,
@@ -24,46 +24,42 @@ from project.server.main.utils import (
     COUNTRY_SWITCHER,
     CITY_COUNTRY,
 )
+from project.server.main.vocabulary import get_vocabulary_actions
 
 logger = get_logger(__name__)
 
 SOURCE = 'ror'
 SCHEMA_VERSION = "2.0"
 USE_ZONE_EMPLOI_COMPOSITION = False
+# Ids of the entities of a criterion value held by its percolator, besides the ror ids
+OTHER_IDS = ['country_alpha2', 'grids', 'wikidatas']
 
-def download_data() -> list:
+def download_data() -> str:
+    """Download the ROR dump if it has changed, and return the path of its zip file in the download cache."""
     logger.debug(f'download ROR from {ROR_DUMP_URL}')
-    ror_downloaded_file = 'ror_data_dump.zip'
-    ror_unzipped_folder = mkdtemp()
-    response = requests.get(url=ROR_DUMP_URL, stream=True)
+    return download(url=ROR_DUMP_URL, name='ror')
 
-    with open(file=ror_downloaded_file, mode='wb') as file:
-        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            file.write(chunk)
-    with ZipFile(file=ror_downloaded_file, mode='r') as file:
-        file.extractall(ror_unzipped_folder)
 
-    found_version = False
-    for data_file in os.listdir(ror_unzipped_folder):
-        if data_file.endswith('.json'):
-            with open(f'{ror_unzipped_folder}/{data_file}', 'r') as file:
-                data = json.load(file)
+def read_data(ror_downloaded_file: str):
+    """Yield the organizations of the first JSON file of the ROR dump in the SCHEMA_VERSION, parsed incrementally
+    from the zip file without extracting it."""
+    with ZipFile(file=ror_downloaded_file, mode='r') as zip_file:
+        for data_file in zip_file.namelist():
+            if not data_file.endswith('.json'):
+                continue
+            with zip_file.open(data_file, mode='r') as file:
+                rors = iter_json_array(io.TextIOWrapper(file, encoding='utf-8'))
+                first_ror = next(rors, None)
                 # Check schema version
-                if SCHEMA_VERSION == data[0].get("admin", {}).get("last_modified", {}).get("schema_version"):
-                    found_version = True
-                    break
-
-    os.remove(path=ror_downloaded_file)
-    shutil.rmtree(path=ror_unzipped_folder)
-
-    if not found_version:
-        logger.debug(f"Error: ROR schema version {SCHEMA_VERSION} not found in {ROR_DUMP_URL}")
-        data = []
+                if first_ror is not None and \
+                        SCHEMA_VERSION == first_ror.get("admin", {}).get("last_modified", {}).get("schema_version"):
+                    yield first_ror
+                    yield from rors
+                    return
+    logger.debug(f"Error: ROR schema version {SCHEMA_VERSION} not found in {ROR_DUMP_URL}")
 
-    return data
 
-
-def transform_data(rors: list) -> list:
+def transform_data(rors):
     logger.debug('transform data')
 
     # adding zone emploi data for France ie Saint Martin d'hères <-> Grenoble
@@ -72,7 +68,6 @@ def transform_data(rors: list) -> list:
     geonames_departments = geonames_french_departments()
     logger.debug(f"Geonames_departments = {len(geonames_departments)}")
 
-    data = []
     for ror in rors:
         current_id = ror.get('id').replace('https://ror.org/', '')
         current_data = {"id": current_id}
@@ -160,17 +155,52 @@ def transform_data(rors: list) -> list:
         current_data["web_url"] = clean_list(urls)
         current_data["web_domain"] = clean_list(domains)
 
-        data.append(current_data)
+        yield current_data
+
+def aggregate_data(data_points, es_data: dict, criteria: list):
+    """Add the id and the other ids of each data point to the percolators of its criteria values in es_data, and yield
+    it. Only the ids needed by the percolators are kept, as sets."""
+    for data_point in data_points:
+        for criterion in criteria:
+            criterion_values = data_point.get(criterion)
+            if criterion_values is None:
+                if 'city' not in criterion and 'unique' not in criterion:
+                    logger.debug(f"This element {data_point['id']} has no {criterion}")
+                continue
+            if not isinstance(criterion_values, list):
+                criterion_values = [criterion_values]
+            for criterion_value in criterion_values:
+                if criterion_value not in es_data[criterion]:
+                    es_data[criterion][criterion_value] = {'rors': [], **{other_id: set() for other_id in OTHER_IDS}}
+                percolator = es_data[criterion][criterion_value]
+                percolator['rors'].append(data_point.get('id'))
+                percolator['country_alpha2'].update(data_point.get('country_code') or [])
+                for other_id in OTHER_IDS[1:]:
+                    percolator[other_id].update(data_point.get('external_ids', {}).get(other_id) or [])
+        yield data_point
+
+
+def get_percolator_actions(es_data: dict, analyzers: dict, index_prefix: str):
+    for criterion in es_data:
+        logger.debug(f'prep index {criterion}')
+        index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
+        analyzer = analyzers[criterion]
+        for criterion_value, percolator in es_data[criterion].items():
+            action = {'_index': index, 'rors': percolator['rors']}
+            for other_id in OTHER_IDS:
+                if percolator[other_id]:
+                    action[other_id] = list(percolator[other_id])
+            action['query'] = {'match_phrase': {'content': {'query': criterion_value,
+                                                            'analyzer': analyzer, 'slop': 0}}}
+            yield action
 
-    return data
 
-def load_ror(index_prefix: str = 'matcher') -> dict:
+def load_ror(index_prefix: str = 'matcher', incremental: bool = False) -> dict:
     logger.debug('load ROR start')
-    raw_data = download_data()
-    transformed_data = transform_data(raw_data)
+    ror_downloaded_file = download_data()
     # Init ES
     es_data = {}
-    es = MyElastic()
+    es = get_elastic()
     settings = {
         'analysis': {
             'analyzer': get_analyzers(),
@@ -205,77 +235,48 @@ def load_ror(index_prefix: str = 'matcher') -> dict:
     for criterion in criteria:
         index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
         analyzer = analyzers[criterion]
-        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings)
+        es.create_index(index=index, mappings=get_mappings(analyzer), settings=settings, incremental=incremental)
         es_data[criterion] = {}
-    external_ids_label = []
-    # Iterate over ror data
+    # Iterate over ror data, streamed from the zip file: only the percolators and the entities are kept in memory
     logger.debug('iterating over data points')
-    for data_point in transformed_data:
-        for criterion in criteria:
-            criterion_values = data_point.get(criterion)
-            if criterion_values is None:
-                if 'city' not in criterion and 'unique' not in criterion:
-                    logger.debug(f"This element {data_point['id']} has no {criterion}")
-                continue
-            if not isinstance(criterion_values, list):
-                criterion_values = [criterion_values]
-            for criterion_value in criterion_values:
-                if criterion_value not in es_data[criterion]:
-                    es_data[criterion][criterion_value] = []
-                current_elt = { 
-                    'id': data_point.get('id'),
-                    'country_alpha2': data_point.get('country_code')
-                }
-                for ext_id in data_point.get('external_ids', {}):
-                    current_elt[ext_id] = data_point['external_ids'][ext_id]
-                    if ext_id not in external_ids_label:
-                        external_ids_label.append(ext_id)
-                es_data[criterion][criterion_value].append(current_elt)
+    entities_index = get_index_name(index_name='entities', source=SOURCE, index_prefix=index_prefix)
+    entities_fields = [field for field in ENTITY_FIELDS if field in criteria]
+    entities_actions = []
+    load_plain_simple_index = False
+    plain_index = get_index_name(index_name='all', source=SOURCE, index_prefix=index_prefix, simple=True)
+    plain_actions = []
+    for data_point in aggregate_data(transform_data(read_data(ror_downloaded_file)), es_data=es_data,
+                                     criteria=criteria):
+        entities_actions += get_entities_actions(data=[data_point], index=entities_index, fields=entities_fields)
+        if load_plain_simple_index:
+            plain_actions.append({'_index': plain_index, **data_point})
     # add unique criterion
     for criterion in criteria_unique:
         for criterion_value in es_data[criterion]:
-            if len(es_data[criterion][criterion_value]) == 1:
-                if f'{criterion}_unique' not in es_data:
-                    es_data[f'{criterion}_unique'] = {}
+            if len(es_data[criterion][criterion_value]['rors']) == 1:
                 es_data[f'{criterion}_unique'][criterion_value] = es_data[criterion][criterion_value]
-    # Bulk insert data into ES
-    actions = []
+    # Bulk insert data into ES, the actions being generated while they are sent
     results = {}
     for criterion in es_data:
-        logger.debug(f'prep index {criterion}')
         index = get_index_name(index_name=criterion, source=SOURCE, index_prefix=index_prefix)
-        analyzer = analyzers[criterion]
         results[index] = len(es_data[criterion])
-        for criterion_value in es_data[criterion]:
-            action = {
-                '_index': index,
-                'rors': [k['id'] for k in es_data[criterion][criterion_value]],
-            }
-            for other_id in ['country_alpha2', 'grids', 'rors', 'wikidatas']:
-                all_codes = [k.get(other_id) for k in es_data[criterion][criterion_value] if other_id in k]
-                codes = list(set([j for sub in all_codes for j in sub]))
-                if codes:
-                    action[other_id] = codes
-            #if criterion in exact_criteria:
-            #    action['query'] = {
-            #        'match_phrase': {'content': {'query': criterion_value, 'analyzer': analyzer, 'slop': 1}}}
-            #elif criterion in txt_criteria:
-            #    action['query'] = {'match': {'content': {'query': criterion_value, 'analyzer': analyzer,
-            #                                             'minimum_should_match': '-10%'}}}
-            if criterion in criteria:
-                action['query'] = {'match_phrase': {'content': {'query': criterion_value,
-                                                                'analyzer': analyzer, 'slop': 0}}}
-            actions.append(action)
-    load_plain_simple_index = False
     if load_plain_simple_index:
         logger.debug('prep direct index')
-        index = get_index_name(index_name='all', source=SOURCE, index_prefix=index_prefix, simple=True)
-        es.create_index(index=index, mappings=get_mappings_direct(analyzers), settings=settings)
-        results[index] = len(transformed_data)
-        for current_data in transformed_data: 
-            action = { '_index': index }
-            action.update(current_data)
-            actions.append(action)
+        es.create_index(index=plain_index, mappings=get_mappings_direct(analyzers), settings=settings,
+                        incremental=incremental)
+        results[plain_index] = len(plain_actions)
+    # One document per entity, fetched by id to enrich the results
+    es.create_index(index=entities_index, mappings=get_mappings_entities(), incremental=incremental)
+    results[entities_index] = len(entities_actions)
+    # Vocabulary of each criterion, used by the matcher to skip the percolations that cannot match
+    index = get_index_name(index_name='vocabulary', source=SOURCE, index_prefix=index_prefix)
+    es.create_index(index=index, mappings=get_mappings_vocabulary(), incremental=incremental)
+    vocabulary_actions = get_vocabulary_actions(es=es, index=index, index_prefix=index_prefix,
+                                                actions=get_percolator_actions(es_data=es_data, analyzers=analyzers,
+                                                                               index_prefix=index_prefix))
+    results[index] = len(vocabulary_actions)
     logger.debug('bulk insert')
-    es.parallel_bulk(actions=actions)
+    es.parallel_bulk(actions=itertools.chain(
+        get_percolator_actions(es_data=es_data, analyzers=analyzers, index_prefix=index_prefix), plain_actions,
+        entities_actions, vocabulary_actions), incremental=incremental)
     return results
@@ -0,0 +1,136 @@
+import datetime
+import multiprocessing
+import time
+
+from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from project.server.main.cache import load_inputs_cache
+from project.server.main.config import GRID_DUMP_URL, LOAD_WORKERS, ROR_DUMP_URL
+from project.server.main.download import download
+from project.server.main.load_country import load_country
+from project.server.main.load_grid import load_grid
+from project.server.main.load_paysage import load_paysage
+from project.server.main.load_rnsr import load_rnsr
+from project.server.main.load_ror import load_ror
+from project.server.main.load_wikidata import load_wikidata
+from project.server.main.logger import get_logger
+from project.server.main.my_elastic import get_elastic
+from project.server.main.utils import download_geonames_data, download_insee_data, GEONAMES_FRENCH_CODES
+
+logger = get_logger(__name__)
+
+LOADERS = {
+    'country': load_country,
+    'grid': load_grid,
+    'paysage': load_paysage,
+    'rnsr': load_rnsr,
+    'ror': load_ror,
+    'wikidata': load_wikidata
+}
+# Sources loaded by the type all
+ALL_SOURCES = ['country', 'grid', 'rnsr', 'ror', 'paysage']
+# Inputs downloaded in threads before the loads, with the sources using them. The ones parsed by utils are kept in the
+# load_inputs_cache, so they are parsed once and inherited by the processes of the loads
+LOAD_INPUTS = {
+    'grid': (['grid'], partial(download, url=GRID_DUMP_URL, name='grid')),
+    'ror': (['ror'], partial(download, url=ROR_DUMP_URL, name='ror')),
+    'insee_zone_emploi': (['paysage', 'rnsr', 'ror'], download_insee_data),
+    **{f'geonames_{code}': (['ror'], partial(download_geonames_data, country=code)) for code in GEONAMES_FRENCH_CODES}
+}
+
+
+def download_inputs(sources: list) -> None:
+    names = [name for name, (input_sources, _) in LOAD_INPUTS.items() if set(input_sources) & set(sources)]
+    if not names:
+        return
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        futures = {executor.submit(LOAD_INPUTS[name][1]): name for name in names}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as error:
+                # Downloaded again by the loads using it, which handle its errors
+                logger.error(f'Error while downloading {futures[future]}: {error}')
+
+
+def run_load(source: str, index_prefix: str, incremental: bool) -> dict:
+    """Load a source, and return its results, its duration in seconds and its error if any."""
+    start = time.monotonic()
+    try:
+        results = LOADERS[source](index_prefix=index_prefix, incremental=incremental)
+        error = None if results else 'No data loaded'
+    except Exception as exception:
+        logger.error(f'Error while loading {source}: {exception}')
+        results, error = {}, repr(exception)
+    return {'source': source, 'results': results or {}, 'duration': round(time.monotonic() - start, 3),
+            'error': error}
+
+
+def run_loads(sources: list, index_prefix: str, incremental: bool, workers: int):
+    """Yield the loads of the sources as they complete, run in a pool of forked processes, so that they inherit the
+    inputs already downloaded and the data loaded at import."""
+    if workers <= 1 or len(sources) <= 1:
+        for source in sources:
+            yield run_load(source=source, index_prefix=index_prefix, incremental=incremental)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(sources)),
+                             mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = {executor.submit(run_load, source, index_prefix, incremental): source for source in sources}
+        for future in as_completed(futures):
+            try:
+                load = future.result()
+            except Exception as error:
+                # ie. the process of the load has been killed
+                logger.error(f'Error while loading {futures[future]}: {error}')
+                load = {'source': futures[future], 'results': {}, 'duration': None, 'error': repr(error)}
+            yield load
+
+
+def update_source_aliases(es, source: str, index_prefix: str, index_prefix_dated: str, succeeded: bool) -> None:
+    """Move the aliases of the source on its new dated indices if its load succeeded, or delete these indices."""
+    if succeeded:
+        es.finalize_index(index=f'{index_prefix_dated}_{source}_*')
+    for idx in list(es.indices.get(f'{index_prefix_dated}_{source}_*').keys()):
+        if succeeded:
+            es.update_index_alias(my_alias=idx.replace(index_prefix_dated, index_prefix), new_index=idx)
+        else:
+            logger.debug(f'delete index {idx} of the failed load of {source}')
+            es.indices.delete(index=idx, ignore=[400, 404])
+
+
+def load_sources(sources: list, index_prefix: str = 'matcher', incremental: bool = False,
+                 workers: int = LOAD_WORKERS) -> dict:
+    """Load the sources concurrently, the aliases of each source being moved as soon as its load succeeds. Return the
+    results of the loads, and their status, duration and error by source."""
+    es = get_elastic()
+    es.delete_non_dated_indices(index_prefix=index_prefix)
+    if incremental:
+        # the live indices behind the aliases are updated in place, with the documents changed since the last load
+        index_prefix_load = index_prefix
+    else:
+        today = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
+        # the indices are created with the datetime in the name
+        index_prefix_load = f'{index_prefix}-{today}'
+    result = {}
+    report = {}
+    start = time.monotonic()
+    try:
+        download_inputs(sources=sources)
+        logger.debug(f'inputs of {sources} downloaded in {time.monotonic() - start:.1f}s')
+        for load in run_loads(sources=sources, index_prefix=index_prefix_load, incremental=incremental,
+                              workers=workers):
+            source = load['source']
+            result.update(load['results'])
+            if not incremental:
+                update_source_aliases(es=es, source=source, index_prefix=index_prefix,
+                                      index_prefix_dated=index_prefix_load, succeeded=load['error'] is None)
+            report[source] = {'status': 'failed' if load['error'] else 'loaded', 'duration': load['duration']}
+            if load['error']:
+                report[source]['error'] = load['error']
+            logger.debug(f'load of {source}: {report[source]}')
+    finally:
+        load_inputs_cache.invalidate()
+    logger.debug(f'load of {sources} done in {time.monotonic() - start:.1f}s')
+    result['sources'] = report
+    return result
@@ -2,13 +2,13 @@ import requests
 
 from project.server.main.elastic_utils import get_index_name
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
+from project.server.main.my_elastic import get_elastic
 
 QUERY_CITY_POPULATION_LIMIT = 50000
 SOURCE = 'wikidata'
 WIKIDATA_SPARQL_URL = 'https://query.wikidata.org/bigdata/namespace/wdq/sparql'
 
-es = MyElastic()
+es = get_elastic()
 logger = get_logger(__name__)
 
 
@@ -110,7 +110,7 @@ def data2actions(index: str, data: list = None) -> list:
     return actions
 
 
-def load_wikidata(index_prefix: str = '') -> dict:
+def load_wikidata(index_prefix: str = '', incremental: bool = False) -> dict:
     mappings = {
         'properties': {
             'content': {
@@ -134,7 +134,7 @@ def load_wikidata(index_prefix: str = '') -> dict:
     indexes = [index_city, index_university, index_hospital]
     results = {}
     for index in indexes:
-        es.create_index(index=index, mappings=mappings)
+        es.create_index(index=index, mappings=mappings, incremental=incremental)
     actions = []
     cities = get_cities_from_wikidata()
     actions += data2actions(data=cities, index=index_city)
@@ -145,5 +145,5 @@ def load_wikidata(index_prefix: str = '') -> dict:
     universities = get_universities_from_wikidata()
     actions += data2actions(data=universities, index=index_university)
     results[index_university] = len(universities)
-    es.parallel_bulk(actions=actions)
+    es.parallel_bulk(actions=actions, incremental=incremental)
     return results
@@ -1,4 +1,9 @@
-from project.server.main.matcher import Matcher
+import asyncio
+
+from project import __version__
+from project.server.main.config import MATCHER_COUNTRY_GAZETTEER
+from project.server.main.country_gazetteer import get_gazetteer
+from project.server.main.matcher import AsyncMatcher, correspondance, Matcher, MatcherType
 from project.server.main.utils import ENGLISH_STOP, FRENCH_STOP
 
 STOPWORDS_STRATEGIES = {'grid_name': ENGLISH_STOP + FRENCH_STOP}
@@ -23,17 +28,55 @@ COUNTRY_DEFAULT_STRATEGIES = [
         ['rnsr_name', 'rnsr_zone_emploi', 'country_name'], ['rnsr_name', 'rnsr_city', 'country_name']],
     [['rnsr_code_prefix', 'rnsr_acronym'], ['rnsr_code_prefix', 'rnsr_supervisor_acronym']]
 ]
+COUNTRY_MATCHER = MatcherType(method='country', field='country_alpha2', default_strategies=COUNTRY_DEFAULT_STRATEGIES,
+                              stopwords_strategies=STOPWORDS_STRATEGIES)
+
+
+def match_country_gazetteer(matcher: Matcher, conditions: dict):
+    """Response of the default strategies if the country gazetteer can answer the query, None otherwise."""
+    gazetteer_enabled = str(conditions.get('gazetteer', MATCHER_COUNTRY_GAZETTEER)).lower() == 'true'
+    if not gazetteer_enabled or conditions.get('verbose') or 'strategies' in conditions or 'name' in conditions:
+        return None
+    index_prefix = conditions.get('index_prefix', 'matcher')
+    gazetteer = get_gazetteer(es=matcher.es, index_prefix=index_prefix)
+    country = gazetteer.get_country(conditions.get('query', '')) if gazetteer else None
+    if country is None:
+        return None
+    return {
+        'highlights': {},
+        'debug': {'criterion': {}, 'strategies': [], 'gazetteer': True},
+        'other_ids': list(dict.fromkeys(correspondance.get(country, []))),
+        'results': [country],
+        'index_date': gazetteer.index_date,
+        'version': __version__,
+        'enriched_results': matcher.enrich_results([country], 'country', index_prefix, entities=gazetteer.entities)
+    }
 
 
 def match_country(conditions: dict) -> dict:
-    strategies = conditions.get('strategies')
-    if strategies is None:
-        strategies = COUNTRY_DEFAULT_STRATEGIES
     matcher = Matcher()
-    return matcher.match(
-            method='country',
-            field='country_alpha2',
-            conditions=conditions,
-            strategies=strategies,
-            stopwords_strategies=STOPWORDS_STRATEGIES
-        )
+    response = match_country_gazetteer(matcher=matcher, conditions=conditions)
+    if response is not None:
+        return response
+    return COUNTRY_MATCHER.match(conditions=conditions, matcher=matcher)
+
+
+async def match_country_async(conditions: dict) -> dict:
+    matcher = AsyncMatcher()
+    # The gazetteer is built in a thread the first time
+    response = await asyncio.to_thread(match_country_gazetteer, matcher=matcher, conditions=conditions)
+    if response is not None:
+        return response
+    return await COUNTRY_MATCHER.match_async(conditions=conditions, matcher=matcher)
+
+
+def match_country_list(conditions_list: list) -> list:
+    matcher = Matcher()
+    responses = [match_country_gazetteer(matcher=matcher, conditions=conditions) for conditions in conditions_list]
+    # Only the conditions not answered by the gazetteer are percolated
+    indices = [index for index, response in enumerate(responses) if response is None]
+    percolated_responses = COUNTRY_MATCHER.match_list(conditions_list=[conditions_list[index] for index in indices],
+                                                      matcher=matcher)
+    for index, response in zip(indices, percolated_responses):
+        responses[index] = response
+    return responses
@@ -1,10 +1,10 @@
 import requests
 
-from bs4 import BeautifulSoup
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
 
 from project.server.main.config import ELASTICSEARCH_HOST, ELASTICSEARCH_URL
+from project.server.main.utils import get_highlighted_tokens
 
 es = Elasticsearch(ELASTICSEARCH_HOST)
 INDEX = 'index_finess'
@@ -177,8 +177,8 @@ def get_info(input_str, search_fields, size=20, highlights: list = None):
         for matching_field in hit.meta.highlight:
             for fragment in hit.meta.highlight[matching_field]:
                 highlights[hit.id].append(fragment)
-                matches = [normalize_for_count(e.get_text(), matching_field) for e in
-                           BeautifulSoup(fragment, 'lxml').find_all('em')]
+                matches = [normalize_for_count(token, matching_field) for token in
+                           get_highlighted_tokens(fragment)]
                 if hit.id not in nb_matches:
                     nb_matches[hit.id] = 0
                     matches_frag[hit.id] = []
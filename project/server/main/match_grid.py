@@ -1,6 +1,11 @@
-from project.server.main.matcher import Matcher
+from project.server.main.elastic_utils import get_index_name
+from project.server.main.logger import get_logger
+from project.server.main.matcher import MatcherType
+from project.server.main.strategies import get_hit_budget
 from project.server.main.utils import ENGLISH_STOP, FRENCH_STOP, remove_ref_index
 
+logger = get_logger(__name__)
+
 DEFAULT_STRATEGIES_GRID = [
     [['grid_id'], ['ror_id']],
     [['grid_name', 'grid_acronym', 'grid_city', 'grid_country'],
@@ -28,7 +33,8 @@ STOPWORDS_STRATEGIES = {'grid_name': ENGLISH_STOP + FRENCH_STOP}
 
 def get_ancestors(query: str, es, index_prefix: str) -> list:
     index = f'{index_prefix}_grid_parent'
-    body = {'query': {'query_string': {'query': query}}, '_source': {'includes': ['query']}}
+    body = {'query': {'query_string': {'query': query}}, '_source': {'includes': ['query']},
+            'size': get_hit_budget('grid_parent')}
     hits = es.search(index=index, body=body).get('hits', {}).get('hits', [])
     parents = [hit.get('_source', {}).get('query', {}).get('match_phrase', {}).get('content', {}).get('query')
                for hit in hits]
@@ -38,24 +44,35 @@ def get_ancestors(query: str, es, index_prefix: str) -> list:
     return list(set(ancestors))
 
 
+def get_stored_ancestors(grids: list, es, index_prefix: str) -> dict:
+    """Ancestors of each grid, computed by the load and stored in the grid entities, with a single mget."""
+    if not grids:
+        return {}
+    index = get_index_name(index_name='entities', source='grid', index_prefix=index_prefix)
+    try:
+        docs = es.mget(index=index, body={'ids': grids}, _source_includes=['ancestors'], ignore=404).get('docs', [])
+    except Exception as exception:
+        logger.error(f'get_stored_ancestors {index} raises an error: {exception}')
+        return {}
+    return {doc['_id']: doc['_source']['ancestors'] for doc in docs
+            if doc.get('found') and 'ancestors' in doc.get('_source', {})}
+
+
 def remove_ancestors(grids: list, es, index_prefix: str) -> list:
-    grids_copy = grids.copy()
+    stored_ancestors = get_stored_ancestors(grids=grids, es=es, index_prefix=index_prefix)
+    ancestors = set()
     for grid in grids:
-        ancestors = get_ancestors(query=grid, es=es, index_prefix=index_prefix)
-        grids_copy = list(set(grids_copy) - set(ancestors))
-    return grids_copy
-
-
-def match_grid(conditions: dict) -> dict:
-    strategies = conditions.get('strategies')
-    if strategies is None:
-        strategies = DEFAULT_STRATEGIES_GRID
-    matcher = Matcher()
-    return matcher.match(
-        field='grids',
-        conditions=conditions,
-        strategies=strategies,
-        pre_treatment_query=remove_ref_index,
-        stopwords_strategies=STOPWORDS_STRATEGIES,
-        post_treatment_results=remove_ancestors
-    )
+        if grid in stored_ancestors:
+            ancestors.update(stored_ancestors[grid])
+        else:
+            # Grid entities loaded before the ancestors were stored
+            ancestors.update(get_ancestors(query=grid, es=es, index_prefix=index_prefix))
+    return [grid for grid in grids if grid not in ancestors]
+
+
+GRID_MATCHER = MatcherType(method='grid', field='grids', default_strategies=DEFAULT_STRATEGIES_GRID,
+                           stopwords_strategies=STOPWORDS_STRATEGIES, pre_treatment_query=remove_ref_index,
+                           post_treatment_results=remove_ancestors)
+match_grid = GRID_MATCHER.match
+match_grid_async = GRID_MATCHER.match_async
+match_grid_list = GRID_MATCHER.match_list
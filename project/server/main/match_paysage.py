@@ -1,6 +1,6 @@
 import re
 
-from project.server.main.matcher import Matcher
+from project.server.main.matcher import MatcherType
 from project.server.main.utils import FRENCH_STOP, remove_ref_index
 
 DEFAULT_STRATEGIES = [
@@ -27,23 +27,9 @@ def pre_treatment_paysage(query: str = "") -> str:
     return query.lower()
 
 
-def match_paysage(conditions: dict) -> dict:
-    strategies = conditions.get("strategies")
-    if strategies is None:
-        strategies = DEFAULT_STRATEGIES
-    if "year" in conditions:
-        strategies_copy = []
-        for equivalent_strategies in strategies:
-            equivalent_strategies_copy = []
-            for strategy in equivalent_strategies:
-                equivalent_strategies_copy.append(strategy + ["paysage_year"])
-            strategies_copy.append(equivalent_strategies_copy)
-        strategies = strategies_copy
-    matcher = Matcher()
-    return matcher.match(
-        field="paysages",
-        conditions=conditions,
-        strategies=strategies,
-        stopwords_strategies=STOPWORDS_STRATEGIES,
-        pre_treatment_query=pre_treatment_paysage,
-    )
+PAYSAGE_MATCHER = MatcherType(method="paysage", field="paysages", default_strategies=DEFAULT_STRATEGIES,
+                              stopwords_strategies=STOPWORDS_STRATEGIES, pre_treatment_query=pre_treatment_paysage,
+                              year_criterion="paysage_year")
+match_paysage = PAYSAGE_MATCHER.match
+match_paysage_async = PAYSAGE_MATCHER.match_async
+match_paysage_list = PAYSAGE_MATCHER.match_list
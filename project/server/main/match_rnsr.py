@@ -1,6 +1,6 @@
 import re
 
-from project.server.main.matcher import Matcher
+from project.server.main.matcher import MatcherType
 from project.server.main.utils import FRENCH_STOP, remove_ref_index
 
 DEFAULT_STRATEGIES = [
@@ -47,19 +47,9 @@ def pre_treatment_rnsr(query: str = '') -> str:
     return rgx.sub("umr\\3\\5", query).lower()
 
 
-def match_rnsr(conditions: dict) -> dict:
-    strategies = conditions.get('strategies')
-    if strategies is None:
-        strategies = DEFAULT_STRATEGIES
-    if 'year' in conditions:
-        strategies_copy = []
-        for equivalent_strategies in strategies:
-            equivalent_strategies_copy = []
-            for strategy in equivalent_strategies:
-                equivalent_strategies_copy.append(strategy + ['rnsr_year'])
-            strategies_copy.append(equivalent_strategies_copy)
-        strategies = strategies_copy
-    matcher = Matcher()
-    return matcher.match(field='rnsrs', conditions=conditions, strategies=strategies,
-                         stopwords_strategies=STOPWORDS_STRATEGIES,
-                         pre_treatment_query=pre_treatment_rnsr)
+RNSR_MATCHER = MatcherType(method='rnsr', field='rnsrs', default_strategies=DEFAULT_STRATEGIES,
+                           stopwords_strategies=STOPWORDS_STRATEGIES, pre_treatment_query=pre_treatment_rnsr,
+                           year_criterion='rnsr_year')
+match_rnsr = RNSR_MATCHER.match
+match_rnsr_async = RNSR_MATCHER.match_async
+match_rnsr_list = RNSR_MATCHER.match_list
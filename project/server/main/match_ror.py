@@ -1,5 +1,5 @@
 import re
-from project.server.main.matcher import Matcher
+from project.server.main.matcher import MatcherType
 from project.server.main.utils import ENGLISH_STOP, FRENCH_STOP, remove_ref_index
 
 DEFAULT_STRATEGIES = [
@@ -65,15 +65,9 @@ def pre_treatment_ror(query: str = '') -> str:
         query = replace_synonym(query, synonym[0], synonym[1])
     return query.lower()
 
-def match_ror(conditions: dict) -> dict:
-    strategies = conditions.get('strategies')
-    if strategies is None:
-        strategies = DEFAULT_STRATEGIES
-    matcher = Matcher()
-    return matcher.match(
-        field='rors',
-        conditions=conditions,
-        strategies=strategies,
-        pre_treatment_query=pre_treatment_ror,
-        stopwords_strategies=STOPWORDS_STRATEGIES,
-    )
+
+ROR_MATCHER = MatcherType(method='ror', field='rors', default_strategies=DEFAULT_STRATEGIES,
+                          stopwords_strategies=STOPWORDS_STRATEGIES, pre_treatment_query=pre_treatment_ror)
+match_ror = ROR_MATCHER.match
+match_ror_async = ROR_MATCHER.match_async
+match_ror_list = ROR_MATCHER.match_list
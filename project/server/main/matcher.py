@@ -1,44 +1,71 @@
-import requests
+import asyncio
 import itertools
-from fuzzywuzzy import fuzz
+import threading
+import time
 
-from bs4 import BeautifulSoup
+from functools import lru_cache
+from rapidfuzz import fuzz, process
+
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
 
 from project import __version__
-from project.server.main.elastic_utils import get_index_name
+from project.server.main.cache import analyzed_queries_cache, percolation_cache, vocabularies_cache
+from project.server.main.config import MATCHER_BATCH_MAX_HITS, MATCHER_CANDIDATE_FILTER, \
+    MATCHER_CANDIDATE_FILTER_MAX_TERMS, MATCHER_DEADLINE_MS, MATCHER_HIT_BUDGET, MATCHER_HIT_BUDGETS, MATCHER_HIT_MAX, \
+    MATCHER_PIT_KEEP_ALIVE, MATCHER_PREFETCH_GROUPS, MATCHER_SPECULATIVE_GROUPS, MATCHER_VOCABULARY_FILTER
+from project.server.main.elastic_utils import get_index_name, ENTITY_FIELDS
+from project.server.main.id_interner import IdTable, id_interner
 from project.server.main.logger import get_logger
-from project.server.main.my_elastic import MyElastic
-from project.server.main.utils import remove_stop, normalize_text
+from project.server.main.my_elastic import get_async_elastic, get_elastic
+from project.server.main.utils import get_highlighted_tokens, normalize_name
 from project.server.main.load_rnsr import get_siren
-from project.server.main.load_paysage import PAYSAGE_API_URL, PAYSAGE_API_KEY, CATEGORIES
+from project.server.main.result_cache import get_index_version
+from project.server.main.strategies import compile_strategies, get_criterion_index, get_criterion_rank, StrategyPlan
+from project.server.main.vocabulary import can_match, get_vocabularies
 
 logger = get_logger(__name__)
 
 correspondance = get_siren()
 
+# Fields of the percolators mapped with the keyword analyzer, that can be filtered by candidates
+CANDIDATE_FILTER_FIELDS = ['grids', 'paysages', 'rnsrs', 'rors']
+# Operations given the time left before the deadline of a match as request_timeout
+DEADLINE_OPERATIONS = ['percolate', 'open_point_in_time', 'search_point_in_time']
+
+
+class DeadlineExceeded(Exception):
+    pass
+
 def identity(x: str = '') -> str:
     return x
 
-def check_similarity(str1, str2, pre_treatment_query, threshold = 0.8):
-    logs=''
-    x1 = pre_treatment_query(normalize_text(text = str1, remove_separator = False, re_order = True, to_lower = True))
-    x2 = pre_treatment_query(normalize_text(text = str2, remove_separator = False, re_order = True, to_lower = True))
-    r = (fuzz.ratio(x1, x2))/100.0
-    if r < threshold:
-        logger.debug(f'reject {str1} {str2} match as ratio = {r} < {threshold}')
-        return False
-    logger.debug(f'accept {str1} {str2} match as ratio = {r} >= {threshold} !')
-    return True
+@lru_cache(maxsize=100000)
+def get_reference_name(name_normalized: str, pre_treatment_query) -> str:
+    return pre_treatment_query(name_normalized)
+
+def get_similar_results(input_name: str, potential_results: list, pre_treatment_query, threshold: float = 0.8) -> list:
+    """Ids of the potential results, as (id, normalized names) tuples, having a name similar to the input name.
+    All the names are compared to the input name in a single batch."""
+    query = pre_treatment_query(normalize_name(input_name))
+    ids, names = [], []
+    for potential_id, names_normalized in potential_results:
+        for name_normalized in names_normalized:
+            ids.append(potential_id)
+            names.append(get_reference_name(name_normalized, pre_treatment_query))
+    if not names:
+        return []
+    # The ratio is rounded to an integer before being compared to the threshold
+    scores = process.cdist([query], names, scorer=fuzz.ratio, score_cutoff=100 * threshold - 0.5)[0]
+    similar_ids = set([ids[index] for index, score in enumerate(scores) if score])
+    logger.debug(f'{len(similar_ids)} / {len(potential_results)} results with a name similar to {input_name}')
+    return [potential_id for potential_id, _ in potential_results if potential_id in similar_ids]
 
 def get_highlights_length_by_match(highlights: dict):
     criteria_per_token = {}
     nb_criteria_per_token = {}
     for criterion in highlights:
         values = highlights[criterion]
-        all_highlights = ' '.join(values[0])
-        matching_tokens = list(set(BeautifulSoup(all_highlights, 'lxml').find_all('em')))
-        for m in matching_tokens:
-            current_token = m.get_text()
+        for current_token in get_highlighted_tokens(values[0]):
             if current_token not in criteria_per_token:
                 criteria_per_token[current_token] = []
             criteria_per_token[current_token].append(criterion)
@@ -79,11 +106,14 @@ def filter_submatching_results_by_criterion(res: dict, conditions) -> dict:
         criteria_01 = highlights[matching_ids[0]].keys()
         criteria_02 = highlights[matching_ids[1]].keys() if len(matching_ids) > 1 else []
         criteria = list(set(list(criteria_01) + list(criteria_02)))
+        # The highlighted tokens are extracted once per id and criterion, before comparing the pairs of ids
+        tokens = {matching_id: {criterion: get_highlighted_tokens(highlights[matching_id].get(criterion, []))
+                                for criterion in criteria} for matching_id in matching_ids}
         for (id1, id2) in all_id_combinations:
             is_inf_or_equal_1, is_inf_or_equal_2, is_strict_inf_1, is_strict_inf_2 = True, True, False, False
             for criterion in criteria:
-                matching_elements_1 = set(BeautifulSoup(str(highlights[id1].get(criterion, '')), 'lxml').find_all('em'))
-                matching_elements_2 = set(BeautifulSoup(str(highlights[id2].get(criterion, '')), 'lxml').find_all('em'))
+                matching_elements_1 = tokens[id1][criterion]
+                matching_elements_2 = tokens[id2][criterion]
                 is_inf_or_equal_1 = is_inf_or_equal_1 and matching_elements_1 <= matching_elements_2
                 is_inf_or_equal_2 = is_inf_or_equal_2 and matching_elements_2 <= matching_elements_1
                 is_strict_inf_1 = is_strict_inf_1 or matching_elements_1 < matching_elements_2
@@ -122,9 +152,11 @@ def filter_submatching_results_by_all(res: dict, conditions) -> dict:
         matching_ids = list(highlights.keys())
         # Create all combinaisons of 2 ids among the matching_ids
         all_id_combinations = itertools.combinations(matching_ids, 2)
+        highlights_lengths = {matching_id: get_highlights_length_by_match(highlights=highlights[matching_id])
+                              for matching_id in matching_ids}
         for (id1, id2) in all_id_combinations:
-            highlights_length_01 = get_highlights_length_by_match(highlights=highlights[id1])
-            highlights_length_02 = get_highlights_length_by_match(highlights=highlights[id2])
+            highlights_length_01 = highlights_lengths[id1]
+            highlights_length_02 = highlights_lengths[id2]
             max_1 = highlights_length_01['max']
             max_2 = highlights_length_02['max']
             if max_2 > max_1:
@@ -163,55 +195,465 @@ def clean_highlights(highlights: dict):
                         highlight = " ".join(highlight)
                         logger.debug(f"highlight: {highlight}")
                         new_highlights[match_id]["criterion"][criteria].append(
-                            list(set([tag.text for tag in BeautifulSoup(highlight, "lxml").find_all("em")]))
+                            sorted(get_highlighted_tokens(highlight))
                         )
     return new_highlights
 
 
+def new_percolation(hits: list, total: int = None) -> dict:
+    # The ids of the hits are interned once per IdTable, and kept with the hits in the caches.
+    # total is the number of percolators matched, more than the hits if they have been truncated.
+    return {'hits': hits, 'ids': {}, 'total': len(hits) if total is None else total}
+
+
+def set_shared_percolation(key: tuple, percolation: dict) -> None:
+    # A truncated percolation depends on the hit budget of its request, so it is not shared with the other requests
+    if percolation['total'] <= len(percolation['hits']):
+        percolation_cache.set(key, percolation)
+
+
+def get_total_hits(response: dict) -> int:
+    total = response.get('hits', {}).get('total', 0)
+    return total.get('value', 0) if isinstance(total, dict) else total
+
+
+class PercolationStats:
+    """Thread-safe counters of the percolations of the process, and of the ones exceeding their hit budget."""
+
+    def __init__(self) -> None:
+        self._counts = {'percolations': 0, 'over_budget': 0, 'paged': 0, 'truncated': 0}
+        self._lock = threading.Lock()
+
+    def add(self, **counts) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                self._counts[name] += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {**counts, 'hit_budget': MATCHER_HIT_BUDGET, 'hit_budgets': MATCHER_HIT_BUDGETS,
+                'hit_max': MATCHER_HIT_MAX}
+
+
+percolation_stats = PercolationStats()
+
+
+def get_percolation_ids(percolation: dict, field: str, id_table: IdTable) -> frozenset:
+    # The integers are keyed by the table itself, which they keep alive, as they only make sense with it
+    ids = percolation['ids'].get(id_table)
+    if ids is None:
+        values = []
+        for hit in percolation['hits']:
+            sublist = hit.get('_source', {}).get(field)
+            if isinstance(sublist, list):
+                values += [item for item in sublist if item]
+        ids = id_table.intern(values)
+        percolation['ids'][id_table] = ids
+    return ids
+
+
+def get_percolation_query(criterion_query: str, candidates: list, field: str) -> dict:
+    # If candidates is not None, only the percolators of these candidates are returned
+    query = {'percolate': {'field': 'query', 'document': {'content': criterion_query}}}
+    if candidates is not None:
+        query = {'bool': {'must': [query], 'filter': [{'terms': {field: candidates}}]}}
+    return query
+
+
+def get_percolate_body(percolations: list, field: str) -> list:
+    """_msearch body of the (index, criterion_query, candidates, highlight, size) percolations."""
+    body = []
+    for index, criterion_query, candidates, highlight, size in percolations:
+        percolation = {'query': get_percolation_query(criterion_query=criterion_query, candidates=candidates,
+                                                      field=field),
+                       '_source': {'includes': [field]}, 'size': size}
+        if highlight:
+            percolation['highlight'] = {'fields': {'content': {'type': 'unified'}}}
+        body.append({'index': index})
+        body.append(percolation)
+    return body
+
+
+def get_percolate_page_body(criterion_query: str, candidates: list, highlight: bool, field: str, size: int,
+                            pit_id: str, search_after: list = None) -> dict:
+    """Body of a page of a percolation in the point in time pit_id, after the sort values search_after."""
+    body = {
+        'query': get_percolation_query(criterion_query=criterion_query, candidates=candidates, field=field),
+        '_source': {'includes': [field]},
+        'size': size,
+        'pit': {'id': pit_id, 'keep_alive': MATCHER_PIT_KEEP_ALIVE},
+        'sort': [{'_shard_doc': 'asc'}],
+        'track_total_hits': False
+    }
+    if highlight:
+        body['highlight'] = {'fields': {'content': {'type': 'unified'}}}
+    if search_after is not None:
+        body['search_after'] = search_after
+    return body
+
+
+def page_percolation_steps(index: str, criterion_query: str, candidates: list, highlight: bool, field: str,
+                           size: int, max_hits: int):
+    """Steps retrieving the hits of a percolation up to max_hits, by pages of size hits (see Matcher.run).
+    The point in time keeps the pages consistent, even if the index is refreshed meanwhile. It is closed even if an
+    exception, ie. DeadlineExceeded, is thrown in the steps while paging."""
+    [pit_id] = yield [('open_point_in_time', {'index': index})]
+    hits = []
+    search_after = None
+    try:
+        while len(hits) < max_hits:
+            page_size = min(size, max_hits - len(hits))
+            body = get_percolate_page_body(criterion_query=criterion_query, candidates=candidates,
+                                           highlight=highlight, field=field, size=page_size, pit_id=pit_id,
+                                           search_after=search_after)
+            [response] = yield [('search_point_in_time', {'body': body})]
+            pit_id = response.get('pit_id', pit_id)
+            page = response.get('hits', {}).get('hits', [])
+            hits += page
+            if len(page) < page_size:
+                break
+            search_after = page[-1]['sort']
+    finally:
+        yield [('close_point_in_time', {'pit_id': pit_id})]
+    return hits
+
+
+def gather_steps(steps_list: list):
+    """Run several steps generators together, the operations of their current steps being yielded as a single step,
+    and return the list of their values. An exception raised by one of them, or thrown in the gathered steps, is
+    thrown in the other ones, which may still yield the operations releasing their resources, then raised."""
+    values = [None for _ in steps_list]
+    running = {}
+    thrown = set()
+    error = None
+
+    def advance(steps_index: int, steps, resume, argument) -> None:
+        nonlocal error
+        try:
+            running[steps_index] = (steps, resume(argument))
+        except StopIteration as stop:
+            values[steps_index] = stop.value
+        except Exception as exception:
+            error = error or exception
+
+    for steps_index, steps in enumerate(steps_list):
+        if error is None:
+            advance(steps_index, steps, steps.send, None)
+    while running:
+        for steps_index, (steps, _) in list(running.items()):
+            if error is not None and steps_index not in thrown:
+                thrown.add(steps_index)
+                del running[steps_index]
+                advance(steps_index, steps, steps.throw, error)
+        current = list(running.items())
+        if not current:
+            break
+        try:
+            results = yield [operation for _, (_, operations) in current for operation in operations]
+        except Exception as exception:
+            error = error or exception
+            for steps_index, (steps, _) in current:
+                thrown.add(steps_index)
+                del running[steps_index]
+                advance(steps_index, steps, steps.throw, exception)
+            continue
+        position = 0
+        for steps_index, (steps, operations) in current:
+            steps_results = results[position:position + len(operations)]
+            position += len(operations)
+            del running[steps_index]
+            advance(steps_index, steps, steps.send, steps_results)
+    if error is not None:
+        raise error
+    return values
+
+
+def operation_steps(name: str, kwargs: dict):
+    [result] = yield [(name, kwargs)]
+    return result
+
+
+def deadline_steps(steps, deadline: float):
+    """Forward the operations of the steps, the DEADLINE_OPERATIONS being given the time left before the deadline
+    (time.monotonic() value) as request_timeout, and raise DeadlineExceeded once it is over. DeadlineExceeded is
+    thrown in the steps first, their operations releasing their resources being forwarded outside the deadline."""
+    exceeded = False
+    try:
+        operations = next(steps)
+        while True:
+            request_timeout = deadline - time.monotonic()
+            if not exceeded and request_timeout <= 0:
+                exceeded = True
+                operations = steps.throw(DeadlineExceeded())
+                continue
+            if not exceeded:
+                operations = [(name, {**kwargs, 'request_timeout': request_timeout}) if name in DEADLINE_OPERATIONS
+                              else (name, kwargs) for name, kwargs in operations]
+            try:
+                results = yield operations
+            except ConnectionTimeout:
+                exceeded = True
+                operations = steps.throw(DeadlineExceeded())
+            except Exception as exception:
+                operations = steps.throw(exception)
+            else:
+                operations = steps.send(results)
+    except StopIteration as stop:
+        if exceeded:
+            raise DeadlineExceeded()
+        return stop.value
+
+
+def get_percolate_documents_body(criterion_queries: list, field: str) -> dict:
+    return {
+        'query': {'percolate': {'field': 'query',
+                                'documents': [{'content': criterion_query} for criterion_query in criterion_queries]}},
+        '_source': {'includes': [field]},
+        'highlight': {'fields': {'content': {'type': 'unified'}}},
+        'size': MATCHER_BATCH_MAX_HITS
+    }
+
+
+def get_hits_by_document(hits: list, nb_documents: int) -> list:
+    # Demultiplex the hits back to each percolated document thanks to the _percolator_document_slot
+    hits_by_document = [[] for _ in range(nb_documents)]
+    for hit in hits:
+        highlight = hit.get('highlight', {})
+        for slot in hit.get('fields', {}).get('_percolator_document_slot', []):
+            # With several documents, the highlighted fields are prefixed by the document slot
+            hits_by_document[slot].append({
+                '_index': hit.get('_index'),
+                '_source': hit.get('_source', {}),
+                'highlight': {'content': highlight.get(f'{slot}_content', highlight.get('content', []))}
+            })
+    return hits_by_document
+
+
+def get_hits_by_document_response(response: dict, nb_documents: int):
+    """Hits of each percolated document of the response, or None if its hits have been truncated to its size."""
+    hits = response.get('hits', {}).get('hits', [])
+    total = response.get('hits', {}).get('total', 0)
+    if get_total_hits(response) > len(hits) or (isinstance(total, dict) and total.get('relation') == 'gte'):
+        return None
+    return get_hits_by_document(hits=hits, nb_documents=nb_documents)
+
+
+def get_entities_by_id(docs: list) -> dict:
+    return {doc['_id']: doc.get('_source', {}) for doc in docs if doc.get('found')}
+
+
 class Matcher:
     def __init__(self) -> None:
-        self.es = MyElastic()
+        self.es = get_elastic()
+        # The requests with a deadline are not retried on timeout, as the deadline is over
+        self.deadline_es = get_elastic(retry_on_timeout=False)
+
+    def get_client(self, request_timeout: float = None):
+        return self.es if request_timeout is None else self.deadline_es
+
+    def get_shared_cache_key(self, index: str, field: str, criterion_query: str, highlight: bool = True) -> tuple:
+        # The index behind the alias is part of the key, so that a new load is never served outdated hits
+        return index, self.es.get_index_from_alias(index), field, criterion_query, highlight
+
+    def percolate(self, percolations: list, field: str, request_timeout: float = None) -> list:
+        """Send all the (index, criterion_query, candidates, highlight) percolations in a single _msearch request."""
+        return self.get_client(request_timeout).msearch(body=get_percolate_body(percolations=percolations, field=field),
+                                                        request_timeout=request_timeout).get('responses', [])
+
+    def percolate_documents(self, index: str, criterion_queries: list, field: str) -> list:
+        """Percolate all the criterion_queries as documents of a single request, and return the hits of each one, or
+        None if there are more than MATCHER_BATCH_MAX_HITS hits."""
+        body = get_percolate_documents_body(criterion_queries=criterion_queries, field=field)
+        return get_hits_by_document_response(response=self.es.search(index=index, body=body),
+                                             nb_documents=len(criterion_queries))
+
+    def open_point_in_time(self, index: str, request_timeout: float = None) -> str:
+        # The client does not implement the point in time API, added by Elasticsearch 7.10
+        params = {'keep_alive': MATCHER_PIT_KEEP_ALIVE, 'request_timeout': request_timeout}
+        return self.get_client(request_timeout).transport.perform_request('POST', f'/{index}/_pit', params=params)['id']
+
+    def search_point_in_time(self, body: dict, request_timeout: float = None) -> dict:
+        return self.get_client(request_timeout).transport.perform_request('POST', '/_search', body=body,
+                                                                          params={'request_timeout': request_timeout})
+
+    def close_point_in_time(self, pit_id: str) -> None:
+        # Not given the deadline, and its errors are only logged, the point in time expiring after its keep alive
+        try:
+            self.es.transport.perform_request('DELETE', '/_pit', body={'id': pit_id})
+        except Exception as exception:
+            logger.error(f'close_point_in_time raises an error: {exception}')
+
+    def get_index_version(self, method: str, index_prefix: str) -> str:
+        return get_index_version(es=self.es, matcher_type=method, index_prefix=index_prefix)
+
+    def post_treat(self, post_treatment_results, results: list, index_prefix: str) -> list:
+        return post_treatment_results(results, self.es, index_prefix)
+
+    def get_vocabularies(self, criteria: list, index_prefix: str) -> dict:
+        """Vocabulary of the criteria (see vocabulary.py), keyed by criterion index, read once per load of a source."""
+        vocabularies = {}
+        for source in dict.fromkeys([criterion.split('_')[0] for criterion in criteria]):
+            alias = get_index_name(index_name='vocabulary', source=source, index_prefix=index_prefix)
+            index = self.es.get_index_from_alias(alias)
+            source_vocabularies = vocabularies_cache.get(index)
+            if source_vocabularies is None:
+                try:
+                    source_vocabularies = get_vocabularies(es=self.es, index=index)
+                except Exception as exception:
+                    logger.error(f'get_vocabularies {index} raises an error: {exception}')
+                    continue
+                vocabularies_cache.set(index, source_vocabularies)
+            for criterion in criteria:
+                if criterion in source_vocabularies:
+                    vocabularies[get_criterion_index(criterion=criterion, index_prefix=index_prefix)] = \
+                        source_vocabularies[criterion]
+        return vocabularies
+
+    def analyze(self, index: str, analyzer: str, text: str) -> list:
+        """Tokens of the text analyzed by the analyzer of the index, or None if it cannot be analyzed."""
+        try:
+            response = self.es.indices.analyze(index=index, body={'analyzer': analyzer, 'text': text})
+        except Exception as exception:
+            logger.error(f'analyze {index} raises an error: {exception}')
+            return None
+        return [token['token'] for token in response.get('tokens', [])]
+
+    def run(self, steps):
+        """Execute the operations yielded by the steps generator, and return its value.
+        Each step is a list of (method name, kwargs) operations, whose results are sent back to the generator, or whose
+        exception is raised in the generator."""
+        try:
+            operations = next(steps)
+            while True:
+                try:
+                    results = [getattr(self, name)(**kwargs) for name, kwargs in operations]
+                except Exception as exception:
+                    operations = steps.throw(exception)
+                else:
+                    operations = steps.send(results)
+        except StopIteration as stop:
+            return stop.value
 
-    def enrich_results(self, results, method):
+    def prefetch_steps(self, conditions_list: list, strategies_list: list, pre_treatment_query, field: str,
+                       stopwords_strategies: dict, cache: dict):
+        """Each criterion index is percolated once with the criterion queries of all the conditions as documents,
+        the hits being added to the cache shared by the matches of these conditions."""
+        if pre_treatment_query is None:
+            pre_treatment_query = identity
+        if stopwords_strategies is None:
+            stopwords_strategies = {}
+        criterion_queries_by_index = {}
+        for conditions, strategies in zip(conditions_list, strategies_list):
+            index_prefix = conditions.get('index_prefix', 'matcher')
+            plan = compile_strategies(strategies, stopwords_strategies)
+            pre_treated = {}
+            for criterion in plan.criteria:
+                criterion_query = plan.get_criterion_query(criterion=criterion, conditions=conditions,
+                                                           pre_treatment_query=pre_treatment_query,
+                                                           pre_treated=pre_treated)
+                index = get_criterion_index(criterion=criterion, index_prefix=index_prefix)
+                if index not in criterion_queries_by_index:
+                    criterion_queries_by_index[index] = []
+                if criterion_query not in criterion_queries_by_index[index]:
+                    criterion_queries_by_index[index].append(criterion_query)
+        operations = []
+        for index, criterion_queries in criterion_queries_by_index.items():
+            criterion_queries_to_percolate = []
+            for criterion_query in criterion_queries:
+                shared_key = self.get_shared_cache_key(index=index, field=field, criterion_query=criterion_query)
+                percolation = percolation_cache.get(shared_key)
+                if percolation is None:
+                    criterion_queries_to_percolate.append(criterion_query)
+                else:
+                    cache[(f'{index};{field};{criterion_query}', None, True)] = percolation
+            if criterion_queries_to_percolate:
+                operations.append(('percolate_documents', {'index': index, 'field': field,
+                                                           'criterion_queries': criterion_queries_to_percolate}))
+        while operations:
+            hits_by_document_by_index = yield operations
+            truncated_operations = []
+            for (_, kwargs), hits_by_document in zip(operations, hits_by_document_by_index):
+                index = kwargs['index']
+                criterion_queries = kwargs['criterion_queries']
+                if hits_by_document is None:
+                    # The hits have been truncated, so the documents are percolated again in two halves. A single
+                    # document is left to the percolations of its match, whose hits are paged
+                    logger.debug(f'{len(criterion_queries)} documents percolated on {index} have too many hits')
+                    if len(criterion_queries) > 1:
+                        half = len(criterion_queries) // 2
+                        truncated_operations += [
+                            ('percolate_documents', {**kwargs, 'criterion_queries': criterion_queries[:half]}),
+                            ('percolate_documents', {**kwargs, 'criterion_queries': criterion_queries[half:]})]
+                    continue
+                for criterion_query, hits in zip(criterion_queries, hits_by_document):
+                    percolation = new_percolation(hits)
+                    cache[(f'{index};{field};{criterion_query}', None, True)] = percolation
+                    set_shared_percolation(self.get_shared_cache_key(index=index, field=field,
+                                                                     criterion_query=criterion_query), percolation)
+            operations = truncated_operations
+
+    def match_many(self, method: str = None, conditions_list: list = None, strategies_list: list = None,
+                   pre_treatment_query=None, field: str = 'ids', stopwords_strategies: dict = None,
+                   post_treatment_results=None) -> list:
+        """Match a list of conditions, strategies_list[i] being the strategies of conditions_list[i].
+        The criterion indices are first percolated for all the conditions (see prefetch_steps), then the strategies
+        are applied to each conditions with these hits."""
+        if conditions_list is None:
+            conditions_list = []
+        cache = {}
+        self.run(self.prefetch_steps(conditions_list=conditions_list, strategies_list=strategies_list,
+                                     pre_treatment_query=pre_treatment_query, field=field,
+                                     stopwords_strategies=stopwords_strategies, cache=cache))
+        return [self.match(method=method, conditions=conditions, strategies=strategies,
+                           pre_treatment_query=pre_treatment_query, field=field,
+                           stopwords_strategies=stopwords_strategies, post_treatment_results=post_treatment_results,
+                           cache=cache)
+                for conditions, strategies in zip(conditions_list, strategies_list)]
+
+    def get_entities(self, ids: list, method: str, index_prefix: str = 'matcher') -> dict:
+        """Entities stored at load time, fetched with a single mget."""
+        if not ids:
+            return {}
+        index = get_index_name(index_name='entities', source=method, index_prefix=index_prefix)
+        try:
+            docs = self.es.mget(index=index, body={'ids': ids}, ignore=404).get('docs', [])
+        except Exception as exception:
+            logger.error(f'get_entities {index} raises an error: {exception}')
+            return {}
+        return get_entities_by_id(docs)
+
+    def enrich_results(self, results, method, index_prefix: str = 'matcher', entities: dict = None):
         enriched = []
+        if entities is None:
+            entities = self.get_entities(ids=results, method=method, index_prefix=index_prefix)
         for r in results:
             elt = {"id": r}
-            for f in ["name", "city", "acronym", "country"]:
-                index = f"matcher_{method}_{f}"
-                try:
-                    data = self.es.search(index=index, body={"query": {"simple_query_string": {"query": r}}})
-                    hits = data["hits"]["hits"]
-                    elt[f] = []
-                    for hit in hits:
-                        elt[f].append(list(hit["_source"]["query"].values())[0]["content"]["query"])
-                except:
-                    pass
-
-            # enrich with paysage categories
-            if method == "paysage":
-                try:
-                    headers = {"X-API-KEY": PAYSAGE_API_KEY}
-                    url = f"{PAYSAGE_API_URL}/relations?limit=100&filters[relationTag]=structure-categorie&filters[resourceId]={r}"
-                    response = requests.get(url=url, headers=headers)
-                    data = response.json().get("data")
-                    categories = [
-                        {
-                            "id": d.get("relatedObjectId"),
-                            "label": d.get("relatedObject", {}).get("displayName"),
-                            "priority": d.get("relatedObject", {}).get("priority"),
-                        }
-                        for d in data
-                        if d.get("relatedObjectId") in CATEGORIES
-                    ]
-                    elt["paysage_categories"] = categories
-                except:
-                    pass
+            entity = entities.get(r, {})
+            # A field missing from the entity, ie. loaded before the entities or not fetched, is an empty list
+            for f in ENTITY_FIELDS:
+                elt[f] = entity.get(f) or []
+
+            # enrich with paysage categories, stored with the entities at load time
+            if method == "paysage" and "paysage_categories" in entity:
+                elt["paysage_categories"] = entity["paysage_categories"]
 
             enriched.append(elt)
         return enriched
 
     def match(self, method: str = None, conditions: dict = None, strategies: list = None, pre_treatment_query=None,
-              field: str = 'ids', stopwords_strategies: dict = None, post_treatment_results=None) -> dict:
+              field: str = 'ids', stopwords_strategies: dict = None, post_treatment_results=None,
+              cache: dict = None) -> dict:
+        return self.run(self.match_steps(method=method, conditions=conditions, strategies=strategies,
+                                         pre_treatment_query=pre_treatment_query, field=field,
+                                         stopwords_strategies=stopwords_strategies,
+                                         post_treatment_results=post_treatment_results, cache=cache))
+
+    def match_steps(self, method: str = None, conditions: dict = None, strategies: list = None,
+                    pre_treatment_query=None, field: str = 'ids', stopwords_strategies: dict = None,
+                    post_treatment_results=None, cache: dict = None):
+        """Apply the strategies to the conditions, yielding the requests to Elasticsearch to the engine running it
+        (see run), so that the same strategies are applied by the synchronous and asynchronous matchers."""
         if conditions is None:
             conditions = {}
         if method is None:
@@ -224,6 +666,7 @@ class Matcher:
             pre_treatment_query = identity
         if stopwords_strategies is None:
             stopwords_strategies = {}
+        strategies = compile_strategies(strategies, stopwords_strategies)
         verbose = conditions.get('verbose', False)
         index_prefix = conditions.get('index_prefix', 'matcher')
         query = conditions.get('query', '')
@@ -234,74 +677,313 @@ class Matcher:
         logger.debug(f"query {query}")
         # to limit the nb of ES requests
         # avoid call ES if a search on the same criterion has been done for a strategy before
-        cache = {}
+        if cache is None:
+            cache = {}
+        vocabulary_filter = str(conditions.get('vocabulary_filter', MATCHER_VOCABULARY_FILTER)).lower() == 'true'
+        operations = [('get_index_version', {'method': method, 'index_prefix': index_prefix})]
+        if vocabulary_filter:
+            operations.append(('get_vocabularies', {'criteria': strategies.criteria, 'index_prefix': index_prefix}))
+        operations_results = yield operations
+        # Entity ids are interned into integers for the intersections and unions of the strategies
+        index_version = operations_results[0]
+        vocabularies = operations_results[1] if vocabulary_filter else {}
+        id_table = id_interner.get_table((field, index_version))
+        cache_keys = {}
+        pre_treated = {}
+        errors = {}
         index_date = None
-        for equivalent_strategies in strategies:
-            equivalent_strategies_results = None
-            equivalent_strategies_matches = []
-            all_hits = {}
-            # logs += f'<br/> - Matching equivalent strategies : {equivalent_strategies}<br/>'
-            for strategy in equivalent_strategies:
-                strategy_results = None
-                for criterion in strategy:
-                    # TODO : remove index_prefix
-                    criterion_without_source = '_'.join(criterion.split('_')[1:])
-                    if criterion_without_source in conditions:
-                        criterion_query = pre_treatment_query(conditions[criterion_without_source])
+        prefetch_groups = int(conditions.get('prefetch_groups', MATCHER_PREFETCH_GROUPS))
+        speculative_groups = int(conditions.get('speculative_groups', MATCHER_SPECULATIVE_GROUPS))
+        candidate_filter = str(conditions.get('candidate_filter', MATCHER_CANDIDATE_FILTER)).lower() == 'true' \
+            and field in CANDIDATE_FILTER_FIELDS
+        # Number of hits of the percolation of each criterion, before paging
+        hit_budgets = strategies.hit_budgets
+        if conditions.get('hit_budget') is not None:
+            hit_budgets = {criterion: int(conditions['hit_budget']) for criterion in strategies.criteria}
+        deadline_ms = int(conditions.get('deadline_ms', MATCHER_DEADLINE_MS))
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms > 0 else None
+
+        def add_percolation(criterion: str, candidates: frozenset, highlight: bool, percolations: dict) -> tuple:
+            # Return the cache key of the percolation of this criterion, adding it to percolations if not cached yet.
+            # A percolation with highlights, or without candidates, also serves the ones without.
+            if criterion not in cache_keys:
+                criterion_query = strategies.get_criterion_query(criterion=criterion, conditions=conditions,
+                                                                 pre_treatment_query=pre_treatment_query,
+                                                                 pre_treated=pre_treated)
+                # TODO : remove index_prefix
+                index = get_criterion_index(criterion=criterion, index_prefix=index_prefix)
+                cache_keys[criterion] = (f'{index};{field};{criterion_query}', index, criterion_query)
+            criterion_key, index, criterion_query = cache_keys[criterion]
+            highlights = [True] if highlight else [True, False]
+            for current_highlight in highlights:
+                cache_key = (criterion_key, None, current_highlight)
+                if cache_key in cache or cache_key in percolations:
+                    return cache_key
+            for current_highlight in highlights:
+                shared_key = self.get_shared_cache_key(index=index, field=field, criterion_query=criterion_query,
+                                                       highlight=current_highlight)
+                percolation = percolation_cache.get(shared_key)
+                if percolation is not None:
+                    cache[(criterion_key, None, current_highlight)] = percolation
+                    return criterion_key, None, current_highlight
+            if candidates is not None and len(candidates) <= MATCHER_CANDIDATE_FILTER_MAX_TERMS:
+                # Only the percolators of the candidates are needed, they are not shared with the other requests
+                for current_highlight in highlights:
+                    cache_key = (criterion_key, candidates, current_highlight)
+                    if cache_key in cache or cache_key in percolations:
+                        return cache_key
+                percolations[cache_key] = (index, criterion_query, id_table.lookup(candidates), highlight,
+                                           hit_budgets[criterion], None)
+                return cache_key
+            cache_key = (criterion_key, None, highlight)
+            percolations[cache_key] = (index, criterion_query, None, highlight, hit_budgets[criterion],
+                                       self.get_shared_cache_key(index=index, field=field,
+                                                                 criterion_query=criterion_query, highlight=highlight))
+            return cache_key
+
+        def skip_percolations(percolations: dict):
+            # The percolations whose criterion query has no token in the vocabulary of its criterion cannot match,
+            # their empty hits are cached without being sent. The criterion queries are analyzed once per process.
+            analyze_keys = {}
+            for cache_key, (index, criterion_query, _, _, _, _) in percolations.items():
+                if index in vocabularies:
+                    analyze_keys[cache_key] = (self.es.get_index_from_alias(index), vocabularies[index]['analyzer'],
+                                               criterion_query)
+            tokens_by_key = {}
+            for analyze_key in dict.fromkeys(analyze_keys.values()):
+                tokens = analyzed_queries_cache.get(analyze_key)
+                if tokens is not None:
+                    tokens_by_key[analyze_key] = tokens
+            analyze_keys_to_send = [key for key in dict.fromkeys(analyze_keys.values()) if key not in tokens_by_key]
+            if analyze_keys_to_send:
+                analyzed = yield [('analyze', {'index': index, 'analyzer': analyzer, 'text': criterion_query})
+                                  for index, analyzer, criterion_query in analyze_keys_to_send]
+                for analyze_key, tokens in zip(analyze_keys_to_send, analyzed):
+                    if tokens is not None:
+                        analyzed_queries_cache.set(analyze_key, tokens)
+                        tokens_by_key[analyze_key] = tokens
+            for cache_key, analyze_key in analyze_keys.items():
+                tokens = tokens_by_key.get(analyze_key)
+                if tokens is not None and not can_match(vocabularies[percolations[cache_key][0]], tokens):
+                    percolation = percolations.pop(cache_key)
+                    cache[cache_key] = new_percolation([])
+                    if percolation[5] is not None:
+                        set_shared_percolation(percolation[5], cache[cache_key])
+
+        def send_percolations(percolations: dict):
+            if vocabularies:
+                yield from skip_percolations(percolations)
+            if not percolations:
+                return
+            percolate_steps = operation_steps('percolate', {'percolations': [p[0:5] for p in percolations.values()],
+                                                            'field': field})
+            if deadline is None:
+                responses = yield from percolate_steps
+            else:
+                responses = yield from deadline_steps(percolate_steps, deadline=deadline)
+            percolations_to_page = {}
+            totals = {}
+            for (cache_key, percolation), response in zip(percolations.items(), responses):
+                if 'error' in response:
+                    errors[cache_key] = response
+                    continue
+                hits = response.get('hits', {}).get('hits', [])
+                totals[cache_key] = get_total_hits(response)
+                if totals[cache_key] > len(hits) and MATCHER_HIT_MAX > len(hits):
+                    # The hit budget is exceeded, all the hits are paged up to MATCHER_HIT_MAX
+                    percolations_to_page[cache_key] = percolation
+                    continue
+                cache[cache_key] = new_percolation(hits, total=totals[cache_key])
+            if percolations_to_page:
+                pages_steps = [page_percolation_steps(index=index, criterion_query=criterion_query,
+                                                      candidates=candidates, highlight=highlight, field=field,
+                                                      size=size, max_hits=MATCHER_HIT_MAX)
+                               for index, criterion_query, candidates, highlight, size, _
+                               in percolations_to_page.values()]
+                if deadline is None:
+                    hits_list = yield from gather_steps(pages_steps)
+                else:
+                    hits_list = yield from deadline_steps(gather_steps(pages_steps), deadline=deadline)
+                for cache_key, hits in zip(percolations_to_page, hits_list):
+                    cache[cache_key] = new_percolation(hits, total=max(totals[cache_key], len(hits)))
+            for cache_key, percolation in percolations.items():
+                if cache_key in cache and percolation[5] is not None:
+                    set_shared_percolation(percolation[5], cache[cache_key])
+            over_budget = [key for key, percolation in percolations.items() if totals.get(key, 0) > percolation[4]]
+            truncated = [key for key in over_budget if key in cache and cache[key]['total'] > len(cache[key]['hits'])]
+            percolation_stats.add(percolations=len(percolations), over_budget=len(over_budget),
+                                  paged=len(percolations_to_page), truncated=len(truncated))
+
+        def send_percolations_before_deadline(percolations: dict):
+            # Return False if the deadline is over before all the percolations are done
+            try:
+                yield from send_percolations(percolations)
+            except DeadlineExceeded:
+                return False
+            return True
+
+        def get_percolation(cache_key: tuple) -> dict:
+            if cache_key not in cache:
+                error = errors.get(cache_key, {})
+                raise TransportError(error.get('status', 'N/A'), str(error.get('error')), error)
+            return cache[cache_key]
+
+        def is_highlighted(group_index: int) -> bool:
+            # The highlights are needed by the verbose logs, and by the submatching filters if there are at least 2
+            # results. They are requested at once for the equivalent strategies expected to yield several results.
+            return verbose or (method != 'paysage' and strategies.groups_highlighted[group_index])
+
+        def evaluate_group(group_index: int):
+            # Yield the percolations needed by each round of this equivalent strategies, then return the results and
+            # the cache keys of each strategy, with the number of results of each criterion, the criteria exceeding
+            # their hit budget and the index date
+            if candidate_filter:
+                ordered_strategies = strategies.ranked_groups[group_index]
+            else:
+                ordered_strategies = strategies.groups[group_index]
+            group_highlight = is_highlighted(group_index)
+            strategies_results = [None for _ in ordered_strategies]
+            strategies_cache_keys = [{} for _ in ordered_strategies]
+            criteria_matches = {}
+            criteria_over_budget = {}
+            group_index_date = None
+            # The criteria of the strategies are percolated by rounds, the n-th criterion of each strategy being
+            # restricted to the candidates surviving its n-1 first criteria
+            for round_index in range(max([len(strategy) for strategy in ordered_strategies], default=0)):
+                percolations = {}
+                round_criteria = {}
+                round_candidates = {}
+                for strategy_index, strategy in enumerate(ordered_strategies):
+                    candidates = strategies_results[strategy_index] if candidate_filter else None
+                    if round_index >= len(strategy) or candidates == frozenset():
+                        # A strategy is stopped as soon as its intersection is empty
+                        continue
+                    criterion = strategy[round_index]
+                    round_criteria[strategy_index] = criterion
+                    # A criterion needed by several strategies is percolated once, with the union of their candidates
+                    if candidates is None or (criterion in round_candidates and round_candidates[criterion] is None):
+                        round_candidates[criterion] = None
                     else:
-                        criterion_query = pre_treatment_query(query)
-                    if criterion in stopwords_strategies:
-                        stopwords = stopwords_strategies[criterion]
-                        criterion_query = remove_stop(criterion_query, stopwords)
-                    index = get_index_name(index_name=criterion, source='', index_prefix=index_prefix)
-                    cache_key = f'{index};{field};{criterion_query}'
-                    if cache_key in cache:
-                        hits = cache[cache_key]
+                        round_candidates[criterion] = round_candidates.get(criterion, frozenset()) | candidates
+                round_cache_keys = {criterion: add_percolation(criterion=criterion, candidates=candidates,
+                                                               highlight=group_highlight, percolations=percolations)
+                                    for criterion, candidates in round_candidates.items()}
+                if round_index == 0:
+                    # All the percolations that do not depend on candidates, for this equivalent strategies and the
+                    # next prefetch_groups ones, are sent in the same _msearch request
+                    if candidate_filter:
+                        next_groups_criteria = strategies.groups_first_criteria
                     else:
-                        body = {
-                            'query': {'percolate': {'field': 'query', 'document': {'content': criterion_query}}},
-                            '_source': {'includes': [field]},
-                            'highlight': {'fields': {'content': {'type': 'unified'}}}
-                        }
-                        hits = self.es.search(index=index, body=body).get('hits', []).get('hits', [])
-                        if hits and (not index_date):
-                            index_date = hits[0]['_index'].replace('matcher-', '').split('_')[0][0:8]
-                        cache[cache_key] = hits
-                    strategy_label = ';'.join(strategy)
-                    if strategy_label not in all_hits:
-                        all_hits[strategy_label] = {}
-                    all_hits[strategy_label][criterion] = hits
-                    criteria_results = [hit.get('_source', {}).get(field) for hit in hits]
-                    criteria_results_flatten = []
-                    for sublist in criteria_results:
-                        if isinstance(sublist, list):
-                            for item in sublist:
-                                if item:
-                                    criteria_results_flatten.append(item)
-                    # criteria_results = [item for sublist in criteria_results for item in sublist]
-                    criteria_results = list(set(criteria_results_flatten))
-                    if strategy_results is None:
-                        strategy_results = criteria_results
+                        next_groups_criteria = strategies.groups_criteria
+                    for next_group_index in range(group_index, min(group_index + 1 + prefetch_groups,
+                                                                   len(next_groups_criteria))):
+                        for criterion in next_groups_criteria[next_group_index]:
+                            add_percolation(criterion=criterion, candidates=None,
+                                            highlight=is_highlighted(next_group_index), percolations=percolations)
+                yield percolations
+                for strategy_index, criterion in round_criteria.items():
+                    cache_key = round_cache_keys[criterion]
+                    percolation = get_percolation(cache_key)
+                    hits = percolation['hits']
+                    if percolation['total'] > hit_budgets[criterion]:
+                        criteria_over_budget[criterion] = {'budget': hit_budgets[criterion], 'hits': len(hits),
+                                                           'total': percolation['total']}
+                    if hits and (not group_index_date):
+                        group_index_date = hits[0]['_index'].replace('matcher-', '').split('_')[0][0:8]
+                    strategies_cache_keys[strategy_index][criterion] = cache_key
+                    criteria_results = get_percolation_ids(percolation=percolation, field=field, id_table=id_table)
+                    if strategies_results[strategy_index] is None:
+                        strategies_results[strategy_index] = criteria_results
                     else:
                         # Intersection
-                        strategy_results = [result for result in strategy_results if result in criteria_results]
+                        strategies_results[strategy_index] = strategies_results[strategy_index] & criteria_results
                     # logs += f'Criteria : {criterion} : {len(criteria_results)} matches <br/>'
-                    debug["criterion"][criterion] = len(criteria_results)
+                    criteria_matches[criterion] = len(criteria_results)
+            return strategies_results, strategies_cache_keys, criteria_matches, criteria_over_budget, group_index_date
+
+        running_groups = {}
+        evaluated_groups = {}
+
+        def advance_group(group_index: int, group) -> None:
+            try:
+                running_groups[group_index] = (group, next(group))
+            except StopIteration as stop:
+                running_groups.pop(group_index, None)
+                evaluated_groups[group_index] = stop.value
+            except Exception as exception:
+                # Only raised if the strategies reach this group
+                running_groups.pop(group_index, None)
+                evaluated_groups[group_index] = exception
+
+        next_group_index = 0
+        # Equivalent strategies evaluated without result, reported if the deadline stops the strategies
+        no_result_groups = []
+        partial = False
+        for group_index, equivalent_strategies in enumerate(strategies):
+            # The next speculative_groups equivalent strategies are evaluated along with this one, the percolations
+            # of their rounds being sent in the same _msearch requests. Their results are only used in order, once
+            # all the previous equivalent strategies have no result.
+            while group_index not in evaluated_groups:
+                while next_group_index <= min(group_index + speculative_groups, len(strategies) - 1):
+                    advance_group(next_group_index, evaluate_group(next_group_index))
+                    next_group_index += 1
+                percolations = {}
+                for _, group_percolations in running_groups.values():
+                    percolations.update(group_percolations)
+                partial = not (yield from send_percolations_before_deadline(percolations))
+                if partial:
+                    break
+                for running_group_index, (group, _) in list(running_groups.items()):
+                    advance_group(running_group_index, group)
+            if partial:
+                break
+            group_evaluation = evaluated_groups.pop(group_index)
+            if isinstance(group_evaluation, Exception):
+                raise group_evaluation
+            strategies_results, strategies_cache_keys, criteria_matches, criteria_over_budget, group_index_date = \
+                group_evaluation
+            debug["criterion"].update(criteria_matches)
+            if criteria_over_budget:
+                debug.setdefault("hit_budget", {}).update(criteria_over_budget)
+            if not index_date:
+                index_date = group_index_date
+            equivalent_strategies_results = frozenset()
+            for strategy_results in strategies_results:
+                # Union
+                equivalent_strategies_results = equivalent_strategies_results | (strategy_results or frozenset())
+            # The equivalent strategies expected to yield at most one result have been percolated without
+            # highlights, which are requested afterwards if they yield several results anyway
+            with_highlights = verbose or (method != 'paysage' and len(equivalent_strategies_results) > 1)
+            if with_highlights and not verbose:
+                percolations = {}
+                for strategy_cache_keys in strategies_cache_keys:
+                    for criterion, cache_key in strategy_cache_keys.items():
+                        if not cache_key[2]:
+                            strategy_cache_keys[criterion] = add_percolation(
+                                criterion=criterion, candidates=cache_key[1], highlight=True, percolations=percolations)
+                partial = not (yield from send_percolations_before_deadline(percolations))
+                if partial:
+                    break
+            equivalent_strategies_matches = []
+            all_hits = {}
+            # logs += f'<br/> - Matching equivalent strategies : {equivalent_strategies}<br/>'
+            for strategy_index, strategy in enumerate(equivalent_strategies):
+                strategy_label = strategies.labels[group_index][strategy_index]
+                if strategy_label not in all_hits:
+                    all_hits[strategy_label] = {}
+                for criterion in strategy:
+                    if criterion in strategies_cache_keys[strategy_index]:
+                        cache_key = strategies_cache_keys[strategy_index][criterion]
+                        all_hits[strategy_label][criterion] = get_percolation(cache_key)['hits']
+                strategy_results = strategies_results[strategy_index] or frozenset()
                 equivalent_strategies_matches.append(len(strategy_results))
-                if equivalent_strategies_results is None:
-                    equivalent_strategies_results = strategy_results
-                else:
-                    # Union
-                    equivalent_strategies_results += strategy_results
-                    # Remove duplicates
-                    equivalent_strategies_results = list(set(equivalent_strategies_results))
                 # logs += f'Strategy : {strategy} : {len(strategy_results)} matches <br/>'
                 # logs += f'Equivalent strategies have {len(equivalent_strategies_results)} possibilities that match ' \
                 # f'one of the strategy<br/>'
             debug["strategies"].append(
                 {
                     "equivalent_strategies": [
-                        {"criteria": es, "matches": equivalent_strategies_matches[index]}
+                        {"criteria": list(es), "matches": equivalent_strategies_matches[index]}
                         for index, es in enumerate(equivalent_strategies)
                     ],
                     "possibilities": len(equivalent_strategies_results),
@@ -310,11 +992,18 @@ class Matcher:
             # Strategies stopped as soon as a first result is met for an equivalent_strategies
             all_highlights = {}
             if len(equivalent_strategies_results) > 0:
-                for strategy in all_hits:
+                # The evaluation of the next equivalent strategies is not needed anymore
+                for group, _ in running_groups.values():
+                    group.close()
+                running_groups.clear()
+                # Back from the integer ids to the entity ids
+                equivalent_strategies_results = id_table.lookup(equivalent_strategies_results)
+                results_set = set(equivalent_strategies_results)
+                for strategy in all_hits if with_highlights else []:
                     all_highlights[strategy] = {}
                     for matching_criteria in all_hits[strategy]:
                         for hit in all_hits[strategy][matching_criteria]:
-                            matching_ids = list(set(hit['_source'][field]) & set(equivalent_strategies_results))
+                            matching_ids = sorted(set(hit['_source'][field]) & results_set)
                             for matching_id in matching_ids:
                                 if matching_id not in all_highlights[strategy]:
                                     all_highlights[strategy][matching_id] = {}
@@ -324,8 +1013,9 @@ class Matcher:
                                 if current_highlight not in all_highlights[strategy][matching_id][matching_criteria]:
                                     all_highlights[strategy][matching_id][matching_criteria].append(current_highlight)
                 if post_treatment_results:
-                    equivalent_strategies_results = post_treatment_results(equivalent_strategies_results, self.es,
-                                                                           index_prefix)
+                    [equivalent_strategies_results] = yield [('post_treat', {
+                        'post_treatment_results': post_treatment_results, 'results': equivalent_strategies_results,
+                        'index_prefix': index_prefix})]
                 final_res = {
                     "highlights": all_highlights,
                     "logs": logs,
@@ -338,25 +1028,31 @@ class Matcher:
                 if method != "paysage":
                     final_res = filter_submatching_results_by_criterion(final_res, conditions)
                     final_res = filter_submatching_results_by_all(final_res, conditions)
-                final_res['enriched_results'] = self.enrich_results(final_res['results'], method)
+                [entities] = yield [('get_entities', {'ids': final_res['results'], 'method': method,
+                                                      'index_prefix': index_prefix})]
+                final_res['enriched_results'] = self.enrich_results(final_res['results'], method, index_prefix,
+                                                                    entities=entities)
                 if 'name' in conditions:
-                    similar_results = []
                     input_name = conditions['name']
+                    potential_results = []
+                    for potential_result in final_res['enriched_results']:
+                        # The names are normalized at load time, or here for the indices loaded before
+                        names_normalized = entities.get(potential_result['id'], {}).get('name_normalized')
+                        if not isinstance(names_normalized, list):
+                            potential_names = potential_result.get('name')
+                            if not isinstance(potential_names, list):
+                                potential_names = []
+                            names_normalized = [normalize_name(name) for name in potential_names]
+                        potential_results.append((potential_result['id'], names_normalized))
+                    similar_results = get_similar_results(input_name=input_name, potential_results=potential_results,
+                                                          pre_treatment_query=pre_treatment_query, threshold=0.8)
                     for potential_result in final_res['enriched_results']:
-                        is_similar = False
-                        potential_names = potential_result.get('name')
-                        if not isinstance(potential_names, list):
-                            potential_names = []
-                        for name in potential_names:
-                            current_similar = check_similarity(name, input_name, pre_treatment_query, 0.8)
-                            if current_similar:
-                                is_similar = True
-                                similar_results.append(potential_result['id'])
-                                break
-                        if is_similar is False:
+                        if potential_result['id'] not in similar_results:
                             final_res['logs'] += f"<br> removing potential_result['id'] as names potential_result['name'] not similar enough to input name {input_name}"
                     final_res['results'] = similar_results
-                    final_res['enriched_results'] = self.enrich_results(final_res['results'], method)
+                    final_res['enriched_results'] = [potential_result for potential_result in
+                                                     final_res['enriched_results']
+                                                     if potential_result['id'] in similar_results]
                 logs = final_res['logs']
                 other_ids = []
                 # logs += '<br><hr>Results: '
@@ -392,6 +1088,9 @@ class Matcher:
                     del final_res['logs']
                 final_res["highlights"] = clean_highlights(final_res.get("highlights"))
                 return final_res
+            no_result_groups.append(group_index)
+        for group, _ in running_groups.values():
+            group.close()
         logs += '<br/> No results found'
         final_res = {
             'highlights': {},
@@ -400,10 +1099,172 @@ class Matcher:
             'index_date': index_date,
             'version': __version__
         }
+        if partial:
+            # A fast answer without result, the next equivalent strategies being left unevaluated
+            logger.warning(f'deadline of {deadline_ms} ms exceeded after {len(no_result_groups)} equivalent strategies')
+            final_res['partial'] = True
+            final_res['evaluated_groups'] = no_result_groups
         if verbose:
             final_res['logs'] = logs
             final_res["debug"] = debug
         else:
             del final_res['highlights']
-        final_res['enriched_results'] = self.enrich_results(final_res['results'], method)
+        final_res['enriched_results'] = []
         return final_res
+
+
+class AsyncMatcher(Matcher):
+    """Matcher sending its requests to Elasticsearch with the AsyncElasticsearch client of the event loop.
+    The operations of a same step, and the matches of match_many, are run concurrently."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.async_es = get_async_elastic()
+        self.async_deadline_es = get_async_elastic(retry_on_timeout=False)
+
+    def get_async_client(self, request_timeout: float = None):
+        return self.async_es if request_timeout is None else self.async_deadline_es
+
+    async def percolate_async(self, percolations: list, field: str, request_timeout: float = None) -> list:
+        response = await self.get_async_client(request_timeout).msearch(
+            body=get_percolate_body(percolations=percolations, field=field), request_timeout=request_timeout)
+        return response.get('responses', [])
+
+    async def percolate_documents_async(self, index: str, criterion_queries: list, field: str) -> list:
+        body = get_percolate_documents_body(criterion_queries=criterion_queries, field=field)
+        response = await self.async_es.search(index=index, body=body)
+        return get_hits_by_document_response(response=response, nb_documents=len(criterion_queries))
+
+    async def open_point_in_time_async(self, index: str, request_timeout: float = None) -> str:
+        params = {'keep_alive': MATCHER_PIT_KEEP_ALIVE, 'request_timeout': request_timeout}
+        response = await self.get_async_client(request_timeout).transport.perform_request('POST', f'/{index}/_pit',
+                                                                                           params=params)
+        return response['id']
+
+    async def search_point_in_time_async(self, body: dict, request_timeout: float = None) -> dict:
+        return await self.get_async_client(request_timeout).transport.perform_request(
+            'POST', '/_search', body=body, params={'request_timeout': request_timeout})
+
+    async def close_point_in_time_async(self, pit_id: str) -> None:
+        try:
+            await self.async_es.transport.perform_request('DELETE', '/_pit', body={'id': pit_id})
+        except Exception as exception:
+            logger.error(f'close_point_in_time raises an error: {exception}')
+
+    async def get_index_version_async(self, method: str, index_prefix: str) -> str:
+        # The aliases are resolved once by the synchronous client, then read from the aliases cache
+        return await asyncio.to_thread(self.get_index_version, method=method, index_prefix=index_prefix)
+
+    async def get_vocabularies_async(self, criteria: list, index_prefix: str) -> dict:
+        # Read once per load of a source, then from the vocabularies cache
+        return await asyncio.to_thread(self.get_vocabularies, criteria=criteria, index_prefix=index_prefix)
+
+    async def analyze_async(self, index: str, analyzer: str, text: str) -> list:
+        try:
+            response = await self.async_es.indices.analyze(index=index, body={'analyzer': analyzer, 'text': text})
+        except Exception as exception:
+            logger.error(f'analyze {index} raises an error: {exception}')
+            return None
+        return [token['token'] for token in response.get('tokens', [])]
+
+    async def post_treat_async(self, post_treatment_results, results: list, index_prefix: str) -> list:
+        return await asyncio.to_thread(self.post_treat, post_treatment_results=post_treatment_results,
+                                       results=results, index_prefix=index_prefix)
+
+    async def get_entities_async(self, ids: list, method: str, index_prefix: str = 'matcher') -> dict:
+        if not ids:
+            return {}
+        index = get_index_name(index_name='entities', source=method, index_prefix=index_prefix)
+        try:
+            response = await self.async_es.mget(index=index, body={'ids': ids}, ignore=404)
+        except Exception as exception:
+            logger.error(f'get_entities {index} raises an error: {exception}')
+            return {}
+        return get_entities_by_id(response.get('docs', []))
+
+    async def run_async(self, steps):
+        try:
+            operations = next(steps)
+            while True:
+                try:
+                    results = await asyncio.gather(*[getattr(self, f'{name}_async')(**kwargs)
+                                                     for name, kwargs in operations])
+                except Exception as exception:
+                    operations = steps.throw(exception)
+                else:
+                    operations = steps.send(list(results))
+        except StopIteration as stop:
+            return stop.value
+
+    async def match(self, method: str = None, conditions: dict = None, strategies: list = None,
+                    pre_treatment_query=None, field: str = 'ids', stopwords_strategies: dict = None,
+                    post_treatment_results=None, cache: dict = None) -> dict:
+        return await self.run_async(self.match_steps(method=method, conditions=conditions, strategies=strategies,
+                                                     pre_treatment_query=pre_treatment_query, field=field,
+                                                     stopwords_strategies=stopwords_strategies,
+                                                     post_treatment_results=post_treatment_results, cache=cache))
+
+    async def match_many(self, method: str = None, conditions_list: list = None, strategies_list: list = None,
+                         pre_treatment_query=None, field: str = 'ids', stopwords_strategies: dict = None,
+                         post_treatment_results=None) -> list:
+        if conditions_list is None:
+            conditions_list = []
+        cache = {}
+        await self.run_async(self.prefetch_steps(conditions_list=conditions_list, strategies_list=strategies_list,
+                                                 pre_treatment_query=pre_treatment_query, field=field,
+                                                 stopwords_strategies=stopwords_strategies, cache=cache))
+        return list(await asyncio.gather(*[
+            self.match(method=method, conditions=conditions, strategies=strategies,
+                       pre_treatment_query=pre_treatment_query, field=field, stopwords_strategies=stopwords_strategies,
+                       post_treatment_results=post_treatment_results, cache=cache)
+            for conditions, strategies in zip(conditions_list, strategies_list)]))
+
+
+class MatcherType:
+    """Entry points of a matcher type (ie. ror), shared by its synchronous, asynchronous and list matches: the
+    strategies of the conditions, or its default ones compiled once, applied with its treatments."""
+
+    def __init__(self, method: str, field: str, default_strategies: list, stopwords_strategies: dict,
+                 pre_treatment_query=None, post_treatment_results=None, year_criterion: str = None) -> None:
+        self.method = method
+        self.field = field
+        self.stopwords_strategies = stopwords_strategies
+        self.default_plan = compile_strategies(default_strategies, stopwords_strategies)
+        self.pre_treatment_query = pre_treatment_query
+        self.post_treatment_results = post_treatment_results
+        # Criterion added to all the strategies if the conditions have a year, ie. rnsr_year
+        self.year_criterion = year_criterion
+
+    def get_strategies(self, conditions: dict) -> StrategyPlan:
+        strategies = conditions.get('strategies')
+        if strategies is None:
+            plan = self.default_plan
+        else:
+            plan = compile_strategies(strategies, self.stopwords_strategies)
+        if self.year_criterion and 'year' in conditions:
+            plan = plan.with_criterion(self.year_criterion)
+        return plan
+
+    def get_match_kwargs(self) -> dict:
+        return {'method': self.method, 'field': self.field, 'pre_treatment_query': self.pre_treatment_query,
+                'stopwords_strategies': self.stopwords_strategies,
+                'post_treatment_results': self.post_treatment_results}
+
+    def match(self, conditions: dict, matcher: Matcher = None) -> dict:
+        if matcher is None:
+            matcher = Matcher()
+        return matcher.match(conditions=conditions, strategies=self.get_strategies(conditions),
+                             **self.get_match_kwargs())
+
+    async def match_async(self, conditions: dict, matcher: AsyncMatcher = None) -> dict:
+        if matcher is None:
+            matcher = AsyncMatcher()
+        return await matcher.match(conditions=conditions, strategies=self.get_strategies(conditions),
+                                   **self.get_match_kwargs())
+
+    def match_list(self, conditions_list: list, matcher: Matcher = None) -> list:
+        if matcher is None:
+            matcher = Matcher()
+        return matcher.match_many(conditions_list=conditions_list,
+                                  strategies_list=[self.get_strategies(conditions) for conditions in conditions_list],
+                                  **self.get_match_kwargs())
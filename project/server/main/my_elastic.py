@@ -1,18 +1,46 @@
-from elasticsearch import Elasticsearch, helpers
+import asyncio
+import datetime
+import os
+import threading
+import weakref
 
-from project.server.main.config import ELASTICSEARCH_HOST, ELASTICSEARCH_LOGIN, ELASTICSEARCH_PASSWORD
+from elasticsearch import AsyncElasticsearch, Elasticsearch, helpers
+
+from project.server.main.cache import aliases_cache, percolation_cache
+from project.server.main.config import BULK_CHUNK_SIZE, BULK_THREAD_COUNT, ELASTICSEARCH_HOST, \
+    ELASTICSEARCH_HTTP_COMPRESS, ELASTICSEARCH_LOGIN, ELASTICSEARCH_MAX_RETRIES, ELASTICSEARCH_MAXSIZE, \
+    ELASTICSEARCH_PASSWORD, ELASTICSEARCH_TIMEOUT, LOAD_MAX_NUM_SEGMENTS, LOAD_NUMBER_OF_REPLICAS
+from project.server.main.elastic_utils import add_document_fingerprint
 from project.server.main.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Separator of the alias marking the generation of the last incremental load of the index behind an alias
+GENERATION_SEPARATOR = '@'
+# Settings of the new indices during their bulk load, until finalize_index
+BULK_INDEX_SETTINGS = {'number_of_replicas': 0, 'refresh_interval': '-1'}
+
+
+def get_bulk_actions(actions, indices: set):
+    for action in actions:
+        indices.add(action['_index'])
+        yield add_document_fingerprint(action)
+
+
+def get_client_kwargs(timeout: int = ELASTICSEARCH_TIMEOUT, max_retries: int = ELASTICSEARCH_MAX_RETRIES,
+                      retry_on_timeout: bool = True, maxsize: int = ELASTICSEARCH_MAXSIZE,
+                      http_compress: bool = ELASTICSEARCH_HTTP_COMPRESS) -> dict:
+    # maxsize is the number of kept alive connections per node
+    kwargs = {'hosts': ELASTICSEARCH_HOST, 'timeout': timeout, 'max_retries': max_retries,
+              'retry_on_timeout': retry_on_timeout, 'maxsize': maxsize, 'http_compress': http_compress}
+    if ELASTICSEARCH_LOGIN:
+        kwargs['http_auth'] = (ELASTICSEARCH_LOGIN, ELASTICSEARCH_PASSWORD)
+    return kwargs
+
 
 class MyElastic(Elasticsearch):
-    def __init__(self) -> None:
-        if ELASTICSEARCH_LOGIN:
-            super().__init__(hosts=ELASTICSEARCH_HOST, http_auth=(ELASTICSEARCH_LOGIN, ELASTICSEARCH_PASSWORD),
-                             timeout=30, max_retries=10, retry_on_timeout=True)
-        else:
-            super().__init__(hosts=ELASTICSEARCH_HOST, timeout=30, max_retries=10, retry_on_timeout=True)
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**get_client_kwargs(**kwargs))
 
     def exception_handler(func):
         def inner_function(self, *args, **kwargs):
@@ -25,15 +53,36 @@ class MyElastic(Elasticsearch):
         return inner_function
 
     @exception_handler
-    def create_index(self, index: str = None, mappings: dict = None, settings: dict = None):
+    def create_index(self, index: str = None, mappings: dict = None, settings: dict = None, incremental: bool = False):
         if mappings is None:
             mappings = {}
         if settings is None:
             settings = {}
+        if incremental:
+            if self.indices.exists_alias(name=index):
+                # The live index behind the alias is updated in place by parallel_bulk
+                return None
+            # An index new in an incremental load is created dated, then aliased like in a full load
+            prefix, name = index.split('_', 1)
+            dated_index = f'{prefix}-{datetime.datetime.today().strftime("%Y%m%d%H%M%S")}_{name}'
+            response = self.indices.create(index=dated_index, body={'mappings': mappings, 'settings': settings},
+                                           ignore=400)
+            self.update_index_alias(my_alias=index, new_index=dated_index)
+            return response
         self.delete_index(index=index)
-        response = self.indices.create(index=index, body={'mappings': mappings, 'settings': settings}, ignore=400)
+        response = self.indices.create(index=index, body={'mappings': mappings,
+                                                          'settings': {**settings, **BULK_INDEX_SETTINGS}}, ignore=400)
         return response
 
+    @exception_handler
+    def finalize_index(self, index: str = None) -> None:
+        """Make the indices loaded in bulk ready to be served, before their aliases are moved: as they are not written
+        anymore, they are force merged for faster percolations, replicated and blocked for writes."""
+        if LOAD_MAX_NUM_SEGMENTS > 0:
+            self.indices.forcemerge(index=index, max_num_segments=LOAD_MAX_NUM_SEGMENTS, request_timeout=3600)
+        self.indices.put_settings(index=index, body={'index': {'number_of_replicas': LOAD_NUMBER_OF_REPLICAS,
+                                                               'refresh_interval': None, 'blocks.write': True}})
+
     @exception_handler
     def delete_index(self, index: str = None):
         return self.indices.delete(index=index, ignore=404)
@@ -42,11 +91,60 @@ class MyElastic(Elasticsearch):
     def delete_all_by_query(self, index: str = None):
         return self.delete_by_query(index=index, body={'query': {'match_all': {}}}, refresh=True)
 
-    @exception_handler
-    def parallel_bulk(self, actions: list = None) -> None:
-        for success, info in helpers.parallel_bulk(client=self, actions=actions, request_timeout=60, refresh=True):
-            if not success:
-                logger.warning(f'A document failed: {info}')
+    def parallel_bulk(self, actions: list = None, incremental: bool = False) -> None:
+        """Index the documents with stable ids and fingerprints. In incremental mode, only the documents added or
+        changed since the last load are indexed in the live indices behind the aliases, and the ones not loaded anymore
+        are deleted. A failure is raised, so that the load is not reported as a success."""
+        indices = set()
+        actions = get_bulk_actions(actions=actions, indices=indices)
+        stats = {}
+        if incremental:
+            actions = self.get_delta_actions(actions=actions, stats=stats)
+        try:
+            for success, info in helpers.parallel_bulk(client=self, actions=actions, request_timeout=60,
+                                                       chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREAD_COUNT):
+                if not success:
+                    logger.warning(f'A document failed: {info}')
+            # The indices are refreshed once, after all their documents are indexed
+            if indices:
+                self.indices.refresh(index=','.join(sorted(indices)))
+        finally:
+            # The live indices unblocked by get_delta_actions are blocked again, even if the load failed
+            if stats:
+                self.indices.put_settings(index=','.join(sorted(stats)), body={'index': {'blocks.write': True}})
+        for alias, alias_stats in stats.items():
+            logger.debug(f'incremental load of {alias}: {alias_stats}')
+            if alias_stats['added'] or alias_stats['updated'] or alias_stats['deleted']:
+                self.update_index_generation(my_alias=alias)
+
+    def get_fingerprints(self, index: str) -> dict:
+        hits = helpers.scan(client=self, index=index, query={'query': {'match_all': {}}, '_source': ['fingerprint']})
+        return {hit['_id']: hit.get('_source', {}).get('fingerprint') for hit in hits}
+
+    def get_delta_actions(self, actions, stats: dict):
+        """Yield the actions whose document is not in its index with the same fingerprint, then the deletions of the
+        documents of these indices not in the actions. The number of documents added, updated, deleted and unchanged
+        are counted by index in stats."""
+        fingerprints = {}
+        for action in actions:
+            index = action['_index']
+            if index not in fingerprints:
+                stats[index] = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+                # The live indices are blocked for writes by finalize_index, until the end of the incremental load
+                self.indices.put_settings(index=index, body={'index': {'blocks.write': False}})
+                fingerprints[index] = self.get_fingerprints(index=index)
+            if action['_id'] not in fingerprints[index]:
+                stats[index]['added'] += 1
+            elif fingerprints[index].pop(action['_id']) == action['fingerprint']:
+                stats[index]['unchanged'] += 1
+                continue
+            else:
+                stats[index]['updated'] += 1
+            yield action
+        for index, remaining_fingerprints in fingerprints.items():
+            stats[index]['deleted'] = len(remaining_fingerprints)
+            for document_id in remaining_fingerprints:
+                yield {'_op_type': 'delete', '_index': index, '_id': document_id}
 
     @exception_handler
     def delete_non_dated_indices(self, index_prefix):
@@ -60,6 +158,45 @@ class MyElastic(Elasticsearch):
                     logger.debug(f'{idx} is not a dated index, lets delete it')
                     self.indices.delete(index=idx, ignore=[400, 404])
 
+    def get_index_from_alias(self, alias: str) -> str:
+        """Return the index currently behind the alias (or the alias itself if it is not an alias), followed by the
+        generation of its last incremental load if any, so that the caches keyed by it are renewed by each load.
+        The aliases of a source, ie. matcher_ror_*, return the indices behind all of them, so that an incremental load
+        of any of them renews the version of the source.
+        The aliases are resolved by prefix, ie. all the aliases of a matcher with a single request."""
+        index = aliases_cache.get(alias)
+        if index is None:
+            prefix = alias.split('_')[0]
+            try:
+                aliases_data = self.indices.get_alias(name=f'{prefix}_*', ignore=404)
+            except Exception as exception:
+                logger.error(f'get_index_from_alias {alias} raises an error: {exception}')
+                return alias
+            source_versions = {}
+            for idx, idx_data in aliases_data.items():
+                if not isinstance(idx_data, dict):
+                    continue
+                idx_aliases = idx_data.get('aliases', {})
+                for current_alias in idx_aliases:
+                    if GENERATION_SEPARATOR in current_alias:
+                        continue
+                    generations = [idx_alias[len(current_alias):] for idx_alias in idx_aliases
+                                   if idx_alias.startswith(f'{current_alias}{GENERATION_SEPARATOR}')]
+                    version = f'{idx}{max(generations)}' if generations else idx
+                    aliases_cache.set(current_alias, version)
+                    source_versions.setdefault(get_source_alias(current_alias), []).append(version)
+                    if current_alias == alias:
+                        index = version
+            for source_alias, versions in source_versions.items():
+                version = ';'.join(sorted(versions))
+                aliases_cache.set(source_alias, version)
+                if source_alias == alias:
+                    index = version
+            if index is None:
+                index = alias
+                aliases_cache.set(alias, index)
+        return index
+
     @exception_handler
     def update_index_alias(self, my_alias, new_index):
         logger.debug(f'update_index_alias {my_alias} {new_index}')
@@ -80,7 +217,82 @@ class MyElastic(Elasticsearch):
         actions.append({'add': {'index': new_index, 'alias': my_alias}})
         logger.debug(f'add alias {my_alias} for index {new_index}')
         self.indices.update_aliases({'actions': actions})
+        aliases_cache.set(my_alias, new_index)
+        aliases_cache.invalidate(lambda key: key == get_source_alias(my_alias))
+        nb_invalidated = percolation_cache.invalidate(lambda key: key[0] == my_alias)
+        logger.debug(f'{nb_invalidated} percolations cached for alias {my_alias} invalidated')
 
         if old_index:
             logger.debug(f'delete index {old_index}')
             self.indices.delete(index=old_index, ignore=[400, 404])
+
+    @exception_handler
+    def update_index_generation(self, my_alias: str) -> None:
+        """Mark the index behind the alias, updated in place by an incremental load, with a new generation."""
+        generation = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
+        actions = []
+        for idx in self.indices.get_alias(name=my_alias):
+            for idx_alias in self.indices.get_alias(index=idx)[idx].get('aliases', {}):
+                if idx_alias.startswith(f'{my_alias}{GENERATION_SEPARATOR}'):
+                    actions.append({'remove': {'index': idx, 'alias': idx_alias}})
+            actions.append({'add': {'index': idx, 'alias': f'{my_alias}{GENERATION_SEPARATOR}{generation}'}})
+        self.indices.update_aliases({'actions': actions})
+        aliases_cache.invalidate(lambda key: key in [my_alias, get_source_alias(my_alias)])
+        nb_invalidated = percolation_cache.invalidate(lambda key: key[0] == my_alias)
+        logger.debug(f'generation {generation} of {my_alias}, {nb_invalidated} percolations cached invalidated')
+
+
+def get_source_alias(alias: str) -> str:
+    # ex: matcher_ror_city -> matcher_ror_*
+    return '_'.join(alias.split('_')[0:2] + ['*'])
+
+
+# Clients of the process, one per configuration
+_clients = {}
+_clients_lock = threading.Lock()
+# Asynchronous clients of the process, by configuration for each event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_elastic(**kwargs) -> MyElastic:
+    """Return the MyElastic client of the process for this configuration (see get_client_kwargs for the arguments).
+    The client and its connection pool are thread-safe, and shared by all the matchers, loaders and tasks."""
+    key = tuple(sorted(kwargs.items()))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = MyElastic(**kwargs)
+                _clients[key] = client
+    return client
+
+
+def get_async_elastic(**kwargs) -> AsyncElasticsearch:
+    """Return the AsyncElasticsearch client of the running event loop for this configuration, configured like
+    MyElastic. The aiohttp session of a client is bound to the event loop of its first request."""
+    loop = asyncio.get_running_loop()
+    key = tuple(sorted(kwargs.items()))
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(key)
+    if client is None:
+        client = AsyncElasticsearch(**get_client_kwargs(**kwargs))
+        clients[key] = client
+    return client
+
+
+async def close_async_elastic() -> None:
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def reset_elastic_clients() -> None:
+    # The connections of the parent process must not be used by a forked one, ie. by the rq work horses
+    global _clients_lock
+    _clients.clear()
+    _async_clients.clear()
+    _clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_elastic_clients)
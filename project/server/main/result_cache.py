@@ -0,0 +1,93 @@
+import hashlib
+import json
+import redis
+import time
+
+from project.server.main.config import REDIS_URL, RESULT_CACHE_BACKEND, RESULT_CACHE_TTL
+from project.server.main.elastic_utils import get_index_name
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Sources whose indices are used by each matcher type
+MATCHER_SOURCES = {
+    'country': ['country', 'grid', 'rnsr', 'ror'],
+    'grid': ['grid', 'ror'],
+    'paysage': ['paysage'],
+    'rnsr': ['rnsr'],
+    'ror': ['ror']
+}
+
+
+class NoResultCache:
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        return None
+
+    def clear(self) -> int:
+        return 0
+
+
+class RedisResultCache:
+    """Match results shared by all the web and worker processes through Redis.
+    If Redis is not reachable, the cache is bypassed for retry_delay seconds."""
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = RESULT_CACHE_TTL, prefix: str = 'matcher-result',
+                 retry_delay: int = 60) -> None:
+        self.ttl = ttl
+        self.prefix = prefix
+        self.retry_delay = retry_delay
+        self._client = redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self._disabled_until = 0
+
+    def _call(self, func, *args, **kwargs):
+        if time.monotonic() < self._disabled_until:
+            return None
+        try:
+            return func(*args, **kwargs)
+        except redis.exceptions.RedisError as error:
+            logger.error(f'Result cache disabled for {self.retry_delay}s because of Redis error: {error}')
+            self._disabled_until = time.monotonic() + self.retry_delay
+            return None
+
+    def get(self, key: str):
+        value = self._call(self._client.get, f'{self.prefix}:{key}')
+        return json.loads(value) if value else None
+
+    def set(self, key: str, value: dict) -> None:
+        self._call(self._client.set, f'{self.prefix}:{key}', json.dumps(value), ex=self.ttl)
+
+    def clear(self) -> int:
+        keys = self._call(lambda: list(self._client.scan_iter(match=f'{self.prefix}:*', count=1000))) or []
+        for keys_chunk in [keys[i:i + 1000] for i in range(0, len(keys), 1000)]:
+            self._call(self._client.delete, *keys_chunk)
+        return len(keys)
+
+
+RESULT_CACHE_BACKENDS = {
+    'none': NoResultCache,
+    'redis': RedisResultCache
+}
+
+result_cache = RESULT_CACHE_BACKENDS[RESULT_CACHE_BACKEND]()
+
+
+def get_index_version(es, matcher_type: str, index_prefix: str) -> str:
+    """Version of all the indices of the sources of the matcher type, changed by any load of any of them."""
+    indices = []
+    for source in MATCHER_SOURCES.get(matcher_type, []):
+        alias = get_index_name(index_name='*', source=source, index_prefix=index_prefix)
+        indices.append(es.get_index_from_alias(alias))
+    return ';'.join(indices)
+
+
+def get_result_cache_key(es, conditions: dict) -> str:
+    """Canonical hash of the conditions and of the version of the indices serving them."""
+    matcher_type = conditions.get('type', 'rnsr').lower()
+    index_prefix = conditions.get('index_prefix', 'matcher')
+    canonical_conditions = json.dumps({**conditions, 'type': matcher_type}, sort_keys=True, ensure_ascii=False,
+                                      default=str)
+    index_version = get_index_version(es=es, matcher_type=matcher_type, index_prefix=index_prefix)
+    return hashlib.sha256(f'{canonical_conditions}|{index_version}'.encode('utf-8')).hexdigest()
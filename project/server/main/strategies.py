@@ -0,0 +1,125 @@
+from functools import lru_cache
+from types import MappingProxyType
+
+from project.server.main.config import MATCHER_HIT_BUDGET, MATCHER_HIT_BUDGETS
+from project.server.main.elastic_utils import get_index_name
+from project.server.main.utils import get_stopwords_pattern
+
+# Criteria from the most to the least selective, the criteria of a strategy being percolated in this order
+CRITERIA_SELECTIVITY = ['id', 'grid_id', 'code_number', 'web_url', 'web_domain', 'name_unique', 'acronym_unique',
+                        'acronym', 'name', 'supervisor_acronym', 'supervisor_name', 'code_prefix', 'city',
+                        'cities_by_region', 'city_zone_emploi', 'zone_emploi', 'city_nuts_level2', 'department',
+                        'region', 'parent', 'subdivision_name', 'subdivision_code', 'year', 'country', 'country_code',
+                        'alpha2', 'alpha3']
+# Criteria identifying an entity, a strategy holding one of them being expected to yield at most one result
+IDENTIFYING_CRITERIA = ['id', 'grid_id', 'code_number', 'web_url', 'web_domain', 'name_unique', 'acronym_unique']
+
+
+def get_criterion_field(criterion: str) -> str:
+    # ex: rnsr_supervisor_name -> supervisor_name
+    return '_'.join(criterion.split('_')[1:])
+
+
+def get_criterion_rank(criterion: str) -> int:
+    criterion_field = get_criterion_field(criterion)
+    if criterion_field in CRITERIA_SELECTIVITY:
+        return CRITERIA_SELECTIVITY.index(criterion_field)
+    return len(CRITERIA_SELECTIVITY)
+
+
+def get_hit_budget(criterion: str) -> int:
+    # The budget of the criterion (ie. grid_city), else of its field (ie. city), else the default one
+    return int(MATCHER_HIT_BUDGETS.get(criterion, MATCHER_HIT_BUDGETS.get(get_criterion_field(criterion),
+                                                                          MATCHER_HIT_BUDGET)))
+
+
+@lru_cache(maxsize=10000)
+def get_criterion_index(criterion: str, index_prefix: str) -> str:
+    return get_index_name(index_name=criterion, source='', index_prefix=index_prefix)
+
+
+class StrategyPlan:
+    """Immutable execution plan of a list of equivalent strategies, built once by compile_strategies."""
+
+    __slots__ = ('groups', 'stopwords_strategies', 'criteria', 'criteria_fields', 'stopwords_patterns',
+                 'ranked_groups', 'groups_criteria', 'groups_first_criteria', 'groups_highlighted', 'labels',
+                 'hit_budgets')
+
+    def __init__(self, groups: tuple, stopwords_strategies: tuple) -> None:
+        self.groups = groups
+        self.stopwords_strategies = stopwords_strategies
+        # Distinct criteria, in the order of their first use
+        self.criteria = tuple(dict.fromkeys([criterion for group in groups for strategy in group
+                                             for criterion in strategy]))
+        self.criteria_fields = MappingProxyType({criterion: get_criterion_field(criterion)
+                                                 for criterion in self.criteria})
+        self.stopwords_patterns = MappingProxyType({criterion: get_stopwords_pattern(stopwords)
+                                                    for criterion, stopwords in stopwords_strategies
+                                                    if criterion in self.criteria_fields})
+        # Strategies whose criteria are sorted from the most to the least selective, for the candidate filter
+        self.ranked_groups = tuple([tuple([tuple(sorted(strategy, key=get_criterion_rank)) for strategy in group])
+                                    for group in groups])
+        self.groups_criteria = tuple([tuple(dict.fromkeys([criterion for strategy in group for criterion in strategy]))
+                                      for group in groups])
+        self.groups_first_criteria = tuple([tuple(dict.fromkeys([strategy[0] for strategy in group if strategy]))
+                                            for group in self.ranked_groups])
+        # Equivalent strategies expected to yield several results, whose percolations are highlighted at once for the
+        # submatching filters
+        self.groups_highlighted = tuple([not all(any(get_criterion_field(criterion) in IDENTIFYING_CRITERIA
+                                                     for criterion in strategy) for strategy in group)
+                                         for group in groups])
+        self.labels = tuple([tuple([';'.join(strategy) for strategy in group]) for group in groups])
+        self.hit_budgets = MappingProxyType({criterion: get_hit_budget(criterion) for criterion in self.criteria})
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __getitem__(self, index):
+        return self.groups[index]
+
+    def with_criterion(self, criterion: str) -> 'StrategyPlan':
+        """Plan whose strategies all end with this extra criterion, ie. rnsr_year."""
+        return add_criterion(self, criterion)
+
+    def get_criterion_query(self, criterion: str, conditions: dict, pre_treatment_query,
+                            pre_treated: dict = None) -> str:
+        """Query of the criterion: its own condition (ie. supervisor_name for ror_supervisor_name) or the query,
+        pre-treated and without the stopwords of the criterion. The pre-treated conditions are kept in pre_treated if
+        given."""
+        field = self.criteria_fields[criterion]
+        if field not in conditions:
+            field = 'query'
+        if pre_treated is None:
+            pre_treated = {}
+        if field not in pre_treated:
+            pre_treated[field] = pre_treatment_query(conditions.get(field, ''))
+        criterion_query = pre_treated[field]
+        if criterion in self.stopwords_patterns:
+            criterion_query = self.stopwords_patterns[criterion].sub('', criterion_query)
+        return criterion_query
+
+
+@lru_cache(maxsize=1000)
+def build_plan(groups: tuple, stopwords_strategies: tuple) -> StrategyPlan:
+    return StrategyPlan(groups=groups, stopwords_strategies=stopwords_strategies)
+
+
+@lru_cache(maxsize=1000)
+def add_criterion(plan: StrategyPlan, criterion: str) -> StrategyPlan:
+    groups = tuple([tuple([strategy + (criterion,) for strategy in group]) for group in plan.groups])
+    return build_plan(groups=groups, stopwords_strategies=plan.stopwords_strategies)
+
+
+def compile_strategies(strategies, stopwords_strategies: dict = None) -> StrategyPlan:
+    """Compile a list of equivalent strategies (ie. [[['grid_name', 'grid_city']]]) and the stopwords of their
+    criteria into a plan, cached by their content. A plan is returned as is."""
+    if isinstance(strategies, StrategyPlan):
+        return strategies
+    groups = tuple([tuple([tuple(strategy) for strategy in group]) for group in strategies])
+    if stopwords_strategies is None:
+        stopwords_strategies = {}
+    stopwords = tuple(sorted([(criterion, tuple(words)) for criterion, words in stopwords_strategies.items()]))
+    return build_plan(groups=groups, stopwords_strategies=stopwords)
@@ -1,19 +1,17 @@
-import datetime
+import asyncio
 from project.server.main.affiliation_matcher import check_matcher_health, enrich_and_filter_publications_by_country,\
-    get_matches
-from project.server.main.load_country import load_country
-from project.server.main.load_grid import load_grid
-from project.server.main.load_rnsr import load_rnsr
-from project.server.main.load_ror import load_ror
-from project.server.main.load_wikidata import load_wikidata
-from project.server.main.load_paysage import load_paysage
+    get_matches_list
+from project.server.main.config import MATCHER_BATCH_SIZE
+from project.server.main.load_sources import ALL_SOURCES, load_sources, LOADERS
 from project.server.main.logger import get_logger
-from project.server.main.match_country import match_country
-from project.server.main.match_grid import match_grid
-from project.server.main.match_rnsr import match_rnsr
-from project.server.main.match_ror import match_ror
-from project.server.main.match_paysage import match_paysage
-from project.server.main.my_elastic import MyElastic
+from project.server.main.match_country import match_country, match_country_async
+from project.server.main.match_grid import match_grid, match_grid_async
+from project.server.main.match_rnsr import match_rnsr, match_rnsr_async
+from project.server.main.match_ror import match_ror, match_ror_async
+from project.server.main.match_paysage import match_paysage, match_paysage_async
+from project.server.main.my_elastic import get_elastic
+from project.server.main.result_cache import get_result_cache_key, result_cache
+from project.server.main.utils import chunks
 
 logger = get_logger(__name__)
 
@@ -37,8 +35,9 @@ def create_task_affiliations_list(args: dict = None) -> dict:
         logger.debug('No valid affiliations args')
     res = []
     match_types = args.get('match_types', ['grid', 'rnsr'])
-    for aff in affiliations:
-        res.append({'query': aff, 'matches': get_matches(aff, match_types)})
+    for affiliations_chunk in chunks(affiliations, MATCHER_BATCH_SIZE):
+        matches = get_matches_list(affiliations_chunk, match_types)
+        res += [{'query': aff, 'matches': m} for aff, m in zip(affiliations_chunk, matches)]
     logger.debug(f'End matching {len(affiliations)} affiliations.')
     return res
 
@@ -48,43 +47,27 @@ def create_task_load(args: dict = None) -> dict:
         args = {}
     matcher_type = args.get('type', 'all').lower()
     index_prefix = args.get('index_prefix', 'matcher').lower()
-    es = MyElastic()
-    es.delete_non_dated_indices(index_prefix=index_prefix)
-    today = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
-    index_prefix_dated = f'{index_prefix}-{today}'
-    # the indices are created with the datetime in the name
-    result = {}
+    incremental = str(args.get('incremental', 'false')).lower() == 'true'
     if matcher_type == 'all':
-        result.update(load_country(index_prefix=index_prefix_dated))
-        result.update(load_grid(index_prefix=index_prefix_dated))
-        result.update(load_rnsr(index_prefix=index_prefix_dated))
-        result.update(load_ror(index_prefix=index_prefix_dated))
-        result.update(load_paysage(index_prefix=index_prefix_dated))
-    elif matcher_type == 'country':
-        result.update(load_country(index_prefix=index_prefix_dated))
-    elif matcher_type == 'grid':
-        result.update(load_grid(index_prefix=index_prefix_dated))
-    elif matcher_type == 'rnsr':
-        result.update(load_rnsr(index_prefix=index_prefix_dated))
-    elif matcher_type == 'ror':
-        result.update(load_ror(index_prefix=index_prefix_dated))
-    elif matcher_type == 'wikidata':
-        result.update(load_wikidata(index_prefix=index_prefix_dated))
-    elif matcher_type == "paysage":
-        result.update(load_paysage(index_prefix=index_prefix_dated))
+        sources = ALL_SOURCES
+    elif matcher_type in LOADERS:
+        sources = [matcher_type]
     else:
-        result = {'Error': f'Matcher type {matcher_type} unknown'}
-    # An alias is the put on the newly created indices
-    for idx in list(es.indices.get('*').keys()):
-        if idx.startswith(index_prefix_dated):
-            current_alias = idx.replace(index_prefix_dated, index_prefix)
-            es.update_index_alias(my_alias=current_alias, new_index=idx)
-    return result
+        return {'Error': f'Matcher type {matcher_type} unknown'}
+    return load_sources(sources=sources, index_prefix=index_prefix, incremental=incremental)
 
 
 def create_task_match(args: dict = None) -> dict:
     if args is None:
         args = {}
+    cache_key = None
+    try:
+        cache_key = get_result_cache_key(es=get_elastic(), conditions=args)
+        result = result_cache.get(cache_key)
+        if result is not None:
+            return result
+    except Exception as error:
+        logger.error(f'Error while reading the result cache: {error}')
     matcher_type = args.get('type', 'rnsr').lower()
     if matcher_type == 'country':
         result = match_country(args)
@@ -98,4 +81,36 @@ def create_task_match(args: dict = None) -> dict:
         result = match_paysage(args)
     else:
         result = {'Error': f'Matcher type {matcher_type} unknown'}
+    if cache_key and 'Error' not in result and not result.get('partial'):
+        result_cache.set(cache_key, result)
+    return result
+
+
+async def create_task_match_async(args: dict = None) -> dict:
+    """Same as create_task_match, with the requests to Elasticsearch of the matcher sent asynchronously."""
+    if args is None:
+        args = {}
+    cache_key = None
+    try:
+        cache_key = await asyncio.to_thread(get_result_cache_key, es=get_elastic(), conditions=args)
+        result = await asyncio.to_thread(result_cache.get, cache_key)
+        if result is not None:
+            return result
+    except Exception as error:
+        logger.error(f'Error while reading the result cache: {error}')
+    matcher_type = args.get('type', 'rnsr').lower()
+    if matcher_type == 'country':
+        result = await match_country_async(args)
+    elif matcher_type == 'grid':
+        result = await match_grid_async(args)
+    elif matcher_type == 'rnsr':
+        result = await match_rnsr_async(args)
+    elif matcher_type == 'ror':
+        result = await match_ror_async(args)
+    elif matcher_type == "paysage":
+        result = await match_paysage_async(args)
+    else:
+        result = {'Error': f'Matcher type {matcher_type} unknown'}
+    if cache_key and 'Error' not in result and not result.get('partial'):
+        await asyncio.to_thread(result_cache.set, cache_key, result)
     return result
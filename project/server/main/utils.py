@@ -1,19 +1,21 @@
-import os
+import html
+import io
+import json
 import pandas as pd
 import re
-import requests
-import shutil
 import string
 import unicodedata
 
-from tempfile import mkdtemp
+from functools import lru_cache
 from zipfile import ZipFile
 
 from project.server.main.logger import get_logger
 
 logger = get_logger(__name__)
 
-from project.server.main.config import CHUNK_SIZE, ZONE_EMPLOI_INSEE_DUMP, GEONAMES_DUMP_URL
+from project.server.main.cache import load_inputs_cache
+from project.server.main.config import STREAM_CHUNK_SIZE, ZONE_EMPLOI_INSEE_DUMP, GEONAMES_DUMP_URL
+from project.server.main.download import download
 
 ENGLISH_STOP = ['and', 'are', 'as', 'be', 'but', 'by', 'for', 'if', 'in', 'into', 'is', 'it', 'no',
                 'not', 'of', 'on', 'or', 'such', 'that', 'the', 'their', 'then', 'there', 'these', 'they', 'this',
@@ -60,13 +62,38 @@ COUNTRY_SWITCHER = {
             'vn': ['vietnam']
         }
 
+# France, Guadeloupe, Martinique, Guyane, Reunion, Mayotte
+GEONAMES_FRENCH_CODES = ["FR", "GP", "MQ", "GF", "RE", "YT"]
+
 CITY_COUNTRY = {
         'hong kong': ['hong kong']
     }
 
+HIGHLIGHT_PATTERN = re.compile(r'<em>(.*?)</em>', re.DOTALL)
+
+
+@lru_cache(maxsize=100000)
+def get_fragment_tokens(fragment: str) -> frozenset:
+    return frozenset([html.unescape(token) for token in HIGHLIGHT_PATTERN.findall(fragment)])
+
+
+def get_highlighted_tokens(highlights) -> frozenset:
+    """Tokens between <em> tags of a highlight fragment, or of a (nested) list of fragments."""
+    if isinstance(highlights, str):
+        return get_fragment_tokens(highlights)
+    tokens = frozenset()
+    for highlight in highlights:
+        tokens = tokens | get_highlighted_tokens(highlight)
+    return tokens
+
+
+@lru_cache(maxsize=1000)
+def get_stopwords_pattern(stopwords: tuple):
+    return re.compile(r'\b(' + r'|'.join(stopwords) + r')\b\s*', re.IGNORECASE)
+
+
 def remove_stop(text: str, stopwords: list) -> str:
-    pattern = re.compile(r'\b(' + r'|'.join(stopwords) + r')\b\s*', re.IGNORECASE)
-    return pattern.sub('', text)
+    return get_stopwords_pattern(tuple(stopwords)).sub('', text)
 
 
 def remove_parenthesis(x):
@@ -109,6 +136,57 @@ def chunks(lst: list, n: int) -> list:
         yield lst[i:i + n]
 
 
+def iter_json_array(file, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield the elements of the JSON array of a text file one by one, reading it by chunks of chunk_size characters,
+    so that only the current element is held in memory."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    end_of_file = False
+    # Next expected token: '[', the first element or ']', ',' or ']', an element
+    expected = 'start'
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if end_of_file:
+                raise ValueError('Unexpected end of the JSON array')
+            buffer, position = file.read(chunk_size), 0
+            end_of_file = not buffer
+            continue
+        character = buffer[position]
+        if expected == 'start':
+            if character != '[':
+                raise ValueError(f'Expected a JSON array, found {character!r}')
+            position += 1
+            expected = 'first'
+        elif expected in ['first', 'separator'] and character == ']':
+            return
+        elif expected == 'separator':
+            if character != ',':
+                raise ValueError(f'Expected , or ] in the JSON array, found {character!r}')
+            position += 1
+            expected = 'element'
+        else:
+            try:
+                element, element_end = decoder.raw_decode(buffer, position)
+                # A number may go on in the next chunk, until a delimiter is read
+                complete = end_of_file or (element_end < len(buffer) and (
+                    not isinstance(element, (int, float)) or buffer[element_end] in ' \t\n\r,]'))
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                complete = False
+            if not complete:
+                chunk = file.read(chunk_size)
+                buffer, position = buffer[position:] + chunk, 0
+                end_of_file = not chunk
+                continue
+            yield element
+            position = element_end
+            expected = 'separator'
+
+
 def get_token_basic(x):
     return x.split(' ')
 
@@ -156,6 +234,11 @@ def normalize_text(text: str = None, remove_separator: bool = True, re_order: bo
     return text.strip() or ""
 
 
+def normalize_name(name: str) -> str:
+    """Normalization of the names compared by the name similarity gate of the matcher."""
+    return normalize_text(text=name, remove_separator=False, re_order=True, to_lower=True)
+
+
 def get_alpha2_from_french(user_input):
     ref = {
         'Afrique du Sud': 'za',
@@ -184,32 +267,29 @@ def get_alpha2_from_french(user_input):
 
 def download_geonames_data(country: str) -> dict:
     assert country.isupper() and len(country) == 2
+    # Parsed once by load, for all the sources using it
+    data = load_inputs_cache.get(f"geonames_{country}")
+    if data is not None:
+        return data
     geonames_url = f"{GEONAMES_DUMP_URL}/{country}.zip"
-    geonames_downloaded_file = f"{country}.zip"
-    geonames_unzipped_folder = mkdtemp()
-    geonames_unzipped_file = f"{geonames_unzipped_folder}/{country}.txt"
     COL_GEO_ID = 0  # Geoname ID column
     COL_FEAT_CLASS = 6  # Geoname feature class column http://www.geonames.org/export/codes.html
     COL_GEO_DEP = 11  # Department code column
 
-    # Download file
-    response = requests.get(url=geonames_url, stream=True, verify=False)
-    with open(geonames_downloaded_file, "wb") as file:
-        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            file.write(chunk)
-    # Extract file
-    with ZipFile(geonames_downloaded_file, "r") as file:
-        file.extractall(geonames_unzipped_folder)
-
-    # Read file
-    df = pd.read_csv(
-        geonames_unzipped_file,
-        sep="\t",
-        encoding="utf-8",
-        dtype=str,
-        header=None,
-        usecols=[COL_GEO_ID, COL_FEAT_CLASS, COL_GEO_DEP],
-    ).set_index(COL_GEO_ID)
+    # Download file, if it has changed
+    geonames_downloaded_file = download(url=geonames_url, name=f"geonames_{country}", verify=False)
+
+    # Read file, from the zip file
+    with ZipFile(geonames_downloaded_file, "r") as zip_file:
+        with zip_file.open(f"{country}.txt", "r") as file:
+            df = pd.read_csv(
+                file,
+                sep="\t",
+                encoding="utf-8",
+                dtype=str,
+                header=None,
+                usecols=[COL_GEO_ID, COL_FEAT_CLASS, COL_GEO_DEP],
+            ).set_index(COL_GEO_ID)
 
     # Filter by feature class P = City, Village, ...
     df = df[df[COL_FEAT_CLASS] == "P"]
@@ -220,9 +300,7 @@ def download_geonames_data(country: str) -> dict:
 
     # Clean data
     data = df[COL_GEO_DEP].dropna().to_dict()
-
-    os.remove(path=geonames_downloaded_file)
-    shutil.rmtree(path=geonames_unzipped_folder)
+    load_inputs_cache.set(f"geonames_{country}", data)
 
     return data
 
@@ -234,12 +312,10 @@ def geonames_french_departments() -> dict:
         data: dict(geoname_id: department code)
     """
 
-    # France, Guadeloupe, Martinique, Guyane, Reunion, Mayotte
-    french_codes = ["FR", "GP", "MQ", "GF", "RE", "YT"]
-    logger.debug(f"Start download of geonames for countries {french_codes}")
+    logger.debug(f"Start download of geonames for countries {GEONAMES_FRENCH_CODES}")
 
     data = {}
-    for code in french_codes:
+    for code in GEONAMES_FRENCH_CODES:
         try:
             current_data = download_geonames_data(country=code)
             data.update(current_data)
@@ -250,22 +326,19 @@ def geonames_french_departments() -> dict:
 
 
 def download_insee_data() -> list:
-    insee_downloaded_file = 'insee_data_dump.zip'
-    insee_unzipped_folder = mkdtemp()
-    response = requests.get(url=ZONE_EMPLOI_INSEE_DUMP, stream=True, verify=False)
-    with open(insee_downloaded_file, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            file.write(chunk)
-    with ZipFile(insee_downloaded_file, 'r') as file:
-        file.extractall(insee_unzipped_folder)
+    data = load_inputs_cache.get('insee_zone_emploi')
+    if data is not None:
+        return data
+    insee_downloaded_file = download(url=ZONE_EMPLOI_INSEE_DUMP, name='insee_zone_emploi', verify=False)
+    with ZipFile(insee_downloaded_file, 'r') as zip_file:
+        workbook = io.BytesIO(zip_file.read("ZE2020_au_01-01-2024.xlsx"))
     data = pd.read_excel(
-        f"{insee_unzipped_folder}/ZE2020_au_01-01-2024.xlsx",
+        workbook,
         sheet_name="Composition_communale",
         engine="calamine",
         skiprows=5,
     ).to_dict(orient="records")
-    os.remove(path=insee_downloaded_file)
-    shutil.rmtree(path=insee_unzipped_folder)
+    load_inputs_cache.set('insee_zone_emploi', data)
     return data
 
 
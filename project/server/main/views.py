@@ -5,7 +5,9 @@ import redis
 from flask import Blueprint, current_app, jsonify, render_template, request
 from rq import Connection, Queue
 
+from project.server.main.cache import percolation_cache
 from project.server.main.logger import get_logger
+from project.server.main.matcher import percolation_stats
 from project.server.main.tasks import create_task_enrich_filter, create_task_affiliations_list,\
     create_task_load, create_task_match
 
@@ -27,6 +29,16 @@ def run_task_load():
     return jsonify(response_object), 202
 
 
+@main_blueprint.route('/percolation_cache', methods=['GET'])
+def get_percolation_cache_stats():
+    return jsonify(percolation_cache.stats()), 200
+
+
+@main_blueprint.route('/percolation_stats', methods=['GET'])
+def get_percolation_stats():
+    return jsonify(percolation_stats.stats()), 200
+
+
 @main_blueprint.route('/match', methods=['POST'])
 def run_task_match():
     if request.files.get('file') is None:
@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import math
+
+from project.server.main.config import VOCABULARY_FALSE_POSITIVE_RATE
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Maximum number of characters analyzed by a single _analyze request, far below its default limit of 10000 tokens
+ANALYZE_MAX_CHARACTERS = 5000
+
+
+class BloomFilter:
+    """Set of tokens without false negatives, and with about false_positive_rate false positives."""
+
+    def __init__(self, size: int, nb_hashes: int, bits: bytearray = None) -> None:
+        self.size = size
+        self.nb_hashes = nb_hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def from_tokens(cls, tokens: set, false_positive_rate: float = VOCABULARY_FALSE_POSITIVE_RATE) -> 'BloomFilter':
+        nb_tokens = max(len(tokens), 1)
+        size = max(64, math.ceil(-nb_tokens * math.log(false_positive_rate) / math.log(2) ** 2))
+        nb_hashes = max(1, round(size / nb_tokens * math.log(2)))
+        bloom_filter = cls(size=size, nb_hashes=nb_hashes)
+        for token in tokens:
+            bloom_filter.add(token)
+        return bloom_filter
+
+    def get_positions(self, token: str) -> list:
+        # Double hashing, the nb_hashes positions being derived from the two halves of a single digest
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+        hash_1, hash_2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(hash_1 + i * hash_2) % self.size for i in range(self.nb_hashes)]
+
+    def add(self, token: str) -> None:
+        for position in self.get_positions(token):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, token: str) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.get_positions(token))
+
+    def to_dict(self) -> dict:
+        return {'size': self.size, 'nb_hashes': self.nb_hashes, 'bits': base64.b64encode(self.bits).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BloomFilter':
+        return cls(size=data['size'], nb_hashes=data['nb_hashes'], bits=bytearray(base64.b64decode(data['bits'])))
+
+
+def get_percolator_text(query: dict):
+    """(analyzer, text) of a match or match_phrase percolator on the content, None for any other percolator."""
+    if not isinstance(query, dict) or len(query) != 1:
+        return None
+    query_type, query_fields = list(query.items())[0]
+    if query_type not in ['match', 'match_phrase'] or not isinstance(query_fields, dict) \
+            or list(query_fields.keys()) != ['content']:
+        return None
+    content = query_fields['content']
+    if not isinstance(content, dict) or not isinstance(content.get('query'), str) or not content.get('analyzer'):
+        return None
+    return content['analyzer'], content['query']
+
+
+def get_analyzed_tokens(es, index: str, analyzer: str, texts: list) -> set:
+    tokens = set()
+    chunk = []
+    nb_characters = 0
+    for text in texts + [None]:
+        if text is None or (chunk and nb_characters + len(text) > ANALYZE_MAX_CHARACTERS):
+            if chunk:
+                response = es.indices.analyze(index=index, body={'analyzer': analyzer, 'text': chunk})
+                tokens.update([token['token'] for token in response.get('tokens', [])])
+            chunk = []
+            nb_characters = 0
+        if text is not None:
+            chunk.append(text)
+            nb_characters += len(text)
+    return tokens
+
+
+def get_vocabulary_actions(es, actions: list, index: str, index_prefix: str) -> list:
+    """One document per criterion index of the percolators actions, holding the Bloom filter of the tokens of all its
+    percolators, analyzed as the criterion queries will be. A criterion whose percolators are not all match or
+    match_phrase queries, with the same analyzer, gets no vocabulary and is never skipped."""
+    texts_by_index = {}
+    for action in actions:
+        if 'query' not in action:
+            continue
+        percolator_index = action['_index']
+        percolator_text = get_percolator_text(action['query'])
+        if percolator_index not in texts_by_index:
+            texts_by_index[percolator_index] = {'analyzers': set(), 'texts': set()}
+        if percolator_text is None:
+            texts_by_index[percolator_index]['analyzers'].add(None)
+            continue
+        analyzer, text = percolator_text
+        texts_by_index[percolator_index]['analyzers'].add(analyzer)
+        texts_by_index[percolator_index]['texts'].add(text)
+    vocabulary_actions = []
+    for percolator_index, percolators in texts_by_index.items():
+        # ex: matcher-20240101000000_ror_name -> ror_name
+        criterion = percolator_index[len(index_prefix) + 1:]
+        if len(percolators['analyzers']) != 1 or None in percolators['analyzers']:
+            logger.debug(f'No vocabulary for {percolator_index}, analyzed by {percolators["analyzers"]}')
+            continue
+        analyzer = list(percolators['analyzers'])[0]
+        tokens = get_analyzed_tokens(es=es, index=percolator_index, analyzer=analyzer,
+                                     texts=sorted(percolators['texts']))
+        logger.debug(f'Vocabulary of {len(tokens)} tokens for {percolator_index}')
+        vocabulary_actions.append({'_index': index, '_id': criterion, 'criterion': criterion, 'analyzer': analyzer,
+                                   'nb_tokens': len(tokens), **BloomFilter.from_tokens(tokens).to_dict()})
+    return vocabulary_actions
+
+
+def get_vocabularies(es, index: str) -> dict:
+    """Analyzer and Bloom filter of each criterion of a vocabulary index, keyed by criterion."""
+    response = es.search(index=index, body={'query': {'match_all': {}}, 'size': 1000}, ignore=404)
+    vocabularies = {}
+    for hit in response.get('hits', {}).get('hits', []):
+        vocabulary = hit.get('_source', {})
+        vocabularies[vocabulary['criterion']] = {'analyzer': vocabulary['analyzer'],
+                                                 'bloom_filter': BloomFilter.from_dict(vocabulary)}
+    return vocabularies
+
+
+def can_match(vocabulary: dict, tokens: list) -> bool:
+    return any(token in vocabulary['bloom_filter'] for token in tokens)
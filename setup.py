@@ -16,20 +16,21 @@ setup(
     author='Eric Jeangirard, Anne L\'Hôte',
     author_email='eric.jeangirard@recherche.gouv.fr, anne.lhote@enseignementsup.gouv.fr',
     keywords=['research', 'matching', 'affiliation'],
-    python_requires='>=3.6',
+    python_requires='>=3.9',
     packages=find_packages(),
     package_data={'': ['*.json']},
     test_suite='pytest',
     install_requires=[
-        'beautifulsoup4==4.8.2',
+        'aiohttp==3.14.5',
+        'asgiref==3.12.1',
         'elasticsearch==7.8.0',
         'elasticsearch-dsl==7.2.1',
         'Flask==1.1.1',
         'Flask-Bootstrap==3.3.7.1',
         'geopy==2.1.0',
-        'lxml==4.9.1',
         'pandas==0.25.3',
         'pycountry==20.7.3',
+        'rapidfuzz==3.14.6',
         'redis==3.3.11',
         'requests==2.20.0',
         'rq==1.1.0',
@@ -53,9 +54,7 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
-        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         'Topic :: Education',
         'Topic :: Scientific/Engineering',
         'Topic :: Scientific/Engineering :: Information Analysis'
@@ -0,0 +1,43 @@
+import time
+
+from project.server.main.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_get_set(self) -> None:
+        cache = LRUCache(maxsize=2, ttl=60)
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['size'] == 1
+
+    def test_maxsize(self) -> None:
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # 'a' is now the most recently used entry, so 'b' is evicted
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl(self) -> None:
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert cache.stats()['size'] == 0
+
+    def test_invalidate(self) -> None:
+        cache = LRUCache(maxsize=10, ttl=60)
+        cache.set(('matcher_ror_city', 'matcher-20240101_ror_city', 'rors', 'paris'), [])
+        cache.set(('matcher_ror_country', 'matcher-20240101_ror_country', 'rors', 'france'), [])
+        assert cache.invalidate(lambda key: key[0] == 'matcher_ror_city') == 1
+        assert cache.get(('matcher_ror_city', 'matcher-20240101_ror_city', 'rors', 'paris')) is None
+        assert cache.get(('matcher_ror_country', 'matcher-20240101_ror_country', 'rors', 'france')) == []
+        assert cache.invalidate() == 1
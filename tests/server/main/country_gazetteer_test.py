@@ -0,0 +1,56 @@
+import pytest
+
+from project.server.main.country_gazetteer import CITY_SYNONYMS, CountryGazetteer, get_tokens, TokenTrie
+
+
+@pytest.fixture(scope='module')
+def gazetteer() -> CountryGazetteer:
+    gazetteer = CountryGazetteer()
+    for name, alpha2 in [('France', 'fr'), ('United States', 'us'), ('USA', 'us'), ('Georgia', 'ge'),
+                         ('Guinea', 'gn'), ('Papua New Guinea', 'pg'), ('United Kingdom', 'gb'), ('UK', 'gb'),
+                         ("Côte d'Ivoire", 'ci')]:
+        gazetteer.add(kind='name', text=name, countries=[alpha2])
+    for alpha3, alpha2 in [('fra', 'fr'), ('usa', 'us'), ('can', 'ca'), ('gbr', 'gb')]:
+        gazetteer.add(kind='alpha3', text=alpha3, countries=[alpha2])
+    for city, alpha2 in [('Paris', 'fr'), ('Paris', 'us'), ('Athens', 'us'), ('Athens', 'gr'), ('Toronto', 'ca'),
+                         ('Saint John', 'ca')]:
+        gazetteer.add(kind='city', text=city, countries=[alpha2])
+    return gazetteer
+
+
+class TestCountryGazetteer:
+    def test_get_tokens(self) -> None:
+        assert get_tokens("Université de Côte d'Ivoire") == ['universite', 'de', 'cote', 'ivoire']
+        # The synonyms of the city_analyzer
+        assert get_tokens('St John, NewYork', synonyms=CITY_SYNONYMS) == ['saint', 'john', 'new', 'york']
+
+    def test_token_trie(self) -> None:
+        trie = TokenTrie()
+        trie.add(['new', 'york'], 'us')
+        trie.add(['york'], 'gb')
+        assert trie.find(['university', 'of', 'new', 'york']) == {'us', 'gb'}
+        assert trie.find(['york', 'new']) == {'gb'}
+        assert trie.find_loose(['york', 'new']) == {'us', 'gb'}
+        assert trie.find([]) == set()
+
+    @pytest.mark.parametrize(
+        'query,expected_country', [
+            ('Université Paris Cité, Paris, France', 'fr'),
+            ('Dept of Physics, MIT, Cambridge, MA, USA', 'us'),
+            ("Université Félix Houphouët-Boigny, Côte d'Ivoire", 'ci'),
+            # Several countries
+            ('University of Georgia, Athens, GA, USA', None),
+            ('Papua New Guinea', None),
+            # Sloppy phrase of another country
+            ('United Nations University, Kingdom of Spain, France', None),
+            # City and alpha3 code of another country, matched by a previous strategy
+            ('University of Toronto, Toronto, CAN, France', None),
+            # Synonyms of the cities, matched as by their city_analyzer
+            ('St John, CAN, France', None),
+            # Codes and ids
+            ('CNRS UMR 5123, Paris, France', None),
+            ('Nowhere', None),
+            ('', None)
+        ])
+    def test_get_country(self, gazetteer, query, expected_country) -> None:
+        assert gazetteer.get_country(query) == expected_country
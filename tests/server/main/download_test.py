@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+import pytest
+
+from project.server.main.download import download, DownloadError, get_paths
+
+URL = 'https://example.org/dump.zip'
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class TestDownload:
+    def test_download_conditional(self, tmp_path, requests_mock) -> None:
+        requests_mock.get(URL, [
+            {'content': b'first', 'headers': {'ETag': '"v1"', 'Content-Length': '5'}},
+            {'status_code': 304},
+            {'content': b'second', 'headers': {'ETag': '"v2"'}}
+        ])
+        first_path = download(url=URL, directory=str(tmp_path))
+        assert read(first_path) == b'first'
+        assert os.path.basename(first_path) == hashlib.sha256(b'first').hexdigest()
+        assert download(url=URL, directory=str(tmp_path)) == first_path
+        assert requests_mock.request_history[1].headers['If-None-Match'] == '"v1"'
+        second_path = download(url=URL, directory=str(tmp_path))
+        assert read(second_path) == b'second'
+        # The previous artifact is not referenced anymore
+        assert not os.path.exists(first_path)
+
+    def test_download_offline(self, tmp_path, requests_mock) -> None:
+        with pytest.raises(DownloadError):
+            download(url=URL, name='dump', directory=str(tmp_path), offline=True)
+        requests_mock.get(URL, [{'content': b'first'}, {'status_code': 500}])
+        path = download(url=URL, name='dump', directory=str(tmp_path))
+        # The last good artifact is used offline, or if the download fails
+        assert download(url=None, name='dump', directory=str(tmp_path), offline=True) == path
+        assert download(url=URL, name='dump', directory=str(tmp_path)) == path
+        assert requests_mock.call_count == 2
+
+    def test_download_resume(self, tmp_path, requests_mock) -> None:
+        paths = get_paths(name=URL, directory=str(tmp_path))
+        with open(paths['partial'], 'wb') as file:
+            file.write(b'abc')
+        with open(paths['partial_metadata'], 'w') as file:
+            json.dump({'url': URL, 'etag': '"v1"'}, file)
+        requests_mock.get(URL, status_code=206, content=b'def', headers={'Content-Range': 'bytes 3-5/6'})
+        path = download(url=URL, directory=str(tmp_path))
+        assert read(path) == b'abcdef'
+        assert requests_mock.last_request.headers['Range'] == 'bytes=3-'
+        assert requests_mock.last_request.headers['If-Range'] == '"v1"'
+        assert not os.path.exists(paths['partial'])
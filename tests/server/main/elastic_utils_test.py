@@ -1,4 +1,5 @@
-from project.server.main.elastic_utils import get_index_name
+from project.server.main.elastic_utils import add_document_fingerprint, get_document_id, get_entities_actions, \
+    get_index_name, get_synonyms
 
 
 class TestElasticUtils:
@@ -7,3 +8,33 @@ class TestElasticUtils:
         assert result_without_prefix == 'source_index'
         result_with_prefix = get_index_name(index_name='index', source='source', index_prefix='test')
         assert result_with_prefix == 'test_source_index'
+
+    def test_get_entities_actions(self) -> None:
+        data = [{'id': 'grid.1', 'name': ['Cambridge University'], 'city': 'Cambridge', 'region': ['England']},
+                {'id': 'grid.2', 'name': ['Paris University'], 'city': None}]
+        actions = get_entities_actions(data=data, index='test_grid_entities', fields=['name', 'city', 'country'])
+        assert actions == [
+            {'_index': 'test_grid_entities', '_id': 'grid.1', 'id': 'grid.1', 'name': ['Cambridge University'],
+             'city': ['Cambridge'], 'country': [], 'name_normalized': ['cambridge university']},
+            {'_index': 'test_grid_entities', '_id': 'grid.2', 'id': 'grid.2', 'name': ['Paris University'],
+             'city': [], 'country': [], 'name_normalized': ['paris university']}
+        ]
+
+    def test_add_document_fingerprint(self) -> None:
+        query = {'match_phrase': {'content': {'query': 'paris', 'analyzer': 'light', 'slop': 0}}}
+        action = add_document_fingerprint({'_index': 'matcher-20230101000000_ror_city', 'rors': ['a', 'b'],
+                                           'query': query})
+        # The id only depends on the criterion and the value, whatever the index prefix
+        assert action['_id'] == get_document_id({'_index': 'matcher_ror_city', 'query': query})
+        assert action['_id'] != get_document_id({'_index': 'matcher_grid_city', 'query': query})
+        assert get_document_id({'_index': 'matcher_ror_entities', '_id': 'ror.1'}) == 'ror.1'
+        # The fingerprint does not depend on the order of the ids, but on their values
+        assert add_document_fingerprint({'_index': 'matcher_ror_city', 'rors': ['b', 'a'], 'query': query}) == \
+            {**action, '_index': 'matcher_ror_city', 'rors': ['b', 'a']}
+        assert add_document_fingerprint({'_index': 'matcher_ror_city', 'rors': ['a'], 'query': query})['fingerprint'] \
+            != action['fingerprint']
+
+    def test_get_synonyms(self) -> None:
+        synonyms = get_synonyms('common_synonym')
+        assert synonyms['st'] == ['saint']
+        assert synonyms['newyork'] == ['new', 'york']
@@ -0,0 +1,36 @@
+import gc
+
+from project.server.main.id_interner import IdInterner
+from project.server.main.matcher import get_percolation_ids
+
+
+class TestIdInterner:
+    def test_intern_lookup(self) -> None:
+        table = IdInterner().get_table(('rors', 'matcher-20240101_ror_id'))
+        ids_01 = table.intern(['03b', '01a', '02c'])
+        ids_02 = table.intern(['02c', '04d'])
+        assert len(table.values) == 4
+        assert table.lookup(ids_01 & ids_02) == ['02c']
+        assert table.lookup(ids_01 | ids_02) == ['01a', '02c', '03b', '04d']
+
+    def test_table_lifetime(self) -> None:
+        interner = IdInterner()
+        table = interner.get_table('v1')
+        assert interner.get_table('v1') is table
+        percolation = {'hits': [{'_source': {'rors': ['ror-A']}}], 'ids': {}}
+        assert table.lookup(get_percolation_ids(percolation=percolation, field='rors', id_table=table)) == ['ror-A']
+        # The table is kept alive by the integers of the cached percolation
+        del table
+        gc.collect()
+        table = interner.get_table('v1')
+        assert table.lookup(percolation['ids'][table]) == ['ror-A']
+        # Once unused, the table is evicted then recreated empty, without decoding the integers of the evicted one
+        del table, percolation
+        gc.collect()
+        table = interner.get_table('v1')
+        assert table.values == []
+        percolation_01 = {'hits': [{'_source': {'rors': ['ror-Z', 'ror-A']}}], 'ids': {}}
+        percolation_02 = {'hits': [{'_source': {'rors': ['ror-A']}}], 'ids': {}}
+        ids_01 = get_percolation_ids(percolation=percolation_01, field='rors', id_table=table)
+        ids_02 = get_percolation_ids(percolation=percolation_02, field='rors', id_table=table)
+        assert table.lookup(ids_01 & ids_02) == ['ror-A']
@@ -1,4 +1,6 @@
-from project.server.main.load_grid import load_grid
+import pytest
+
+from project.server.main.load_grid import get_ancestors_closure, load_grid
 from project.server.main.my_elastic import MyElastic
 
 
@@ -12,3 +14,16 @@ class TestLoadGrid:
                                                                                 'document': {'content': 'Paris'}}}})
         assert len(paris['hits']['hits'][0]['_source']['country_alpha2']) == 3
         es.delete_index(index='test_grid_*')
+
+    @pytest.mark.parametrize(
+        'parents,expected_closure', [
+            ({'a': ['b'], 'b': ['c', 'd'], 'c': ['d'], 'd': []}, {'a': ['b', 'c', 'd'], 'b': ['c', 'd'], 'c': ['d'],
+                                                                  'd': []}),
+            # Parent unknown to the mapping
+            ({'a': ['b'], 'b': ['e']}, {'a': ['b', 'e'], 'b': ['e']}),
+            # Cycle
+            ({'a': ['b'], 'b': ['a']}, {'a': ['b'], 'b': ['a']})
+        ]
+    )
+    def test_get_ancestors_closure(self, parents, expected_closure) -> None:
+        assert get_ancestors_closure(parents) == expected_closure
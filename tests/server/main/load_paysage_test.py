@@ -0,0 +1,13 @@
+from project.server.main.load_paysage import get_categories
+
+
+class TestLoadPaysage:
+    def test_get_categories(self) -> None:
+        record = {
+            'resourceId': 'abcde',
+            'relatedObjectId': ['mCpLW', 'xxxxx', 'mCpLW'],
+            'relatedObject': [{'displayName': 'Université', 'priority': 1}, {'displayName': 'Other', 'priority': 2},
+                              {'displayName': 'Université', 'priority': 1}]
+        }
+        assert get_categories(record) == [{'id': 'mCpLW', 'label': 'Université', 'priority': 1}]
+        assert get_categories({'resourceId': 'abcde'}) == []
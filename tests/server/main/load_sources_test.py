@@ -0,0 +1,61 @@
+import pytest
+
+from project.server.main import load_sources as load_sources_module
+from project.server.main.load_sources import load_sources
+
+
+def load_ok(index_prefix: str, incremental: bool) -> dict:
+    return {f'{index_prefix}_ok_name': 2}
+
+
+def load_empty(index_prefix: str, incremental: bool) -> dict:
+    return {}
+
+
+def load_ko(index_prefix: str, incremental: bool) -> dict:
+    raise ValueError('ko')
+
+
+class FakeIndices:
+    def __init__(self) -> None:
+        self.deleted = []
+
+    def get(self, index: str) -> dict:
+        return {index.replace('*', 'name'): {}}
+
+    def delete(self, index: str, ignore: list = None) -> None:
+        self.deleted.append(index)
+
+
+class FakeElastic:
+    def __init__(self) -> None:
+        self.indices = FakeIndices()
+        self.aliases = {}
+        self.finalized = []
+
+    def delete_non_dated_indices(self, index_prefix: str) -> None:
+        pass
+
+    def finalize_index(self, index: str) -> None:
+        self.finalized.append(index)
+
+    def update_index_alias(self, my_alias: str, new_index: str) -> None:
+        self.aliases[my_alias] = new_index
+
+
+class TestLoadSources:
+    @pytest.mark.parametrize('workers', [1, 3])
+    def test_load_sources(self, monkeypatch, workers) -> None:
+        es = FakeElastic()
+        monkeypatch.setattr(load_sources_module, 'get_elastic', lambda: es)
+        monkeypatch.setattr(load_sources_module, 'LOADERS', {'ok': load_ok, 'empty': load_empty, 'ko': load_ko})
+        result = load_sources(sources=['ok', 'empty', 'ko'], index_prefix='test', workers=workers)
+        assert result['sources']['ok']['status'] == 'loaded'
+        assert result['sources']['empty'] == {'status': 'failed', 'duration': result['sources']['empty']['duration'],
+                                              'error': 'No data loaded'}
+        assert result['sources']['ko']['error'] == "ValueError('ko')"
+        # Only the aliases of the source loaded are moved, the indices of the other ones are deleted
+        assert list(es.aliases.keys()) == ['test_ok_name']
+        assert es.finalized == [es.aliases['test_ok_name'].replace('_name', '_*')]
+        assert result[es.aliases['test_ok_name']] == 2
+        assert sorted(index.split('_')[1] for index in es.indices.deleted) == ['empty', 'ko']
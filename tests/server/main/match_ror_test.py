@@ -32,6 +32,16 @@ class TestMatchRor:
         assert results == expected_results
         assert expected_logs in response['logs']
 
+    @pytest.mark.parametrize('speculative_groups', [1, 2, 5])
+    def test_match_ror_speculative_groups(self, elasticsearch, speculative_groups) -> None:
+        strategies = [[['ror_id']], [['ror_name', 'ror_country']], [['ror_name']], [['ror_grid_id']]]
+        args = {'index_prefix': elasticsearch['index_prefix'], 'strategies': strategies,
+                'query': 'institut pasteur shanghai china'}
+        expected_response = match_ror(conditions=args)
+        response = match_ror(conditions={**args, 'speculative_groups': speculative_groups})
+        assert response['results'] == expected_response['results']
+        assert response['debug']['strategies'] == expected_response['debug']['strategies']
+
     def test_precision_recall(self, elasticsearch) -> None:
         precision_recall = compute_precision_recall(match_type='ror', index_prefix=elasticsearch['index_prefix'])
         assert precision_recall['precision'] >= 0.88
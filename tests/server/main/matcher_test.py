@@ -1,9 +1,39 @@
 import pytest
+import time
 
-from project.server.main.matcher import filter_submatching_results_by_all, filter_submatching_results_by_criterion
+from elasticsearch.exceptions import ConnectionTimeout
+
+from project.server.main.cache import percolation_cache
+from project.server.main.matcher import deadline_steps, DeadlineExceeded, filter_submatching_results_by_all, \
+    filter_submatching_results_by_criterion, gather_steps, get_criterion_rank, \
+    get_hits_by_document_response, get_similar_results, identity, Matcher, MatcherType, new_percolation, page_percolation_steps, \
+    set_shared_percolation
 
 
 class TestMatcher:
+    @pytest.mark.parametrize(
+        'strategy,expected_strategy', [
+            (['grid_name', 'grid_country', 'grid_acronym'], ['grid_acronym', 'grid_name', 'grid_country']),
+            (['rnsr_city', 'rnsr_code_number', 'rnsr_supervisor_name'],
+             ['rnsr_code_number', 'rnsr_supervisor_name', 'rnsr_city']),
+            (['ror_unknown', 'ror_country', 'ror_id'], ['ror_id', 'ror_country', 'ror_unknown'])
+        ])
+    def test_get_criterion_rank(self, strategy, expected_strategy) -> None:
+        assert sorted(strategy, key=get_criterion_rank) == expected_strategy
+
+    @pytest.mark.parametrize(
+        'input_name,potential_results,expected_results', [
+            ('Université Paris Cité', [('id1', ['cite paris universite']), ('id2', ['lyon universite'])], ['id1']),
+            ('University of Paris', [('id1', ['lyon university']), ('id2', ['of paris universities', 'paris'])],
+             ['id2']),
+            ('Sorbonne', [('id1', [])], []),
+            ('', [('id1', ['']), ('id2', ['paris'])], ['id1'])
+        ])
+    def test_get_similar_results(self, input_name, potential_results, expected_results) -> None:
+        results = get_similar_results(input_name=input_name, potential_results=potential_results,
+                                      pre_treatment_query=identity)
+        assert results == expected_results
+
     @pytest.mark.parametrize(
         'highlights,results,expected_results', [
             ({
@@ -94,3 +124,154 @@ class TestMatcher:
         results2 = filter_submatching_results_by_all(res=res)
         assert len(results2['results']) == len(expected_results)
         assert results2['results'][0] == expected_results[0]
+
+    @pytest.mark.parametrize('nb_hits,size,max_hits,expected_nb_hits,expected_nb_pages', [
+        (25, 10, 100, 25, 3),
+        (20, 10, 100, 20, 3),
+        (25, 10, 15, 15, 2),
+        (0, 10, 100, 0, 1)
+    ])
+    def test_page_percolation_steps(self, nb_hits, size, max_hits, expected_nb_hits, expected_nb_pages) -> None:
+        all_hits = [{'_source': {'rors': [f'ror{i}']}, 'sort': [i]} for i in range(nb_hits)]
+        steps = page_percolation_steps(index='matcher_ror_city', criterion_query='paris', candidates=None,
+                                       highlight=False, field='rors', size=size, max_hits=max_hits)
+        operations = next(steps)
+        assert operations == [('open_point_in_time', {'index': 'matcher_ror_city'})]
+        operations = steps.send(['pit-1'])
+        nb_pages = 0
+        while operations[0][0] == 'search_point_in_time':
+            body = operations[0][1]['body']
+            assert body['pit']['id'] == 'pit-1'
+            after = body.get('search_after', [-1])[0]
+            nb_pages += 1
+            page = all_hits[after + 1:after + 1 + body['size']]
+            operations = steps.send([{'pit_id': 'pit-1', 'hits': {'hits': page}}])
+        assert operations == [('close_point_in_time', {'pit_id': 'pit-1'})]
+        with pytest.raises(StopIteration) as stop:
+            steps.send([None])
+        assert stop.value.value == all_hits[:expected_nb_hits]
+        assert nb_pages == expected_nb_pages
+
+    def test_page_percolation_steps_deadline(self) -> None:
+        steps = page_percolation_steps(index='matcher_ror_city', criterion_query='paris', candidates=None,
+                                       highlight=False, field='rors', size=10, max_hits=100)
+        next(steps)
+        [(name, _)] = steps.send(['pit-1'])
+        assert name == 'search_point_in_time'
+        # The point in time is closed before the exception is raised
+        assert steps.throw(DeadlineExceeded()) == [('close_point_in_time', {'pit_id': 'pit-1'})]
+        with pytest.raises(DeadlineExceeded):
+            steps.send([None])
+
+    def test_gather_steps(self) -> None:
+        def steps(name: str, nb_steps: int):
+            results = []
+            for step in range(nb_steps):
+                [result] = yield [(name, {'step': step})]
+                results.append(result)
+            return results
+        gathered = gather_steps([steps('a', 2), steps('b', 0), steps('c', 1)])
+        assert next(gathered) == [('a', {'step': 0}), ('c', {'step': 0})]
+        assert gathered.send(['a0', 'c0']) == [('a', {'step': 1})]
+        with pytest.raises(StopIteration) as stop:
+            gathered.send(['a1'])
+        assert stop.value.value == [['a0', 'a1'], [], ['c0']]
+        # An exception raised by one of the steps is thrown in the other ones before being raised
+        def failing_steps():
+            yield [('a', {})]
+            yield [('b', {})]
+            raise ValueError('b')
+        gathered = gather_steps([failing_steps(), page_percolation_steps(
+            index='test', criterion_query='paris', candidates=None, highlight=False, field='rors', size=10,
+            max_hits=100)])
+        assert [name for name, _ in next(gathered)] == ['a', 'open_point_in_time']
+        assert [name for name, _ in gathered.send([None, 'pit'])] == ['b', 'search_point_in_time']
+        page = {'hits': {'hits': [{'sort': [i]} for i in range(10)]}}
+        assert gathered.send([None, page]) == [('close_point_in_time', {'pit_id': 'pit'})]
+        with pytest.raises(ValueError):
+            gathered.send([None])
+
+    def test_deadline_steps(self) -> None:
+        def steps():
+            [pit_id] = yield [('open_point_in_time', {'index': 'test'})]
+            [response] = yield [('close_point_in_time', {'pit_id': pit_id})]
+            return response
+        with_deadline = deadline_steps(steps(), deadline=time.monotonic() + 60)
+        [(name, kwargs)] = next(with_deadline)
+        assert name == 'open_point_in_time' and 0 < kwargs['request_timeout'] <= 60
+        assert with_deadline.send(['pit']) == [('close_point_in_time', {'pit_id': 'pit'})]
+        with pytest.raises(StopIteration) as stop:
+            with_deadline.send(['closed'])
+        assert stop.value.value == 'closed'
+        with_deadline = deadline_steps(steps(), deadline=time.monotonic() + 60)
+        next(with_deadline)
+        with pytest.raises(DeadlineExceeded):
+            with_deadline.throw(ConnectionTimeout('TIMEOUT', 'timed out', None))
+        with pytest.raises(DeadlineExceeded):
+            next(deadline_steps(steps(), deadline=time.monotonic() - 1))
+        # The point in time being paged is closed outside the deadline
+        with_deadline = deadline_steps(gather_steps([page_percolation_steps(
+            index='test', criterion_query='paris', candidates=None, highlight=False, field='rors', size=10,
+            max_hits=100)]), deadline=time.monotonic() + 60)
+        next(with_deadline)
+        [(name, kwargs)] = with_deadline.send(['pit'])
+        assert name == 'search_point_in_time' and 'request_timeout' in kwargs
+        assert with_deadline.throw(ConnectionTimeout('TIMEOUT', 'timed out', None)) == \
+            [('close_point_in_time', {'pit_id': 'pit'})]
+        with pytest.raises(DeadlineExceeded):
+            with_deadline.send([None])
+
+    def test_get_hits_by_document_response(self) -> None:
+        hits = [{'_source': {'rors': ['ror1']}, 'fields': {'_percolator_document_slot': [0, 1]}}]
+        response = {'hits': {'total': {'value': 1, 'relation': 'eq'}, 'hits': hits}}
+        hits_by_document = get_hits_by_document_response(response=response, nb_documents=2)
+        assert [[hit['_source'] for hit in hits] for hits in hits_by_document] == [[{'rors': ['ror1']}]] * 2
+        # The truncated hits are not returned
+        for total in [{'value': 2, 'relation': 'eq'}, {'value': 1, 'relation': 'gte'}]:
+            assert get_hits_by_document_response(response={'hits': {'total': total, 'hits': hits}},
+                                                 nb_documents=2) is None
+
+    def test_prefetch_steps_truncated(self) -> None:
+        matcher = Matcher()
+        matcher.get_shared_cache_key = lambda index, field, criterion_query, highlight=True: \
+            ('test_prefetch_steps_truncated', index, field, criterion_query)
+        conditions_list = [{'city': city, 'index_prefix': 'test-truncated'} for city in ['a', 'b', 'c']]
+        cache = {}
+        steps = matcher.prefetch_steps(conditions_list=conditions_list, strategies_list=[[[['ror_city']]]] * 3,
+                                       pre_treatment_query=None, field='rors', stopwords_strategies=None, cache=cache)
+        [(_, kwargs)] = next(steps)
+        assert kwargs['criterion_queries'] == ['a', 'b', 'c']
+        # Too many hits: the documents are percolated again in two halves
+        operations = steps.send([None])
+        assert [kwargs['criterion_queries'] for _, kwargs in operations] == [['a'], ['b', 'c']]
+        with pytest.raises(StopIteration):
+            steps.send([None, [[{'_source': {'rors': ['ror-b']}}], []]])
+        # The truncated document is left to its match, and never cached
+        assert sorted(key[0].split(';')[-1] for key in cache) == ['b', 'c']
+
+    def test_set_shared_percolation(self) -> None:
+        hits = [{'_source': {'rors': ['ror1']}}]
+        set_shared_percolation(('test_set_shared_percolation', 'complete'), new_percolation(hits))
+        assert percolation_cache.get(('test_set_shared_percolation', 'complete'))['hits'] == hits
+        # Truncated by the hit budget of the request, ie. with MATCHER_HIT_MAX=0
+        set_shared_percolation(('test_set_shared_percolation', 'truncated'), new_percolation(hits, total=2))
+        assert percolation_cache.get(('test_set_shared_percolation', 'truncated')) is None
+
+    def test_enrich_results(self) -> None:
+        enriched = Matcher().enrich_results(['ror1', 'ror2'], 'ror', entities={'ror1': {'name': ['Inserm']}})
+        assert enriched == [{'id': 'ror1', 'name': ['Inserm'], 'acronym': [], 'city': [], 'country': []},
+                            {'id': 'ror2', 'name': [], 'acronym': [], 'city': [], 'country': []}]
+
+    def test_matcher_type(self) -> None:
+        matcher_type = MatcherType(method='rnsr', field='rnsrs', default_strategies=[[['rnsr_id']]],
+                                   stopwords_strategies={}, pre_treatment_query=str.lower, year_criterion='rnsr_year')
+        assert matcher_type.get_strategies({}) is matcher_type.default_plan
+        assert matcher_type.get_strategies({'year': '2020'}).groups == ((('rnsr_id', 'rnsr_year'),),)
+        assert matcher_type.get_strategies({'strategies': [[['rnsr_name']]]}).groups == ((('rnsr_name',),),)
+
+        class FakeMatcher:
+            def match(self, **kwargs) -> dict:
+                return kwargs
+        kwargs = matcher_type.match(conditions={'query': 'Inserm'}, matcher=FakeMatcher())
+        assert kwargs['strategies'] is matcher_type.default_plan
+        assert (kwargs['method'], kwargs['field'], kwargs['pre_treatment_query']) == ('rnsr', 'rnsrs', str.lower)
@@ -1,4 +1,10 @@
-from project.server.main.my_elastic import MyElastic
+import asyncio
+import pytest
+
+from elasticsearch import AsyncElasticsearch
+
+from project.server.main import my_elastic
+from project.server.main.my_elastic import close_async_elastic, get_async_elastic, get_elastic, MyElastic
 
 
 class TestMyElastic:
@@ -6,6 +12,79 @@ class TestMyElastic:
         es = MyElastic()
         assert type(es) == MyElastic
 
+    def test_get_elastic(self) -> None:
+        es = get_elastic()
+        assert type(es) == MyElastic
+        assert get_elastic() is es
+        assert get_elastic(timeout=5) is not es
+        assert get_elastic(timeout=5) is get_elastic(timeout=5)
+
+    def test_get_async_elastic(self) -> None:
+        async def get_clients() -> list:
+            clients = [get_async_elastic(), get_async_elastic()]
+            await close_async_elastic()
+            clients.append(get_async_elastic())
+            await close_async_elastic()
+            return clients
+        clients = asyncio.run(get_clients())
+        assert type(clients[0]) == AsyncElasticsearch
+        assert clients[1] is clients[0]
+        assert clients[2] is not clients[0]
+        assert asyncio.run(get_clients())[0] is not clients[0]
+
+    def test_get_delta_actions(self, monkeypatch) -> None:
+        es = MyElastic()
+        fingerprints = {'test_ror_name': {'kept': 'f1', 'changed': 'f2', 'removed': 'f3'}}
+        monkeypatch.setattr(es, 'get_fingerprints', lambda index: dict(fingerprints[index]))
+        settings = []
+        monkeypatch.setattr(es.indices, 'put_settings', lambda index, body: settings.append((index, body)))
+        actions = [{'_index': 'test_ror_name', '_id': document_id, 'fingerprint': fingerprint}
+                   for document_id, fingerprint in [('kept', 'f1'), ('changed', 'f4'), ('added', 'f5')]]
+        stats = {}
+        delta_actions = list(es.get_delta_actions(actions=actions, stats=stats))
+        assert delta_actions == actions[1:] + [{'_op_type': 'delete', '_index': 'test_ror_name', '_id': 'removed'}]
+        assert stats == {'test_ror_name': {'added': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1}}
+        # The live index is unblocked for writes
+        assert settings == [('test_ror_name', {'index': {'blocks.write': False}})]
+
+    def test_parallel_bulk_failure(self, monkeypatch) -> None:
+        es = MyElastic()
+        monkeypatch.setattr(es, 'get_fingerprints', lambda index: {})
+        settings = []
+        monkeypatch.setattr(es.indices, 'put_settings', lambda index, body: settings.append((index, body)))
+
+        def failing_bulk(client, actions, **kwargs):
+            next(iter(actions))
+            raise ConnectionError('bulk failed')
+        monkeypatch.setattr(my_elastic.helpers, 'parallel_bulk', failing_bulk)
+        with pytest.raises(ConnectionError):
+            es.parallel_bulk(actions=[{'_index': 'test_ror_name', 'name': 'Inserm'}], incremental=True)
+        # The live index unblocked by the delta is blocked again
+        assert settings == [('test_ror_name', {'index': {'blocks.write': False}}),
+                            ('test_ror_name', {'index': {'blocks.write': True}})]
+
+    def test_get_index_from_alias(self, monkeypatch) -> None:
+        es = MyElastic()
+        aliases = {'testalias-1_ror_id': {'testalias_ror_id'}, 'testalias-1_ror_city': {'testalias_ror_city'}}
+
+        def get_alias(name: str = None, index: str = None, ignore: int = None) -> dict:
+            return {idx: {'aliases': {alias: {} for alias in idx_aliases}} for idx, idx_aliases in aliases.items()
+                    if idx == index or name in idx_aliases or (name or '').endswith('*')}
+
+        def update_aliases(body: dict) -> None:
+            for action in body['actions']:
+                for operation, params in action.items():
+                    getattr(aliases[params['index']], operation.replace('remove', 'discard'))(params['alias'])
+        monkeypatch.setattr(es.indices, 'get_alias', get_alias)
+        monkeypatch.setattr(es.indices, 'update_aliases', update_aliases)
+        assert es.get_index_from_alias('testalias_ror_id') == 'testalias-1_ror_id'
+        assert es.get_index_from_alias('testalias_ror_*') == 'testalias-1_ror_city;testalias-1_ror_id'
+        # An incremental load changing only the city index renews the version of the source
+        es.update_index_generation(my_alias='testalias_ror_city')
+        assert es.get_index_from_alias('testalias_ror_id') == 'testalias-1_ror_id'
+        city_version, id_version = es.get_index_from_alias('testalias_ror_*').split(';')
+        assert city_version.startswith('testalias-1_ror_city@') and id_version == 'testalias-1_ror_id'
+
     def test_create_index(self) -> None:
         index = 'create'
         es = MyElastic()
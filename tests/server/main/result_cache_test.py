@@ -0,0 +1,23 @@
+from project.server.main.result_cache import get_index_version, get_result_cache_key
+
+
+class FakeElastic:
+    def __init__(self, date: str) -> None:
+        self.date = date
+
+    def get_index_from_alias(self, alias: str) -> str:
+        return alias.replace('matcher', f'matcher-{self.date}')
+
+
+class TestResultCache:
+    def test_get_index_version(self) -> None:
+        index_version = get_index_version(es=FakeElastic('20240101'), matcher_type='grid', index_prefix='matcher')
+        assert index_version == 'matcher-20240101_grid_*;matcher-20240101_ror_*'
+
+    def test_get_result_cache_key(self) -> None:
+        es = FakeElastic('20240101')
+        key = get_result_cache_key(es=es, conditions={'type': 'ror', 'query': 'Paris', 'verbose': False})
+        assert key == get_result_cache_key(es=es, conditions={'verbose': False, 'query': 'Paris', 'type': 'ROR'})
+        assert key != get_result_cache_key(es=es, conditions={'type': 'ror', 'query': 'Paris', 'verbose': True})
+        assert key != get_result_cache_key(es=FakeElastic('20240201'),
+                                           conditions={'type': 'ror', 'query': 'Paris', 'verbose': False})
@@ -0,0 +1,40 @@
+import pytest
+
+from project.server.main.strategies import compile_strategies
+
+
+class TestStrategies:
+    def test_compile_strategies(self) -> None:
+        strategies = [[['grid_name', 'grid_city', 'grid_country'], ['grid_name', 'grid_city']], [['grid_id']]]
+        plan = compile_strategies(strategies, {'grid_name': ['de']})
+        assert plan is compile_strategies([[list(s) for s in group] for group in strategies], {'grid_name': ['de']})
+        assert plan is not compile_strategies(strategies)
+        assert compile_strategies(plan) is plan
+        assert len(plan) == 2
+        assert plan.criteria == ('grid_name', 'grid_city', 'grid_country', 'grid_id')
+        assert plan.ranked_groups[0][0] == ('grid_name', 'grid_city', 'grid_country')
+        assert plan.groups_first_criteria == (('grid_name',), ('grid_id',))
+        assert plan.labels[0] == ('grid_name;grid_city;grid_country', 'grid_name;grid_city')
+        # Only the strategies without identifying criterion are expected to yield several results
+        assert plan.groups_highlighted == (True, False)
+
+    def test_with_criterion(self) -> None:
+        plan = compile_strategies([[['rnsr_name'], ['rnsr_acronym', 'rnsr_city']]])
+        plan_with_year = plan.with_criterion('rnsr_year')
+        assert plan_with_year.groups == ((('rnsr_name', 'rnsr_year'), ('rnsr_acronym', 'rnsr_city', 'rnsr_year')),)
+        assert plan_with_year is plan.with_criterion('rnsr_year')
+        assert plan_with_year is compile_strategies([[['rnsr_name', 'rnsr_year'],
+                                                      ['rnsr_acronym', 'rnsr_city', 'rnsr_year']]])
+
+    @pytest.mark.parametrize(
+        'criterion,conditions,stopwords_strategies,expected_query', [
+            ('grid_name', {'query': 'Université de Paris'}, {}, 'université de paris'),
+            ('grid_name', {'query': 'Université de Paris'}, {'grid_name': ['de']}, 'université paris'),
+            ('grid_city', {'query': 'Université de Paris', 'city': 'Lyon'}, {'grid_name': ['de']}, 'lyon'),
+            ('ror_supervisor_name', {'query': 'CNRS', 'supervisor_name': 'Inserm'}, {}, 'inserm')
+        ])
+    def test_get_criterion_query(self, criterion, conditions, stopwords_strategies, expected_query) -> None:
+        plan = compile_strategies([[[criterion]]], stopwords_strategies)
+        criterion_query = plan.get_criterion_query(criterion=criterion, conditions=conditions,
+                                                   pre_treatment_query=str.lower)
+        assert criterion_query == expected_query
@@ -1,7 +1,8 @@
+import io
 import pytest
 
-from project.server.main.utils import delete_punctuation, get_common_words, has_a_digit, \
-    normalize_text, remove_ref_index, strip_accents
+from project.server.main.utils import delete_punctuation, get_common_words, get_highlighted_tokens, has_a_digit, \
+    iter_json_array, normalize_text, remove_ref_index, strip_accents
 
 
 class TestUtils:
@@ -65,3 +66,27 @@ class TestUtils:
     def test_remove_ref_index(self, text, clean_text) -> None:
         result = remove_ref_index(query=text)
         assert result == clean_text
+
+    @pytest.mark.parametrize('highlights,tokens', [
+        ('Cambridge University', set()),
+        ('<em>Cambridge</em> <em>University</em>', {'Cambridge', 'University'}),
+        ('<em>R&amp;D</em> Center <em>R&amp;D</em>', {'R&D'}),
+        ([['<em>Medical</em> Center', '<em>Cambridge</em>'], ['<em>Medical</em>']], {'Cambridge', 'Medical'}),
+        ([], set())
+    ])
+    def test_get_highlighted_tokens(self, highlights, tokens) -> None:
+        assert get_highlighted_tokens(highlights) == tokens
+
+    @pytest.mark.parametrize('text,chunk_size,expected_elements', [
+        ('[]', 1, []),
+        (' [ {"id": "a", "names": ["b", "c"]} ,\n{"id": "d"}]\n', 1, [{'id': 'a', 'names': ['b', 'c']}, {'id': 'd'}]),
+        ('[12345, -1.5e3, "],", null, [true]]', 2, [12345, -1.5e3, '],', None, [True]]),
+        ('[{"id": "é"}]', 1024, [{'id': 'é'}])
+    ])
+    def test_iter_json_array(self, text: str, chunk_size: int, expected_elements: list) -> None:
+        assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == expected_elements
+
+    @pytest.mark.parametrize('text', ['', '{}', '[1, 2', '[1 2]'])
+    def test_iter_json_array_invalid(self, text: str) -> None:
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO(text), chunk_size=2))
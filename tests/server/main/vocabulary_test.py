@@ -0,0 +1,34 @@
+import pytest
+
+from project.server.main.vocabulary import BloomFilter, can_match, get_percolator_text
+
+
+class TestVocabulary:
+    def test_bloom_filter(self) -> None:
+        tokens = {f'token{i}' for i in range(1000)}
+        bloom_filter = BloomFilter.from_tokens(tokens, false_positive_rate=0.01)
+        # No false negative
+        assert all(token in bloom_filter for token in tokens)
+        false_positives = [token for token in [f'other{i}' for i in range(1000)] if token in bloom_filter]
+        assert len(false_positives) < 50
+
+    def test_bloom_filter_to_dict(self) -> None:
+        bloom_filter = BloomFilter.from_tokens({'paris', 'lyon'})
+        loaded_bloom_filter = BloomFilter.from_dict(bloom_filter.to_dict())
+        assert loaded_bloom_filter.bits == bloom_filter.bits
+        assert 'paris' in loaded_bloom_filter
+        assert can_match({'bloom_filter': loaded_bloom_filter}, ['university', 'lyon'])
+        assert not can_match({'bloom_filter': loaded_bloom_filter}, [])
+
+    @pytest.mark.parametrize(
+        'query,expected', [
+            ({'match_phrase': {'content': {'query': 'paris', 'analyzer': 'analyzer_city', 'slop': 0}}},
+             ('analyzer_city', 'paris')),
+            ({'match': {'content': {'query': 'paris', 'analyzer': 'analyzer_name'}}}, ('analyzer_name', 'paris')),
+            ({'match_phrase': {'content': {'query': 'paris'}}}, None),
+            ({'match_phrase': {'content': 'paris'}}, None),
+            ({'term': {'content': {'value': 'paris'}}}, None),
+            ({'bool': {'must': [{'match_phrase': {'content': {'query': 'paris', 'analyzer': 'x'}}}]}}, None)
+        ])
+    def test_get_percolator_text(self, query, expected) -> None:
+        assert get_percolator_text(query) == expected